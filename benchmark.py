@@ -0,0 +1,601 @@
+"""
+离线性能测试
+
+在本机启动模拟站点，按场景生成 RSS/Atom feed、文章网页和图片。数量、大小、延迟和错误率都可以配置。
+然后在临时目录中运行真实的生成流程（build_deliveries：拉取 feed、解析全文、下载转码图片、生成 EPUB），
+报告总耗时、各阶段耗时、内存峰值以及各阶段传输的字节数。
+所有请求都只发往本机，结果不受外部网站影响，可以用来比较修改前后或不同并发设置下的性能。
+
+用法:
+    python benchmark.py                          # 默认场景：10 个 feed × 20 篇文章 × 10 张图片
+    python benchmark.py -s smoke -s slow         # 依次运行多个场景
+    python benchmark.py --set image_concurrency=16 --set resolve_concurrency=16
+    python benchmark.py --warm --repeat 3 --json result.json
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+try:
+    import resource
+except ImportError:  # Windows 上没有 resource 模块，不报告 RSS 峰值
+    resource = None
+
+# 场景预设：站点规模、内容大小和网络状况
+DEFAULT_SCENARIO = {
+    'feeds': 10,  # feed 数量
+    'articles': 20,  # 每个 feed 的文章数量
+    'images': 10,  # 每篇文章的图片数量
+    'article_kb': 12,  # 每篇文章正文的大小（KB）
+    'image_width': 1600,  # 图片尺寸（像素），比 Kindle 屏幕宽才会触发缩放
+    'image_height': 1000,
+    'image_formats': ['jpeg', 'png', 'webp'],  # 依次循环使用的图片格式
+    'hosts': 2,  # feed 和网页分布在几个主机上（每个主机一个端口），图片另有一个主机
+    'feed_format': 'mixed',  # rss / atom / mixed（交替）
+    'resolve': 'mixed',  # selector / readability / none / mixed（交替），none 时正文放在 feed 中
+    'latency_ms': 20,  # 每个请求的固定延迟
+    'jitter_ms': 10,  # 额外的随机延迟
+    'error_rate': 0.0,  # 返回 503 的请求比例（客户端会重试）
+}
+
+SCENARIOS = {
+    'smoke': {'feeds': 2, 'articles': 5, 'images': 2},
+    'default': {},
+    'large': {'feeds': 30, 'articles': 30, 'hosts': 4},
+    'image-heavy': {'feeds': 5, 'articles': 20, 'images': 30, 'image_width': 2400, 'image_height': 1600},
+    'text-only': {'images': 0, 'article_kb': 40},
+    'slow': {'latency_ms': 200, 'jitter_ms': 300, 'error_rate': 0.05},
+}
+
+# 与 config.example.yaml 一致的典型设置，可以用 --set 覆盖
+BASE_SETTINGS = {
+    'max_history': 7,
+    'load_images': True,
+    'only_new': False,
+    'filename_template': 'benchmark_{year}{month}{day}_{hour}{minute}{second}.epub',
+    'image_max_width': 1072,
+    'image_max_kb': 300,
+}
+
+# 报告的流程阶段：(报告中的名称, 运行指标中的阶段名)
+STAGES = [
+    ('feed 拉取', 'fetch_feeds'),
+    ('全文解析', 'resolve_articles'),
+    ('图片下载', 'download_images'),
+    ('图片压缩', 'shrink_images'),
+    ('生成EPUB', 'build_epub'),
+]
+
+# 模拟站点的请求类型，与 http_client 的请求类型对应
+KINDS = ('feed', 'page', 'image')
+
+MEDIA_TYPES = {'jpeg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp', 'gif': 'image/gif'}
+
+TEXT_CHARS = ('的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说'
+              '产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本'
+              '去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但'
+              '质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设'
+              '及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据')
+
+
+class StubSite:
+    """本机模拟站点
+
+    每个主机是一个监听 127.0.0.1 随机端口的 ThreadingHTTPServer，
+    feed 和文章网页按 feed 分布在前几个主机上，图片统一放在最后一个主机（模拟 CDN）。
+    同一个场景多次运行时内容保持不变，feed 支持 ETag 条件请求。
+    """
+
+    def __init__(self, scenario=None, seed=0):
+        self.scenario = dict(DEFAULT_SCENARIO, **(scenario or {}))
+        self.seed = seed
+        self.now = datetime.now(timezone.utc).replace(microsecond=0)
+        self.servers = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._images = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {kind: {'requests': 0, 'bytes': 0, 'errors': 0, 'not_modified': 0} for kind in KINDS}
+
+    def start(self):
+        for fmt in self.scenario['image_formats']:
+            self._images[fmt] = make_image(self.scenario['image_width'], self.scenario['image_height'], fmt,
+                                           self.seed)
+        handler = type('StubHandler', (StubRequestHandler,), {'site': self})
+        for _ in range(max(1, int(self.scenario['hosts'])) + 1):
+            server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def _base_url(self, server):
+        return f'http://127.0.0.1:{server.server_address[1]}'
+
+    def feed_host(self, i):
+        return self._base_url(self.servers[i % (len(self.servers) - 1)])
+
+    def feed_url(self, i):
+        return f'{self.feed_host(i)}/feed/{i}'
+
+    def article_url(self, i, j):
+        return f'{self.feed_host(i)}/article/{i}/{j}'
+
+    def image_url(self, i, j, k):
+        formats = self.scenario['image_formats']
+        ext = formats[(i + j + k) % len(formats)]
+        return f'{self._base_url(self.servers[-1])}/img/{i}/{j}/{k}.{ext}'
+
+    def feed_format(self, i):
+        if self.scenario['feed_format'] == 'mixed':
+            return 'atom' if i % 2 else 'rss'
+        return self.scenario['feed_format']
+
+    def resolve_method(self, i):
+        if self.scenario['resolve'] == 'mixed':
+            return ('selector', 'readability', 'none')[i % 3]
+        return self.scenario['resolve']
+
+    def feeds_config(self):
+        """返回指向模拟站点的 Feeds 配置"""
+        feeds = []
+        for i in range(self.scenario['feeds']):
+            feed = {'url': self.feed_url(i), 'name': f'feed{i}', 'title': f'测试源 {i}', 'enabled': True}
+            method = self.resolve_method(i)
+            if method == 'selector':
+                feed['resolve_link'] = {
+                    'enabled': True,
+                    'method': 'selector',
+                    'selectors': {'content': 'article .post-content', 'remove': '.ads, .share, script'},
+                    'fallback': 'readability',
+                }
+            elif method == 'readability':
+                feed['resolve_link'] = {'enabled': True, 'method': 'readability'}
+            feeds.append(feed)
+        return feeds
+
+    def _paragraphs(self, i, j):
+        rnd = random.Random(f'{self.seed}/{i}/{j}')
+        # 每个汉字 UTF-8 编码为 3 字节，每段约 200 字
+        count = max(1, round(self.scenario['article_kb'] * 1024 / 600))
+        return [''.join(rnd.choice(TEXT_CHARS) for _ in range(200)) for _ in range(count)]
+
+    def article_body(self, i, j):
+        """文章正文：段落之间穿插图片"""
+        paragraphs = self._paragraphs(i, j)
+        images = self.scenario['images']
+        parts = []
+        for n, paragraph in enumerate(paragraphs):
+            parts.append(f'<p>{paragraph}</p>')
+            # 图片均匀分布在段落之后，段落比图片少时一段后面放多张
+            parts.extend(self._figure(i, j, k) for k in range(images) if k * len(paragraphs) // images == n)
+        return '\n'.join(parts)
+
+    def _figure(self, i, j, k):
+        return f'<figure><img src="{self.image_url(i, j, k)}" alt="图{k + 1}"><figcaption>图{k + 1}</figcaption></figure>'
+
+    def render_article(self, i, j):
+        return f'''<!DOCTYPE html>
+<html lang="zh"><head><meta charset="utf-8"><title>文章 {i}-{j}</title>
+<script>window.analytics = {{}};</script></head>
+<body>
+<header><nav><a href="/">首页</a> <a href="/about">关于</a></nav></header>
+<div class="ads">广告位招租</div>
+<article><h1>文章 {i}-{j}</h1>
+<div class="post-content">
+{self.article_body(i, j)}
+</div>
+<div class="share">分享到微博 微信</div>
+</article>
+<aside class="related"><ul><li><a href="/article/{i}/0">相关文章</a></li></ul></aside>
+<footer>版权所有</footer>
+</body></html>'''.encode('utf-8')
+
+    def _entries(self, i):
+        for j in range(self.scenario['articles']):
+            published = self.now - timedelta(hours=j)
+            if self.resolve_method(i) == 'none':
+                content = self.article_body(i, j)
+            else:
+                content = f'<p>{self._paragraphs(i, j)[0][:100]}</p>'
+            yield j, published, content
+
+    def render_feed(self, i):
+        title = f'测试源 {i}'
+        if self.feed_format(i) == 'atom':
+            entries = ''.join(f'''
+  <entry>
+    <title>文章 {i}-{j}</title>
+    <link href="{self.article_url(i, j)}"/>
+    <id>{self.article_url(i, j)}</id>
+    <updated>{published.isoformat()}</updated>
+    <published>{published.isoformat()}</published>
+    <author><name>作者 {i}</name></author>
+    <content type="html">{escape(content)}</content>
+  </entry>''' for j, published, content in self._entries(i))
+            xml = f'''<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title>{title}</title>
+  <link href="{self.feed_host(i)}/"/>
+  <id>{self.feed_url(i)}</id>
+  <updated>{self.now.isoformat()}</updated>
+  <subtitle>离线性能测试</subtitle>{entries}
+</feed>
+'''
+        else:
+            items = ''.join(f'''
+    <item>
+      <title>文章 {i}-{j}</title>
+      <link>{self.article_url(i, j)}</link>
+      <guid>{self.article_url(i, j)}</guid>
+      <pubDate>{format_datetime(published)}</pubDate>
+      <author>作者 {i}</author>
+      <description>{escape(content)}</description>
+    </item>''' for j, published, content in self._entries(i))
+            xml = f'''<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0">
+  <channel>
+    <title>{title}</title>
+    <link>{self.feed_host(i)}/</link>
+    <description>离线性能测试</description>
+    <lastBuildDate>{format_datetime(self.now)}</lastBuildDate>{items}
+  </channel>
+</rss>
+'''
+        return xml.encode('utf-8')
+
+    def route(self, path):
+        """返回 (请求类型, 内容类型, 内容生成函数)，路径无效时返回 None"""
+        parts = path.strip('/').split('/')
+        try:
+            if parts[0] == 'feed' and len(parts) == 2:
+                i = int(parts[1])
+                if i < self.scenario['feeds']:
+                    content_type = 'application/atom+xml' if self.feed_format(i) == 'atom' else 'application/rss+xml'
+                    return 'feed', content_type, lambda: self.render_feed(i)
+            elif parts[0] == 'article' and len(parts) == 3:
+                i, j = int(parts[1]), int(parts[2])
+                if i < self.scenario['feeds'] and j < self.scenario['articles']:
+                    return 'page', 'text/html; charset=utf-8', lambda: self.render_article(i, j)
+            elif parts[0] == 'img' and len(parts) == 4:
+                ext = parts[3].rsplit('.', 1)[-1]
+                if ext in self._images:
+                    return 'image', MEDIA_TYPES[ext], lambda: self._images[ext]
+        except ValueError:
+            pass
+        return None
+
+    def should_fail(self):
+        with self._lock:
+            return self._random.random() < self.scenario['error_rate']
+
+    def delay(self):
+        with self._lock:
+            jitter = self._random.random() * self.scenario['jitter_ms']
+        time.sleep((self.scenario['latency_ms'] + jitter) / 1000)
+
+    def record(self, kind, num_bytes, status):
+        with self._lock:
+            stats = self.stats[kind]
+            stats['requests'] += 1
+            stats['bytes'] += num_bytes
+            if status == 304:
+                stats['not_modified'] += 1
+            elif status >= 400:
+                stats['errors'] += 1
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """模拟站点的请求处理，site 属性由 StubSite.start 设置"""
+
+    protocol_version = 'HTTP/1.1'  # 支持 keep-alive，与真实站点一致
+    site = None
+
+    def do_GET(self):
+        route = self.site.route(self.path.split('?', 1)[0])
+        self.site.delay()
+        if route is None:
+            self._respond(404, b'not found', 'text/plain')
+            return
+        kind, content_type, render = route
+        if self.site.should_fail():
+            self._respond(503, b'service unavailable', 'text/plain', kind)
+            return
+        etag = f'"{self.site.seed}-{self.path}"'
+        if kind == 'feed' and self.headers.get('If-None-Match') == etag:
+            self._respond(304, b'', content_type, kind, {'ETag': etag})
+            return
+        headers = {'ETag': etag} if kind == 'feed' else {}
+        self._respond(200, render(), content_type, kind, headers)
+
+    def _respond(self, status, body, content_type, kind=None, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+        if kind:
+            self.site.record(kind, len(body), status)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_image(width, height, fmt, seed=0):
+    """生成测试图片：渐变背景加色块，压缩后的大小接近网页上的真实图片"""
+    from PIL import Image, ImageDraw
+
+    rnd = random.Random(f'{seed}/{fmt}')
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rnd.randrange(width), rnd.randrange(height)
+        r = rnd.randrange(20, max(21, width // 4))
+        color = tuple(rnd.randrange(256) for _ in range(3))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+    if fmt in ('jpeg', 'webp'):
+        # 照片类图片加噪点；PNG/GIF 保持平涂，与网页上的截图和示意图相近
+        noise = Image.effect_noise((width, height), 24).convert('RGB')
+        image = Image.blend(image, noise, 0.1)
+    if fmt == 'gif':
+        image = image.convert('P')
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt.upper(), **({'quality': 85} if fmt in ('jpeg', 'webp') else {}))
+    return buffer.getvalue()
+
+
+def peak_rss_bytes(who):
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_child(spec_path):
+    """在子进程中运行一次生成流程，结果写入 spec 中指定的文件
+
+    每次运行使用独立的进程，RSS 峰值和导入耗时不受之前运行的影响。
+    """
+    with open(spec_path, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    if spec['tracemalloc']:
+        import tracemalloc
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+    import metrics
+    import_seconds = time.perf_counter() - start
+
+    deliveries = main.build_deliveries(spec['config'])
+    wall = time.perf_counter() - start
+    report = metrics.current().to_dict()
+
+    files = [filename for delivery in deliveries for filename in delivery['files']]
+    result = {
+        'wall_seconds': wall,
+        'import_seconds': import_seconds,
+        'stages': {stage: report['stages'][name]['seconds'] for stage, name in STAGES if name in report['stages']},
+        'metrics': report,
+        'epub_files': len(files),
+        'epub_bytes': sum(os.path.getsize(filename) for filename in files),
+        'peak_rss_bytes': peak_rss_bytes(resource.RUSAGE_SELF) if resource else None,
+        'peak_child_rss_bytes': peak_rss_bytes(resource.RUSAGE_CHILDREN) if resource else None,
+        'tracemalloc_peak_bytes': None,
+    }
+    if spec['tracemalloc']:
+        result['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+    with open(spec['result_path'], 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+def build_config(site, settings_overrides, workdir):
+    settings = dict(BASE_SETTINGS, cache_dir=os.path.join(workdir, '.rss_cache'))
+    settings.update(settings_overrides)
+    return {'Settings': settings, 'Feeds': site.feeds_config()}
+
+
+def run_once(site, config, workdir, label, use_tracemalloc=False, verbose=False):
+    """运行一次生成流程，返回结果（子进程结果加上模拟站点统计的传输量）"""
+    spec_path = os.path.join(workdir, 'benchmark_spec.json')
+    result_path = os.path.join(workdir, 'benchmark_result.json')
+    with open(spec_path, 'w', encoding='utf-8') as f:
+        json.dump({'config': config, 'result_path': result_path, 'tracemalloc': use_tracemalloc}, f,
+                  ensure_ascii=False)
+    if os.path.exists(result_path):
+        os.remove(result_path)
+
+    site.reset_stats()
+    output = None if verbose else subprocess.DEVNULL
+    process = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', spec_path],
+                             cwd=workdir, stdout=output, stderr=output)
+    if process.returncode != 0 or not os.path.exists(result_path):
+        raise RuntimeError(f'生成流程运行失败（退出码 {process.returncode}），可以加上 --verbose 查看输出')
+    with open(result_path, 'r', encoding='utf-8') as f:
+        result = json.load(f)
+    result['label'] = label
+    result['transfer'] = {kind: dict(stats) for kind, stats in site.stats.items()}
+    return result
+
+
+def run_scenario(name, scenario, settings_overrides, repeat=1, warm=False, use_tracemalloc=False,
+                 verbose=False, keep=False, seed=0):
+    """运行一个场景，返回每次运行的结果列表"""
+    results = []
+    print(f"🏁 场景 {name}: {describe_scenario(scenario)}")
+    with StubSite(scenario, seed) as site:
+        for n in range(repeat):
+            workdir = tempfile.mkdtemp(prefix='kindlerss_bench_')
+            try:
+                config = build_config(site, settings_overrides, workdir)
+                labels = ['cold', 'warm'] if warm else ['cold']
+                for label in labels:
+                    result = run_once(site, config, workdir, label, use_tracemalloc, verbose)
+                    result.update(scenario=name, run=n + 1)
+                    results.append(result)
+                    print(f"  第 {n + 1} 次（{label}）：{result['wall_seconds']:.2f}s")
+            finally:
+                if keep:
+                    print(f"  📁 输出保留在 {workdir}")
+                else:
+                    shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def describe_scenario(scenario):
+    params = dict(DEFAULT_SCENARIO, **scenario)
+    return (f"{params['feeds']} 个 feed × {params['articles']} 篇文章 × {params['images']} 张图片，"
+            f"延迟 {params['latency_ms']}±{params['jitter_ms']}ms，错误率 {params['error_rate']:.0%}")
+
+
+def format_size(num_bytes):
+    if num_bytes is None:
+        return '-'
+    if num_bytes >= 1024 * 1024:
+        return f"{num_bytes / (1024 * 1024):.1f} MB"
+    return f"{num_bytes / 1024:.1f} KB"
+
+
+def pad(text, width):
+    """按显示宽度补齐（汉字占两列）"""
+    display = sum(2 if unicodedata.east_asian_width(ch) in 'WF' else 1 for ch in text)
+    return text + ' ' * max(0, width - display)
+
+
+def summarize(results):
+    """按场景和冷/热缓存分组，打印各项指标的中位数"""
+    groups = {}
+    for result in results:
+        groups.setdefault((result['scenario'], result['label']), []).append(result)
+
+    # 传输量归到对应的阶段
+    stage_kinds = {'feed 拉取': 'feed', '全文解析': 'page', '图片下载': 'image'}
+
+    def median(values):
+        values = [value for value in values if value is not None]
+        return statistics.median(values) if values else None
+
+    for (scenario, label), runs in groups.items():
+        walls = [run['wall_seconds'] for run in runs]
+        print(f"\n📊 {scenario}（{label}，{len(runs)} 次运行）")
+        spread = f"（{min(walls):.2f}–{max(walls):.2f}s）" if len(runs) > 1 else ''
+        imports = median([run['import_seconds'] for run in runs])
+        print(f"  {pad('总耗时', 10)}{median(walls):8.2f}s{spread}，其中导入模块 {imports:.2f}s")
+        for stage, _ in STAGES:
+            seconds = median([run['stages'].get(stage) for run in runs])
+            if seconds is None:
+                continue
+            line = f"  {pad(stage, 10)}{seconds:8.2f}s"
+            kind = stage_kinds.get(stage)
+            if kind:
+                transfer = [run['transfer'][kind] for run in runs]
+                requests = median([stats['requests'] for stats in transfer])
+                errors = median([stats['errors'] for stats in transfer])
+                not_modified = median([stats['not_modified'] for stats in transfer])
+                size = format_size(median([stats['bytes'] for stats in transfer]))
+                line += f"  {requests:6g} 次请求 {size:>9}  错误 {errors:g}  未修改 {not_modified:g}"
+            print(line)
+        memory = f"RSS {format_size(median([run['peak_rss_bytes'] for run in runs]))}"
+        memory += f"，转码子进程 {format_size(median([run['peak_child_rss_bytes'] for run in runs]))}"
+        if runs[-1]['tracemalloc_peak_bytes'] is not None:
+            memory += f"，tracemalloc {format_size(median([run['tracemalloc_peak_bytes'] for run in runs]))}"
+        print(f"  {pad('内存峰值', 10)}{memory}")
+        epub_size = format_size(median([run['epub_bytes'] for run in runs]))
+        print(f"  {pad('EPUB', 10)}{runs[-1]['epub_files']} 个文件，{epub_size}")
+
+
+def parse_overrides(items):
+    """解析 key=value 形式的参数，值按 YAML 解析（数字、布尔值、列表等）"""
+    import yaml
+
+    overrides = {}
+    for item in items or []:
+        key, sep, value = item.partition('=')
+        if not sep:
+            raise SystemExit(f"参数格式应为 key=value: {item}")
+        overrides[key.strip()] = yaml.safe_load(value)
+    return overrides
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='KindleRSS 离线性能测试')
+    parser.add_argument('-s', '--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='场景预设，可以指定多次，默认 default')
+    parser.add_argument('--site', action='append', metavar='KEY=VALUE',
+                        help=f"覆盖场景参数，如 images=5、latency_ms=100，可用参数: {', '.join(DEFAULT_SCENARIO)}")
+    parser.add_argument('--set', action='append', metavar='KEY=VALUE', dest='settings',
+                        help='覆盖 Settings，如 image_concurrency=16')
+    parser.add_argument('--repeat', type=int, default=1, help='每个场景运行的次数，报告取中位数')
+    parser.add_argument('--warm', action='store_true', help='每次冷缓存运行后再用同一个缓存目录运行一次')
+    parser.add_argument('--tracemalloc', action='store_true', help='用 tracemalloc 统计 Python 内存峰值（会明显变慢）')
+    parser.add_argument('--json', metavar='PATH', help='把全部结果保存为 JSON')
+    parser.add_argument('--keep', action='store_true', help='保留临时目录（包括生成的 EPUB）')
+    parser.add_argument('--verbose', action='store_true', help='显示生成流程的输出')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子（内容、延迟和错误注入）')
+    parser.add_argument('--child', metavar='SPEC', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child)
+        return []
+
+    site_overrides = parse_overrides(args.site)
+    unknown = set(site_overrides) - set(DEFAULT_SCENARIO)
+    if unknown:
+        parser.error(f"未知的场景参数: {', '.join(sorted(unknown))}")
+    settings_overrides = parse_overrides(args.settings)
+
+    results = []
+    for name in args.scenario or ['default']:
+        scenario = dict(SCENARIOS[name], **site_overrides)
+        results.extend(run_scenario(name, scenario, settings_overrides, max(1, args.repeat), args.warm,
+                                    args.tracemalloc, args.verbose, args.keep, args.seed))
+    summarize(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'settings': settings_overrides, 'site': site_overrides, 'results': results}, f,
+                      ensure_ascii=False, indent=2)
+        print(f"\n💾 结果已保存到 {args.json}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
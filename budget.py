@@ -0,0 +1,83 @@
+"""
+整次运行的时间预算
+
+按优先级安排工作：先拉取 feed，再解析全文，最后下载图片。
+预算用完后尚未完成的全文解析退回到 RSS 摘要、未下载的图片直接丢弃，
+并为生成和发送 EPUB 预留时间，保证按时交付
+"""
+
+import time
+from concurrent.futures import wait
+
+
+class RunBudget:
+    """运行时间预算，max_seconds 为空时不限制"""
+
+    def __init__(self, max_seconds=None, reserve_seconds=None):
+        """
+        Args:
+            max_seconds: 整次运行允许的最长时间（秒）
+            reserve_seconds: 为生成和发送 EPUB 预留的时间（秒），默认取预算的 15%，最多 60 秒
+        """
+        self.start = time.monotonic()
+        self.max_seconds = float(max_seconds) if max_seconds else None
+        if self.max_seconds is None:
+            self.reserve = 0.0
+        elif reserve_seconds is not None:
+            self.reserve = float(reserve_seconds)
+        else:
+            self.reserve = min(60.0, self.max_seconds * 0.15)
+        self.exhausted_stages = []
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def remaining(self):
+        """抓取类工作还能使用的时间（已扣除预留时间），不限制时返回 None"""
+        if self.max_seconds is None:
+            return None
+        return max(0.0, self.max_seconds - self.reserve - self.elapsed())
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def timeout(self, default):
+        """把单个请求的超时限制在剩余预算内"""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return max(1.0, min(default, remaining))
+
+    def mark_exhausted(self, stage):
+        """记录因预算耗尽而被截断的阶段"""
+        if stage not in self.exhausted_stages:
+            self.exhausted_stages.append(stage)
+            print(f"⏰ 时间预算已用完，{stage}阶段未完成的任务将被跳过")
+
+
+def map_within_budget(executor, fn, items, budget=None, stage=''):
+    """在线程池/进程池中执行任务，只收集预算内完成的结果，结束后关闭 executor
+
+    预算耗尽时不再等待仍在运行的任务（它们的请求自身有超时），未开始的任务直接取消。
+
+    Args:
+        executor: 线程池或进程池
+        fn: 任务函数
+        items: 任务参数列表
+        budget: RunBudget，为空时等待全部完成
+        stage: 阶段名称，用于日志
+
+    Returns:
+        与 items 顺序一致的结果列表，未在预算内完成的位置为 None
+    """
+    try:
+        futures = [executor.submit(fn, item) for item in items]
+        timeout = budget.remaining() if budget is not None else None
+        done, not_done = wait(futures, timeout=timeout)
+        if not_done:
+            budget.mark_exhausted(stage)
+        # 与 executor.map 一致：任务本身的异常直接抛出
+        return [future.result() if future in done else None for future in futures]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,385 @@
+"""
+本地缓存：在多次运行之间保存 feed 状态等数据
+
+缓存目录可以通过 GitHub Actions 的 actions/cache 在不同运行之间保留
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+DEFAULT_CACHE_DIR = '.rss_cache'
+
+# 常驻模式下在多次运行之间复用的缓存对象
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def url_key(url):
+    """根据 URL 生成稳定的缓存文件名"""
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+def write_json_atomic(path, data):
+    """先写临时文件再替换，避免中断时留下损坏的缓存"""
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+
+
+def _restore_parsed(value):
+    """把 JSON 还原为 feedparser 的数据结构（支持属性访问和 *_parsed 时间）"""
+    import feedparser
+    if isinstance(value, dict):
+        restored = feedparser.FeedParserDict()
+        for key, item in value.items():
+            if key.endswith('_parsed') and isinstance(item, list) and len(item) == 9:
+                restored[key] = time.struct_time(item)
+            else:
+                restored[key] = _restore_parsed(item)
+        return restored
+    if isinstance(value, list):
+        return [_restore_parsed(item) for item in value]
+    return value
+
+
+def shared(cls, *args, **kwargs):
+    """返回按参数复用的缓存对象
+
+    单次运行时与直接创建没有区别；常驻模式下索引和 feed 状态一直保留在内存中，
+    不必每次运行都重新读取。复用时命中计数清零，按次统计。
+    """
+    key = (cls, args, tuple(sorted(kwargs.items())))
+    with _shared_lock:
+        instance = _shared.get(key)
+        if instance is None:
+            instance = _shared[key] = cls(*args, **kwargs)
+        elif isinstance(instance, BlobCache):
+            instance.reset_stats()
+    return instance
+
+
+class FeedStateStore:
+    """保存每个 feed 的 ETag、Last-Modified 以及上一次解析的条目
+
+    读写过的状态同时保存在内存中，同一个对象再次读取时不需要重新解析 JSON
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.directory = os.path.join(cache_dir, 'feeds')
+        self._states = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.directory, url_key(url) + '.json')
+
+    def load(self, url):
+        """读取 feed 状态，不存在或损坏时返回 None"""
+        with self._lock:
+            if url in self._states:
+                return dict(self._states[url])
+        path = self._path(url)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        state['feed'] = _restore_parsed(state.get('feed', {}))
+        state['entries'] = _restore_parsed(state.get('entries', []))
+        with self._lock:
+            self._states[url] = state
+        return dict(state)
+
+    def save(self, url, parsed_feed, polling=None):
+        """保存一次成功拉取的结果，polling 为 polling.update 计算的轮询状态"""
+        state = {
+            'url': url,
+            'etag': parsed_feed.get('etag'),
+            'modified': parsed_feed.get('modified'),
+            'feed': parsed_feed.get('feed', {}),
+            'entries': parsed_feed.get('entries', []),
+            'fetched_at': time.time(),
+            'polling': polling,
+        }
+        write_json_atomic(self._path(url), state)
+        with self._lock:
+            self._states[url] = state
+
+    def save_polling(self, url, state, polling):
+        """feed 未更新（304）时只更新轮询状态，条目和缓存验证信息不变"""
+        state = dict(state, polling=polling)
+        write_json_atomic(self._path(url), state)
+        with self._lock:
+            self._states[url] = state
+
+    def to_parsed(self, state):
+        """把缓存的状态包装成与 feedparser.parse 返回值相同的结构"""
+        import feedparser
+        return feedparser.FeedParserDict(
+            feed=state['feed'],
+            entries=state['entries'],
+            status=304,
+            etag=state.get('etag'),
+            modified=state.get('modified'),
+        )
+
+
+class BlobCache:
+    """按键索引、按内容哈希存储的磁盘缓存
+
+    索引保存在 index.json 中，内容按 SHA-256 存为文件，相同内容只存一份。
+    总大小超过上限时按最近使用时间淘汰，超过有效期的记录视为未命中。
+    """
+
+    def __init__(self, directory, max_bytes=None, max_age=None):
+        """
+        Args:
+            directory: 缓存目录
+            max_bytes: 缓存总大小上限（字节），None 表示不限制
+            max_age: 缓存有效期（秒），None 表示永久有效
+        """
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, 'blobs')
+        self.index_path = os.path.join(directory, 'index.json')
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._index = self._load_index()
+        # 内容哈希 -> [大小, 引用该内容的记录数量]
+        self._blobs = {}
+        for meta in self._index.values():
+            if meta.get('hash'):
+                self._blobs.setdefault(meta['hash'], [meta['size'], 0])[1] += 1
+        self._remove_orphans()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # 丢弃索引中内容文件已不存在的记录
+        return {
+            key: meta for key, meta in index.items()
+            if not meta.get('hash') or os.path.exists(self._blob_path(meta['hash']))
+        }
+
+    def _remove_orphans(self):
+        """删除索引中没有引用的内容文件（例如上次运行中断时留下的）"""
+        for name in os.listdir(self.blob_dir):
+            if name not in self._blobs:
+                try:
+                    os.remove(os.path.join(self.blob_dir, name))
+                except OSError:
+                    pass
+
+    def _blob_path(self, content_hash):
+        return os.path.join(self.blob_dir, content_hash)
+
+    def _release(self, content_hash):
+        """减少内容引用计数，没有记录引用时删除内容文件，返回释放的字节数（调用方需持有锁）"""
+        if not content_hash:
+            return 0
+        blob = self._blobs[content_hash]
+        blob[1] -= 1
+        if blob[1] > 0:
+            return 0
+        del self._blobs[content_hash]
+        try:
+            os.remove(self._blob_path(content_hash))
+        except OSError:
+            pass
+        return blob[0]
+
+    def _drop(self, key):
+        """删除一条记录，返回释放的字节数（调用方需持有锁）"""
+        return self._release(self._index.pop(key).get('hash'))
+
+    def _evict(self):
+        """按最近使用时间淘汰，直到总大小不超过上限（调用方需持有锁）"""
+        if self.max_bytes is None:
+            return
+        total = sum(size for size, _ in self._blobs.values())
+        if total <= self.max_bytes:
+            return
+        for key in sorted(self._index, key=lambda k: self._index[k]['last_used']):
+            total -= self._drop(key)
+            if total <= self.max_bytes:
+                break
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get_entry(self, key):
+        """读取记录的元数据（不含内容），未命中或已过期返回 None"""
+        with self._lock:
+            meta = self._index.get(key)
+            if meta and self.max_age is not None and time.time() - meta['stored_at'] > self.max_age:
+                self._drop(key)
+                meta = None
+            if not meta:
+                self.misses += 1
+                return None
+            meta['last_used'] = time.time()
+            self.hits += 1
+            return dict(meta)
+
+    def read(self, meta):
+        """读取记录对应的内容，没有内容（例如失败记录）或文件丢失时返回 None"""
+        if not meta.get('hash'):
+            return None
+        try:
+            with open(self._blob_path(meta['hash']), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put_entry(self, key, content=None, **meta):
+        """保存一条记录，content 为 None 时只保存元数据"""
+        now = time.time()
+        content_hash = None
+        if content is not None:
+            content_hash = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            if content_hash:
+                if content_hash not in self._blobs:
+                    blob_path = self._blob_path(content_hash)
+                    tmp_path = f'{blob_path}.tmp{os.getpid()}'
+                    with open(tmp_path, 'wb') as f:
+                        f.write(content)
+                    os.replace(tmp_path, blob_path)
+                    self._blobs[content_hash] = [len(content), 0]
+                self._blobs[content_hash][1] += 1
+            if key in self._index:
+                self._drop(key)
+            meta.update({
+                'hash': content_hash,
+                'size': len(content) if content is not None else 0,
+                'stored_at': now,
+                'last_used': now,
+            })
+            self._index[key] = meta
+            self._evict()
+
+    def update_entry(self, key, **updates):
+        """更新记录的元数据（例如重新验证后刷新保存时间）"""
+        with self._lock:
+            if key in self._index:
+                self._index[key].update(updates)
+
+    def save(self):
+        """写入索引文件"""
+        with self._lock:
+            self._evict()
+            write_json_atomic(self.index_path, self._index)
+
+
+class ImageCache(BlobCache):
+    """按 URL 索引、按内容哈希存储的图片缓存
+
+    保存的是已经转换过的图片（例如 WebP 转成的 JPEG）及其媒体类型，
+    命中时既不需要网络请求也不需要 Pillow 处理。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=200 * 1024 * 1024, max_age=None):
+        super().__init__(os.path.join(cache_dir, 'images'), max_bytes, max_age)
+
+    def get(self, url):
+        """读取缓存的图片，返回 (内容, 扩展名, 媒体类型)，未命中返回 None"""
+        meta = self.get_entry(url)
+        if not meta:
+            return None
+        content = self.read(meta)
+        if content is None:
+            return None
+        return content, meta['ext'], meta['media_type']
+
+    def put(self, url, content, ext, media_type):
+        """保存转换后的图片，相同内容只存一份"""
+        self.put_entry(url, content, ext=ext, media_type=media_type)
+
+
+class ArticleCache(BlobCache):
+    """全文提取结果缓存
+
+    以最终 URL 和 feed 的解析配置为键（修改选择器后自动失效），
+    有效期内直接使用；过期后用 ETag / Last-Modified 条件请求重新验证。
+    解析失败的链接也会缓存一段时间，避免每次运行都在同一个坏站点上等待超时。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=100 * 1024 * 1024,
+                 ttl=24 * 3600, failure_ttl=6 * 3600, max_age=30 * 86400):
+        """
+        Args:
+            cache_dir: 缓存根目录
+            max_bytes: 缓存总大小上限（字节）
+            ttl: 在此时间内直接使用缓存，不发送请求（秒）
+            failure_ttl: 解析失败记录的有效期（秒）
+            max_age: 超过此时间的记录彻底删除（秒）
+        """
+        super().__init__(os.path.join(cache_dir, 'articles'), max_bytes, max_age)
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+
+    @staticmethod
+    def make_key(url, config_key):
+        return url_key(f'{config_key}|{url}')
+
+    def lookup(self, url, config_key):
+        """查找文章缓存
+
+        Returns:
+            None 表示没有可用记录；否则返回字典：
+            content（失败记录为 None）、fresh（是否可以直接使用）、
+            failed、etag、last_modified、key（用于重新验证后刷新）
+        """
+        meta = self.get_entry(self.make_key(url, config_key))
+        # 原始链接可能重定向，记录中保存了指向最终 URL 记录的别名
+        if meta and meta.get('alias'):
+            meta = self.get_entry(meta['alias'])
+        if not meta:
+            return None
+        age = time.time() - meta['stored_at']
+        if meta.get('failed'):
+            if age > self.failure_ttl:
+                return None
+            return {'content': None, 'fresh': True, 'failed': True}
+        content = self.read(meta)
+        if content is None:
+            return None
+        return {
+            'content': content.decode('utf-8'),
+            'fresh': age <= self.ttl,
+            'failed': False,
+            'etag': meta.get('etag'),
+            'last_modified': meta.get('last_modified'),
+            'key': self.make_key(meta['url'], config_key),
+        }
+
+    def put(self, url, final_url, config_key, content, etag=None, last_modified=None):
+        """保存提取结果，最终 URL 与原始链接不同时同时保存别名"""
+        final_key = self.make_key(final_url, config_key)
+        self.put_entry(final_key, content.encode('utf-8'), url=final_url,
+                       etag=etag, last_modified=last_modified)
+        if final_url != url:
+            self.put_entry(self.make_key(url, config_key), alias=final_key)
+
+    def put_failure(self, url, config_key):
+        """记录解析失败的链接"""
+        self.put_entry(self.make_key(url, config_key), url=url, failed=True)
+
+    def refresh(self, key):
+        """条件请求返回 304 后，刷新记录的保存时间"""
+        self.update_entry(key, stored_at=time.time())
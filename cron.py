@@ -0,0 +1,126 @@
+"""
+cron 表达式解析，供常驻模式（rss_and_send.py --daemon）计算下次运行时间
+
+支持标准的 5 个字段（分 时 日 月 周），每个字段可以使用 *、数字、范围（1-5）、
+步长（*/15、8-18/2）、逗号分隔的列表以及英文月份/星期缩写（jan、mon）；
+另外支持 @hourly、@daily、@weekly、@monthly、@yearly。
+与 cron 一致：日和周都不是 * 时，满足其中之一即可运行。
+"""
+
+from datetime import datetime, timedelta
+
+ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+}
+
+MONTH_NAMES = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+DAY_NAMES = ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat']
+
+# (名称, 最小值, 最大值, 名称缩写及其起始值)
+FIELDS = [
+    ('分钟', 0, 59, None),
+    ('小时', 0, 23, None),
+    ('日', 1, 31, None),
+    ('月', 1, 12, (MONTH_NAMES, 1)),
+    ('星期', 0, 7, (DAY_NAMES, 0)),  # 0 和 7 都表示星期日
+]
+
+# 最多向后查找的时间，足够覆盖只在 2 月 29 日运行的表达式
+MAX_LOOKAHEAD = timedelta(days=366 * 8)
+
+
+def _parse_value(text, names):
+    text = text.lower()
+    if names and text in names[0]:
+        return names[0].index(text) + names[1]
+    return int(text)
+
+
+def parse_field(text, low, high, names=None):
+    """解析一个字段，返回允许的取值集合"""
+    values = set()
+    for part in text.split(','):
+        part, _, step_text = part.partition('/')
+        step = int(step_text) if step_text else 1
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            start, end = _parse_value(start_text, names), _parse_value(end_text, names)
+        else:
+            start = _parse_value(part, names)
+            # 单个值带步长（如 5/15）表示从该值开始到最大值
+            end = high if step_text else start
+        if step < 1 or not (low <= start <= high and low <= end <= high) or start > end:
+            raise ValueError(f'超出范围 {low}-{high}: {text}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """一个 cron 表达式"""
+
+    def __init__(self, expression):
+        self.expression = expression.strip()
+        fields = ALIASES.get(self.expression.lower(), self.expression).split()
+        if len(fields) != 5:
+            raise ValueError(f'cron 表达式应有 5 个字段: {expression}')
+        try:
+            parsed = [parse_field(text, low, high, names) for text, (_, low, high, names) in zip(fields, FIELDS)]
+        except ValueError as e:
+            raise ValueError(f'无效的 cron 表达式 {expression}: {e}') from None
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def __repr__(self):
+        return f'CronSchedule({self.expression!r})'
+
+    def day_matches(self, dt):
+        day_ok = dt.day in self.days
+        weekday_ok = (dt.weekday() + 1) % 7 in self.weekdays  # Python 以周一为 0，cron 以周日为 0
+        if self.any_day or self.any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def matches(self, dt):
+        return (dt.month in self.months and self.day_matches(dt)
+                and dt.hour in self.hours and dt.minute in self.minutes)
+
+    def next_after(self, dt):
+        """返回 dt 之后（不含 dt 所在的这一分钟）第一个满足表达式的时间"""
+        t = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + MAX_LOOKAHEAD
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f'cron 表达式不会再匹配任何时间: {self.expression}')
+
+
+def parse_schedules(value):
+    """把配置中的 schedule（单个表达式或列表）解析为 CronSchedule 列表"""
+    if not value:
+        return []
+    expressions = [value] if isinstance(value, str) else list(value)
+    return [CronSchedule(str(expression)) for expression in expressions]
+
+
+def next_run(schedules, now=None):
+    """多个表达式中最早的下次运行时间"""
+    now = now or datetime.now()
+    return min(schedule.next_after(now) for schedule in schedules)
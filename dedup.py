@@ -0,0 +1,142 @@
+"""
+跨 feed 的重复文章检测
+
+同一篇文章经常出现在多个 feed 中（同一媒体的不同 RSSHub 路由、聚合源和原始来源等）。
+在解析全文和下载图片之前先去重，每篇文章只处理一次：
+1. 规范化后的链接或 GUID 相同的视为同一篇文章（不是链接的 GUID 只在同一网站内比较）
+2. 标题和摘要的 SimHash 指纹足够接近的视为转载（近似重复）
+保留优先级（feed 的 priority）最高的 feed 中的那一份，其他 feed 的索引页链接到它。
+只比较不同 feed 之间的文章，同一个 feed 中标题相同的文章（例如每日天气）不受影响。
+"""
+
+import re
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# 指纹位数
+SIMHASH_BITS = 64
+# 近似重复的默认最大汉明距离
+DEFAULT_MAX_DISTANCE = 3
+# 参与指纹计算的摘要长度，聚合源常常截断摘要，只比较开头部分
+SUMMARY_CHARS = 300
+# 指纹太短时不做近似匹配，避免短标题误判
+MIN_FEATURES = 8
+
+# 链接中与内容无关的跟踪参数
+TRACKING_PARAMS = re.compile(r'^(utm_\w+|spm|from|source|ref|share\w*|fbclid|gclid|mc_cid|mc_eid)$', re.I)
+TAG_RE = re.compile(r'<[^>]+>')
+# 英文和数字按单词，中日韩文字按单字，再组合成相邻两项的特征
+TOKEN_RE = re.compile(r'[a-z0-9]+|[぀-ヿ㐀-鿿가-힯]')
+
+
+def canonical_url(url):
+    """规范化链接：忽略协议、www.、大小写的主机名、片段、跟踪参数和末尾的 /"""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    query = urlencode(sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                             if not TRACKING_PARAMS.match(key)))
+    return urlunsplit(('', host, parts.path.rstrip('/') or '/', query, ''))
+
+
+def entry_identities(entry):
+    """文章的精确标识：规范化的链接和 GUID
+
+    GUID 是链接时同样规范化；其他 GUID（例如 "1001"）只在各网站内唯一，
+    加上文章链接的主机名，没有链接时不参与比较。
+    """
+    identities = set()
+    link = entry.get('link')
+    if link:
+        identities.add(canonical_url(link))
+    guid = entry.get('id')
+    if guid:
+        if '://' in guid:
+            identities.add(canonical_url(guid))
+        elif link:
+            identities.add(f'id:{urlsplit(canonical_url(link)).netloc}|{guid}')
+    return identities
+
+
+def simhash(text):
+    """计算文本的 SimHash 指纹，特征太少时返回 None"""
+    tokens = TOKEN_RE.findall(text.lower())
+    features = [a + ' ' + b for a, b in zip(tokens, tokens[1:])]
+    if len(features) < MIN_FEATURES:
+        return None
+    weights = [0] * SIMHASH_BITS
+    for feature in features:
+        value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def entry_fingerprint(entry):
+    """标题和摘要开头的指纹"""
+    summary = TAG_RE.sub(' ', entry.get('summary', entry.get('description', '')) or '')
+    return simhash(f"{entry.get('title', '')} {summary[:SUMMARY_CHARS]}")
+
+
+class FingerprintIndex:
+    """按指纹分段索引，查找汉明距离不超过 max_distance 的指纹
+
+    指纹分为 max_distance + 1 段，距离不超过 max_distance 的两个指纹至少有一段完全相同
+    """
+
+    def __init__(self, max_distance):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.width = SIMHASH_BITS // self.bands
+        self.tables = [{} for _ in range(self.bands)]
+
+    def _keys(self, fingerprint):
+        mask = (1 << self.width) - 1
+        return [(fingerprint >> (band * self.width)) & mask for band in range(self.bands)]
+
+    def add(self, fingerprint, item):
+        for table, key in zip(self.tables, self._keys(fingerprint)):
+            table.setdefault(key, []).append((fingerprint, item))
+
+    def find(self, fingerprint, exclude_group=None):
+        """返回第一个足够接近、且不属于 exclude_group 的条目"""
+        for table, key in zip(self.tables, self._keys(fingerprint)):
+            for other, item in table.get(key, ()):
+                if item[0] != exclude_group and (fingerprint ^ other).bit_count() <= self.max_distance:
+                    return item
+        return None
+
+
+def find_duplicates(ordered_feeds, max_distance=DEFAULT_MAX_DISTANCE):
+    """在多个 feed 之间查找重复文章
+
+    Args:
+        ordered_feeds: [(feed 标识, 条目列表)]，按保留优先级从高到低排列
+        max_distance: 近似重复的最大汉明距离，小于 0 时只按链接和 GUID 去重
+
+    Returns:
+        {(feed 标识, 条目位置): (保留的 feed 标识, 保留的条目)}，不在其中的条目保留
+    """
+    by_identity = {}
+    index = FingerprintIndex(max_distance) if max_distance >= 0 else None
+    duplicates = {}
+    for feed_key, entries in ordered_feeds:
+        for position, entry in enumerate(entries):
+            identities = entry_identities(entry)
+            original = next((by_identity[identity] for identity in identities
+                             if identity in by_identity and by_identity[identity][0] != feed_key), None)
+            fingerprint = entry_fingerprint(entry) if index is not None else None
+            if original is None and fingerprint is not None:
+                original = index.find(fingerprint, exclude_group=feed_key)
+            if original is not None:
+                duplicates[(feed_key, position)] = original
+                continue
+            for identity in identities:
+                by_identity.setdefault(identity, (feed_key, entry))
+            if fingerprint is not None:
+                index.add(fingerprint, (feed_key, entry))
+    return duplicates
@@ -0,0 +1,346 @@
+"""
+流式 EPUB 写入器
+
+每个页面和图片准备好后立即写入 zip 并从内存中释放，只有目录、spine 等少量元数据
+保留到最后，用于生成 content.opf、toc.ncx 和 nav.xhtml。
+内存占用因此取决于最大的单篇文章，而不是整本书。
+先写入临时文件，完成后再替换为目标文件，中断时不会留下损坏的 EPUB。
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from datetime import datetime, timezone
+from html import escape
+
+XHTML_NS = 'http://www.w3.org/1999/xhtml'
+EPUB_NS = 'http://www.idpf.org/2007/ops'
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+CONTAINER_XML = '''<?xml version="1.0" encoding="utf-8"?>
+<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container" version="1.0">
+  <rootfiles>
+    <rootfile media-type="application/oebps-package+xml" full-path="EPUB/content.opf"/>
+  </rootfiles>
+</container>
+'''
+
+
+def quoteattr(value):
+    """转义并加上引号的属性值（不用 xml.sax.saxutils，它会连带导入 urllib.request，拖慢启动）"""
+    return f'"{escape(value)}"'
+
+
+# 已经压缩过的图片直接存储，不再浪费 CPU 做 deflate
+STORED_MEDIA_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp')
+
+
+def html_to_xhtml(title, content, lang='zh', stylesheets=()):
+    """把 HTML 页面转换为 EPUB 要求的 XHTML
+
+    保留 body 内容和原页面 head 中的 <style>（内嵌样式），head 中另外写入标题和样式表链接。
+    原页面链接的外部样式表不在书中，不保留。
+    """
+    import lxml.html
+    from lxml import etree
+
+    root = etree.Element(f'{{{XHTML_NS}}}html', nsmap={None: XHTML_NS, 'epub': EPUB_NS})
+    root.set('lang', lang)
+    root.set(XML_LANG, lang)
+    head = etree.SubElement(root, 'head')
+    etree.SubElement(head, 'title').text = title
+    for href in stylesheets:
+        etree.SubElement(head, 'link', rel='stylesheet', type='text/css', href=href)
+    body = etree.SubElement(root, 'body')
+
+    parser = lxml.html.HTMLParser(encoding='utf-8')
+    document = lxml.html.document_fromstring(content.encode('utf-8'), parser=parser)
+    source_head = document.find('head')
+    if source_head is not None:
+        for style in source_head.findall('style'):
+            style.tail = None
+            head.append(style)
+    source_body = document.find('body')
+    if source_body is not None:
+        body.text = source_body.text
+        for child in list(source_body):
+            body.append(child)
+
+    return etree.tostring(root, encoding='utf-8', xml_declaration=True, pretty_print=True,
+                          doctype='<!DOCTYPE html>')
+
+
+class StreamingEpubWriter:
+    """边生成边写入的 EPUB
+
+    用法与 ebooklib 的 EpubBook 类似：add_page / add_image 立即写入内容，
+    add_stylesheet 写入的样式表由之后写入的所有页面链接，
+    spine（阅读顺序，文件名列表）和 toc（[(标题, 文件名)]）由调用方填写，close 时写入。
+    add_image 可以在多个线程中同时调用；close 之后的写入会被忽略。
+    """
+
+    def __init__(self, path, identifier, title, language='zh', author=None, description=None, date=None):
+        self.path = path
+        self.tmp_path = f'{path}.part'
+        self.identifier = identifier
+        self.title = title
+        self.language = language
+        self.author = author
+        self.description = description
+        self.date = date
+        self.spine = []
+        self.toc = []
+        self.bytes_written = 0
+        self.stylesheets = []
+        self._manifest = []  # [(id, 文件名, 媒体类型, properties)]
+        self._ids = {}  # 文件名 -> manifest id
+        self._lock = threading.Lock()
+        self._closed = False
+        self._zip = zipfile.ZipFile(self.tmp_path, 'w', zipfile.ZIP_DEFLATED)
+        # mimetype 必须是第一个文件且不压缩
+        self._zip.writestr(zipfile.ZipInfo('mimetype'), 'application/epub+zip', zipfile.ZIP_STORED)
+        self._zip.writestr('META-INF/container.xml', CONTAINER_XML)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def _write_locked(self, file_name, data, media_type, properties=None, item_id=None):
+        """写入一个文件并登记到 manifest（调用方需持有锁）"""
+        compress = zipfile.ZIP_STORED if media_type in STORED_MEDIA_TYPES else zipfile.ZIP_DEFLATED
+        self._zip.writestr('EPUB/' + file_name, data, compress)
+        self.bytes_written += len(data)
+        item_id = item_id or f'item_{len(self._manifest)}'
+        self._ids[file_name] = item_id
+        self._manifest.append((item_id, file_name, media_type, properties))
+
+    def _write(self, file_name, data, media_type):
+        with self._lock:
+            if not self._closed:
+                self._write_locked(file_name, data, media_type)
+
+    def add_stylesheet(self, file_name, css):
+        """写入一个样式表，之后写入的页面都会链接它"""
+        self._write(file_name, css.encode('utf-8'), 'text/css')
+        self.stylesheets.append(file_name)
+
+    def add_page(self, file_name, title, content):
+        """写入一个 HTML 页面（会转换为 XHTML），不会自动加入 spine"""
+        self._write(file_name, html_to_xhtml(title, content, self.language, self.stylesheets),
+                    'application/xhtml+xml')
+
+    def add_image(self, file_name, content, media_type):
+        """写入一张图片"""
+        self._write(file_name, content, media_type)
+
+    def add_image_file(self, file_name, path, media_type):
+        """从磁盘文件写入一张图片，不需要把内容读入内存"""
+        compress = zipfile.ZIP_STORED if media_type in STORED_MEDIA_TYPES else zipfile.ZIP_DEFLATED
+        with self._lock:
+            if self._closed:
+                return
+            self._zip.write(path, 'EPUB/' + file_name, compress)
+            self.bytes_written += os.path.getsize(path)
+            item_id = f'item_{len(self._manifest)}'
+            self._ids[file_name] = item_id
+            self._manifest.append((item_id, file_name, media_type, None))
+
+    def compressed_size(self):
+        """目前已写入的压缩后字节数（不含最后写入的导航文件和 content.opf）"""
+        with self._lock:
+            return self._zip.fp.tell()
+
+    def _nav_xhtml(self):
+        items = ''.join(
+            f'        <li>\n          <a href={quoteattr(href)}>{escape(title)}</a>\n        </li>\n'
+            for title, href in self.toc
+        )
+        return f'''<?xml version='1.0' encoding='utf-8'?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="{self.language}" xml:lang="{self.language}">
+  <head>
+    <title>{escape(self.title)}</title>
+  </head>
+  <body>
+    <nav epub:type="toc" id="id" role="doc-toc">
+      <h2>{escape(self.title)}</h2>
+      <ol>
+{items}      </ol>
+    </nav>
+  </body>
+</html>
+'''
+
+    def _toc_ncx(self):
+        points = ''.join(
+            f'''    <navPoint id="navpoint_{idx}" playOrder="{idx}">
+      <navLabel>
+        <text>{escape(title)}</text>
+      </navLabel>
+      <content src={quoteattr(href)}/>
+    </navPoint>
+'''
+            for idx, (title, href) in enumerate(self.toc, 1)
+        )
+        return f'''<?xml version='1.0' encoding='utf-8'?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+  <head>
+    <meta content={quoteattr(self.identifier)} name="dtb:uid"/>
+    <meta content="1" name="dtb:depth"/>
+    <meta content="0" name="dtb:totalPageCount"/>
+    <meta content="0" name="dtb:maxPageNumber"/>
+  </head>
+  <docTitle>
+    <text>{escape(self.title)}</text>
+  </docTitle>
+  <navMap>
+{points}  </navMap>
+</ncx>
+'''
+
+    def _content_opf(self):
+        modified = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        metadata = [
+            f'    <meta property="dcterms:modified">{modified}</meta>',
+            f'    <dc:identifier id="id">{escape(self.identifier)}</dc:identifier>',
+            f'    <dc:title>{escape(self.title)}</dc:title>',
+            f'    <dc:language>{escape(self.language)}</dc:language>',
+        ]
+        if self.author:
+            metadata.append(f'    <dc:creator id="creator">{escape(self.author)}</dc:creator>')
+        if self.description:
+            metadata.append(f'    <dc:description>{escape(self.description)}</dc:description>')
+        if self.date:
+            metadata.append(f'    <dc:date>{escape(self.date)}</dc:date>')
+
+        manifest = []
+        for item_id, file_name, media_type, properties in self._manifest:
+            props = f' properties="{properties}"' if properties else ''
+            manifest.append(f'    <item href={quoteattr(file_name)} id="{item_id}" media-type="{media_type}"{props}/>')
+        spine = [f'    <itemref idref="{self._ids[file_name]}"/>' for file_name in self.spine]
+
+        return '\n'.join([
+            "<?xml version='1.0' encoding='utf-8'?>",
+            '<package xmlns="http://www.idpf.org/2007/opf" unique-identifier="id" version="3.0">',
+            '  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">',
+            *metadata,
+            '  </metadata>',
+            '  <manifest>',
+            *manifest,
+            '  </manifest>',
+            '  <spine toc="ncx">',
+            *spine,
+            '  </spine>',
+            '</package>',
+            '',
+        ])
+
+    def close(self):
+        """写入导航文件和 content.opf，完成后替换为目标文件"""
+        with self._lock:
+            self._closed = True
+            self._write_locked('nav.xhtml', self._nav_xhtml().encode('utf-8'), 'application/xhtml+xml', 'nav', 'nav')
+            self._write_locked('toc.ncx', self._toc_ncx().encode('utf-8'), 'application/x-dtbncx+xml', item_id='ncx')
+            # 内置目录页排在最前面，与之前 ebooklib 生成的阅读顺序一致
+            if 'nav.xhtml' not in self.spine:
+                self.spine.insert(0, 'nav.xhtml')
+            self._zip.writestr('EPUB/content.opf', self._content_opf())
+            self._zip.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """出错时丢弃临时文件"""
+        try:
+            with self._lock:
+                self._closed = True
+                self._zip.close()
+        finally:
+            try:
+                os.remove(self.tmp_path)
+            except OSError:
+                pass
+
+
+class ImageSpool:
+    """把下载好的图片暂存在临时目录中，分卷写入时再按引用复制到各卷
+
+    与 StreamingEpubWriter 提供相同的 add_image 接口，可以在多个线程中同时调用。
+    下载阶段结束后调用 close，之后的 add_image 被忽略（例如时间预算用完后仍在运行的下载线程），
+    已暂存的图片仍然可以用 replace 替换；cleanup 删除临时目录，之后所有写入都被忽略。
+    所有对 images 的访问都持有锁，其他线程可以在遍历的同时写入。
+    """
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix='kindlerss_images_')
+        self.images = {}  # 书内路径 -> (临时文件路径, 媒体类型, 字节数)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._removed = False
+
+    def _path(self, file_name):
+        return os.path.join(self.directory, file_name.replace('/', '_'))
+
+    def _store_locked(self, file_name, content, media_type):
+        """写入临时文件并登记（调用方需持有锁）"""
+        path = self._path(file_name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        self.images[file_name] = (path, media_type, len(content))
+
+    def add_image(self, file_name, content, media_type):
+        with self._lock:
+            if not self._closed:
+                self._store_locked(file_name, content, media_type)
+
+    def replace(self, file_name, new_file_name, content, media_type):
+        """用新内容替换已暂存的图片（close 之后也可以调用）"""
+        with self._lock:
+            if self._removed:
+                return
+            path, _, _ = self.images.pop(file_name)
+            os.remove(path)
+            self._store_locked(new_file_name, content, media_type)
+
+    def close(self):
+        """不再接受 add_image"""
+        with self._lock:
+            self._closed = True
+
+    def names(self):
+        with self._lock:
+            return list(self.images)
+
+    def _entry(self, file_name):
+        with self._lock:
+            return self.images[file_name]
+
+    def read(self, file_name):
+        path, media_type, _ = self._entry(file_name)
+        with open(path, 'rb') as f:
+            return f.read(), media_type
+
+    def size(self, file_name):
+        return self._entry(file_name)[2]
+
+    def total_size(self):
+        with self._lock:
+            return sum(size for _, _, size in self.images.values())
+
+    def copy_to(self, writer, file_name):
+        """把暂存的图片写入 EPUB"""
+        path, media_type, _ = self._entry(file_name)
+        writer.add_image_file(file_name, path, media_type)
+
+    def cleanup(self):
+        with self._lock:
+            self._closed = self._removed = True
+            self.images.clear()
+            shutil.rmtree(self.directory, ignore_errors=True)
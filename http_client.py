@@ -0,0 +1,176 @@
+"""
+共享的 HTTP 客户端
+
+feed、原始网页和图片都通过同一个 requests.Session 发送，复用连接（keep-alive），
+每个主机维护独立的连接池；遇到 429/5xx 或连接错误时按指数退避重试，并遵守 Retry-After。
+读取超时不重试：慢站点每次重试都要再等一个完整的超时，一个站点就会拖慢整次运行。
+每次请求都计入运行指标（metrics）。
+requests 在第一次建立会话时才导入，只发送邮件的运行不需要加载它
+"""
+
+import threading
+import time
+
+import metrics
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+# 不同类型请求使用的请求头
+HEADERS = {
+    'feed': {
+        'User-Agent': USER_AGENT,
+        'Accept': 'application/rss+xml, application/atom+xml, application/xml;q=0.9, text/xml;q=0.9, */*;q=0.8',
+        'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    },
+    'page': {
+        'User-Agent': USER_AGENT,
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    },
+    'image': {
+        'User-Agent': USER_AGENT,
+        'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
+        'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    },
+}
+
+# 不同类型请求的默认读取超时（秒）
+TIMEOUTS = {
+    'feed': 20,
+    'page': 15,
+    'image': 10,
+}
+
+DEFAULT_SETTINGS = {
+    'http_connect_timeout': 10,  # 建立连接的超时（秒）
+    'http_pool_per_host': 8,  # 每个主机保持的最大连接数
+    'http_retries': 2,  # 429/5xx 或连接错误时的重试次数（读取超时不重试）
+    'http_backoff': 0.5,  # 指数退避的基础时间（秒）
+    'http_max_retry_after': 30,  # 按 Retry-After 等待的最长时间（秒）
+}
+
+_settings = dict(DEFAULT_SETTINGS)
+_session = None
+_session_lock = threading.Lock()
+
+
+def configure(settings):
+    """根据全局设置调整客户端参数
+
+    参数有变化时已有会话会被重建；没有变化时继续复用（常驻模式下保留连接池）
+    """
+    global _session
+    with _session_lock:
+        updated = {}
+        for key, default in DEFAULT_SETTINGS.items():
+            value = settings.get(key)
+            updated[key] = default if value is None else value
+        if updated == _settings:
+            return
+        _settings.update(updated)
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def _build_session():
+    import requests
+    import urllib3
+    from requests.adapters import HTTPAdapter
+    from urllib3.exceptions import ReadTimeoutError
+    from urllib3.util.retry import Retry
+
+    # 禁用 SSL 警告（各站点证书质量参差不齐，请求统一不校验证书）
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    class CappedRetry(Retry):
+        """遵守 Retry-After，但最多等待 max_retry_after 秒，避免一个站点拖慢整次运行"""
+
+        max_retry_after = float(_settings['http_max_retry_after'])
+
+        def get_retry_after(self, response):
+            retry_after = super().get_retry_after(response)
+            if retry_after is None:
+                return None
+            return min(retry_after, self.max_retry_after)
+
+        def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+            # 读取超时直接失败；连接被服务器断开（例如复用了已关闭的 keep-alive 连接）等读取错误仍然重试
+            if isinstance(error, ReadTimeoutError):
+                raise error.with_traceback(_stacktrace)
+            return super().increment(method, url, response, error, _pool, _stacktrace)
+
+    retry = CappedRetry(
+        total=int(_settings['http_retries']),
+        connect=int(_settings['http_retries']),
+        read=int(_settings['http_retries']),
+        status=int(_settings['http_retries']),
+        backoff_factor=float(_settings['http_backoff']),
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=64,  # 缓存连接池的主机数量
+        pool_maxsize=int(_settings['http_pool_per_host']),
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.verify = False
+    return session
+
+
+def get_session():
+    """返回共享会话（首次调用时创建）"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def close():
+    """关闭共享会话，释放所有连接"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get(url, kind='page', headers=None, timeout=None, **kwargs):
+    """发送 GET 请求
+
+    Args:
+        url: 请求地址
+        kind: 请求类型（feed / page / image），决定默认请求头和超时
+        headers: 额外的请求头，覆盖默认值
+        timeout: 读取超时（秒），默认按请求类型取值
+
+    Returns:
+        requests.Response
+    """
+    request_headers = dict(HEADERS.get(kind, HEADERS['page']))
+    if headers:
+        request_headers.update(headers)
+    read_timeout = timeout if timeout is not None else TIMEOUTS.get(kind, 15)
+    connect_timeout = min(float(_settings['http_connect_timeout']), read_timeout)
+    import requests
+
+    # 每个主机的请求数、字节数、耗时、失败和超时计入运行指标（重试计为同一次请求）
+    start = time.monotonic()
+    try:
+        response = get_session().get(url, headers=request_headers, timeout=(connect_timeout, read_timeout), **kwargs)
+    except requests.exceptions.Timeout:
+        metrics.record_request(url, kind, time.monotonic() - start, timeout=True)
+        raise
+    except requests.exceptions.RequestException:
+        metrics.record_request(url, kind, time.monotonic() - start)
+        raise
+    num_bytes = 0 if kwargs.get('stream') else len(response.content)
+    metrics.record_request(url, kind, time.monotonic() - start, response.status_code, num_bytes)
+    return response
@@ -0,0 +1,121 @@
+"""
+面向 Kindle 的图片转码：缩放到设备宽度、可选灰度化、按字节预算重新压缩
+
+单独成模块，便于在进程池中运行时子进程只导入 Pillow
+"""
+
+import io
+
+from PIL import Image
+
+# 依次尝试的 JPEG 质量，直到满足字节预算
+JPEG_QUALITIES = (85, 75, 65, 55, 45, 35)
+# 最低质量仍超出预算时，每次缩小的比例和最多缩小次数
+SHRINK_FACTOR = 0.75
+MAX_SHRINK_STEPS = 4
+
+
+def _flatten(img):
+    """去掉透明通道，透明部分用白色背景填充"""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[3])
+        return background
+    return img
+
+
+def _encode(img, fmt, quality=None):
+    output = io.BytesIO()
+    if fmt == 'JPEG':
+        img.save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        img.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+
+def _encode_within_budget(img, keep_png, max_bytes):
+    """按质量从高到低编码，返回第一个不超过预算的结果（都超出时返回最小的）"""
+    best = None
+    if keep_png:
+        # 截图、图标等适合 PNG，先试无损压缩
+        png = _encode(img, 'PNG')
+        best = (png, 'png', 'image/png')
+        if not max_bytes or len(png) <= max_bytes:
+            return best
+    jpeg_img = img if img.mode in ('RGB', 'L') else img.convert('RGB')
+    for quality in JPEG_QUALITIES:
+        data = _encode(jpeg_img, 'JPEG', quality)
+        if best is None or len(data) < len(best[0]):
+            best = (data, 'jpg', 'image/jpeg')
+        if not max_bytes or len(data) <= max_bytes:
+            break
+    return best
+
+
+def transcode_image(content, ext, media_type, max_width=None, grayscale=False, max_bytes=None):
+    """把图片转换为适合 Kindle 的尺寸和格式
+
+    Args:
+        content: 原始图片内容
+        ext: 原始扩展名
+        media_type: 原始媒体类型
+        max_width: 最大宽度（像素），超出时等比缩小
+        grayscale: 是否转换为 8 位灰度
+        max_bytes: 单张图片的字节预算
+
+    Returns:
+        (图片内容, 扩展名, 媒体类型)，无法处理或转码后没有变小时返回原图
+    """
+    original = (content, ext, media_type)
+    try:
+        img = Image.open(io.BytesIO(content))
+        # 动图保持原样，避免只剩第一帧
+        if getattr(img, 'is_animated', False):
+            return original
+        img.load()
+    except Exception:
+        return original
+
+    try:
+        return _transcode(img, original, max_width, grayscale, max_bytes)
+    except Exception:
+        return original
+
+
+def _transcode(img, original, max_width, grayscale, max_bytes):
+    content, _, media_type = original
+    if max_width and img.width > max_width:
+        height = max(1, round(img.height * max_width / img.width))
+        img = img.resize((max_width, height), Image.LANCZOS)
+
+    img = _flatten(img)
+    if grayscale:
+        img = img.convert('L')
+    elif img.mode not in ('RGB', 'L', 'P'):
+        img = img.convert('RGB')
+
+    keep_png = media_type in ('image/png', 'image/gif')
+    if keep_png and img.mode == 'RGB' and not grayscale:
+        # 彩色 PNG 量化为 256 色调色板，截图类图片几乎没有损失
+        img = img.quantize(256)
+
+    result = _encode_within_budget(img, keep_png, max_bytes)
+    for _ in range(MAX_SHRINK_STEPS):
+        if not max_bytes or len(result[0]) <= max_bytes or img.width < 200:
+            break
+        size = (max(1, round(img.width * SHRINK_FACTOR)), max(1, round(img.height * SHRINK_FACTOR)))
+        img = img.resize(size, Image.LANCZOS)
+        result = _encode_within_budget(img, keep_png, max_bytes)
+
+    # 缩放和灰度化是为了减小体积（Kindle 显示时会自行缩放和灰度化），
+    # 结果没有变小时使用原图，例如量化后反而变大的 PNG
+    if len(result[0]) >= len(content):
+        return original
+    return result
+
+
+def transcode_job(job):
+    """进程池入口：job 为 (content, ext, media_type, options)"""
+    content, ext, media_type, options = job
+    return transcode_image(content, ext, media_type, **options)
@@ -0,0 +1,117 @@
+"""
+已投递文章账本：记录哪些文章已经成功发送到 Kindle，实现增量推送
+
+生成 EPUB 时先把其中的文章记为待投递，邮件发送成功后才标记为已投递，
+发送失败的文章会在下次运行时重新推送。
+多个投递目标（Profiles）共用一个账本，文章标识带上目标名称，互不影响
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+
+LEDGER_FILENAME = 'ledger.sqlite3'
+
+
+def entry_key(entry):
+    """文章的唯一标识：优先使用 id/guid，其次使用链接，最后使用标题"""
+    key = entry.get('id') or entry.get('link')
+    if not key:
+        key = 'title:' + entry.get('title', '')
+    return key
+
+
+def entry_content_hash(entry):
+    """文章内容指纹：标题或摘要变化时视为更新过的文章"""
+    text = entry.get('title', '') + '\n' + entry.get('summary', entry.get('description', ''))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ArticleLedger:
+    """基于 SQLite 的已投递文章记录"""
+
+    def __init__(self, cache_dir, profile=None):
+        """
+        Args:
+            cache_dir: 缓存目录
+            profile: 投递目标名称，为空时使用默认目标
+        """
+        self.profile = profile
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, LEDGER_FILENAME)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS delivered (
+                key TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                feed TEXT,
+                delivered_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pending (
+                filename TEXT NOT NULL,
+                key TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                feed TEXT,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (filename, key)
+            );
+        ''')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def _key(self, entry):
+        key = entry_key(entry)
+        return f'{self.profile}|{key}' if self.profile else key
+
+    def is_delivered(self, entry):
+        """文章是否已经投递过（内容有变化的文章视为未投递）"""
+        row = self.conn.execute(
+            'SELECT content_hash FROM delivered WHERE key = ?', (self._key(entry),)
+        ).fetchone()
+        return row is not None and row[0] == entry_content_hash(entry)
+
+    def filter_new(self, entries):
+        """只保留尚未投递的文章"""
+        return [entry for entry in entries if not self.is_delivered(entry)]
+
+    def record_build(self, filename, feed_entries):
+        """记录一本 EPUB 中包含的文章，等待发送成功后再标记为已投递
+
+        Args:
+            filename: EPUB 文件名
+            feed_entries: {feed 名称: [条目, ...]}
+        """
+        now = time.time()
+        filename = os.path.basename(filename)
+        rows = [
+            (filename, self._key(entry), entry_content_hash(entry), feed, now)
+            for feed, entries in feed_entries.items()
+            for entry in entries
+        ]
+        with self.conn:
+            self.conn.execute('DELETE FROM pending WHERE filename = ?', (filename,))
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO pending (filename, key, content_hash, feed, created_at) '
+                'VALUES (?, ?, ?, ?, ?)', rows)
+
+    def mark_delivered(self, filename):
+        """EPUB 发送成功后，把其中的文章标记为已投递，返回标记的文章数量"""
+        filename = os.path.basename(filename)
+        now = time.time()
+        with self.conn:
+            cursor = self.conn.execute(
+                'INSERT OR REPLACE INTO delivered (key, content_hash, feed, delivered_at) '
+                'SELECT key, content_hash, feed, ? FROM pending WHERE filename = ?', (now, filename))
+            count = cursor.rowcount
+            self.conn.execute('DELETE FROM pending WHERE filename = ?', (filename,))
+        return count
+
+    def prune(self, max_age_days):
+        """删除过旧的记录，避免账本无限增长"""
+        cutoff = time.time() - max_age_days * 86400
+        with self.conn:
+            self.conn.execute('DELETE FROM delivered WHERE delivered_at < ?', (cutoff,))
+            self.conn.execute('DELETE FROM pending WHERE created_at < ?', (cutoff,))
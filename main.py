@@ -1,21 +1,27 @@
-import feedparser
+import argparse
 import yaml
 import os
 import json
 from datetime import datetime, timedelta
-from ebooklib import epub
 import re
-import base64
-import requests
-from urllib.parse import urlparse
-import urllib3
-from bs4 import BeautifulSoup
-from readability import Document
-from PIL import Image
+import hashlib
+from urllib.parse import urlparse, urljoin
 import io
-
-# 禁用 SSL 警告
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+# feedparser、bs4、readability、lxml、Pillow 等较重的库在用到的函数中才导入，
+# 仅发送（--send-only）或没有新文章的运行不必加载它们
+from cache import FeedStateStore, ImageCache, ArticleCache, DEFAULT_CACHE_DIR, shared
+from ledger import ArticleLedger, entry_key
+import dedup
+import http_client
+import metrics
+import polling
+import profiling
+import templates
+from epub_writer import StreamingEpubWriter, ImageSpool
+from budget import RunBudget, map_within_budget
 
 def load_config():
     """读取配置（优先从环境变量，其次从文件）"""
@@ -54,19 +60,242 @@ def load_config():
     
     raise FileNotFoundError("未找到配置文件或环境变量")
 
-def fetch_feed(url):
-    """拉取 RSS feed"""
-    return feedparser.parse(url)
+# 原始 XML 中的条目（RSS 的 item、Atom 的 entry，允许带命名空间前缀）
+FEED_ITEM_RE = re.compile(rb'<((?:[\w.-]+:)?(?:item|entry))\b[^>]*>.*?</\1\s*>', re.S)
+FEED_ITEM_CLOSE_RE = re.compile(rb'</(?:[\w.-]+:)?(?:item|entry)\s*>')
+# 条目日期，顺序与 feedparser 一致：先取发布时间，没有时取更新时间
+FEED_PUBLISHED_RE = re.compile(rb'<(?:[\w.-]+:)?(?:pubDate|published|date|issued)\b[^>]*>\s*([^<]+?)\s*</')
+FEED_UPDATED_RE = re.compile(rb'<(?:[\w.-]+:)?(?:updated|modified)\b[^>]*>\s*([^<]+?)\s*</')
+# 连续这么多个条目早于截止时间时停止扫描（容忍置顶文章等少量乱序）
+TRIM_STALE_RUN = 5
+# 用于定位结尾标签的范围
+TRIM_TAIL_WINDOW = 64 * 1024
+
+def parse_raw_item_date(item):
+    """从原始 XML 条目中读取日期时间戳，没有或无法识别时返回 None"""
+    from email.utils import parsedate_to_datetime
+    match = FEED_PUBLISHED_RE.search(item) or FEED_UPDATED_RE.search(item)
+    if not match:
+        return None
+    text = match.group(1).decode('utf-8', 'ignore').strip()
+    try:
+        if text[:4].isdigit():
+            value = datetime.fromisoformat(text.replace('Z', '+00:00'))
+        else:
+            value = parsedate_to_datetime(text)
+    except (TypeError, ValueError, IndexError):
+        return None
+    return value.timestamp()
 
-def filter_entries(entries, max_history):
-    """按日期过滤 RSS 条目"""
+def trim_feed_xml(content, max_entries=None, cutoff=None):
+    """在交给 feedparser 之前裁剪原始 XML，只保留前 max_entries 个、不早于 cutoff 的条目
+    
+    按顺序扫描条目，达到数量上限后停止，后面的条目不再扫描和解析。过期条目逐个丢弃；
+    只有已扫描的日期一直是倒序（新的在前）时，连续遇到多个过期条目才提前停止，
+    按时间正序排列或顺序不明的 feed 会扫描全部条目。
+    没有日期的条目保留，交给 feedparser 和 filter_entries 判断。
+    无法识别结构时返回原内容。
+    
+    Returns:
+        (裁剪后的内容, 是否裁剪)
+    """
+    if not max_entries and cutoff is None:
+        return content, False
+    # 最后一个条目之后的内容（</channel></rss>、</feed> 等）
+    tail_start = len(content) - TRIM_TAIL_WINDOW
+    closes = list(FEED_ITEM_CLOSE_RE.finditer(content, max(0, tail_start)))
+    if not closes:
+        return content, False
+    tail_start = closes[-1].end()
+    
+    head_end = None
+    kept = []
+    dropped = False
+    stale_run = 0
+    # 已扫描的日期是否出现过递减 / 递增
+    previous = None
+    descending = ascending = False
+    for match in FEED_ITEM_RE.finditer(content, 0, tail_start):
+        if head_end is None:
+            head_end = match.start()
+        if max_entries and len(kept) >= max_entries:
+            dropped = True
+            break
+        timestamp = parse_raw_item_date(match.group(0)) if cutoff is not None else None
+        if timestamp is not None:
+            if previous is not None:
+                descending = descending or timestamp < previous
+                ascending = ascending or timestamp > previous
+            previous = timestamp
+        if timestamp is not None and timestamp < cutoff:
+            dropped = True
+            stale_run += 1
+            if stale_run >= TRIM_STALE_RUN and descending and not ascending:
+                break
+            continue
+        stale_run = 0
+        kept.append(match.group(0))
+    if head_end is None or not dropped:
+        return content, False
+    return content[:head_end] + b'\n'.join(kept) + content[tail_start:], True
+
+def parse_feed_response(response, max_entries=None, cutoff=None):
+    """用 feedparser 解析 HTTP 响应，并补充状态码和缓存验证信息
+    
+    Args:
+        response: HTTP 响应
+        max_entries: 最多保留的条目数量
+        cutoff: 时间戳，早于它的条目在解析前丢弃（见 trim_feed_xml）
+    """
+    import feedparser
+    content, trimmed = trim_feed_xml(response.content, max_entries, cutoff)
+    if trimmed:
+        metrics.incr('feeds_trimmed')
+    parsed_feed = feedparser.parse(content, response_headers={
+        'content-type': response.headers.get('content-type', ''),
+        'content-location': response.url,
+    })
+    parsed_feed['status'] = response.status_code
+    parsed_feed['href'] = response.url
+    parsed_feed['etag'] = response.headers.get('ETag')
+    parsed_feed['modified'] = response.headers.get('Last-Modified')
+    # 无法裁剪原始 XML 时（例如非 UTF-8 兼容的编码）在解析后截断
+    if max_entries:
+        del parsed_feed.entries[max_entries:]
+    return parsed_feed
+
+def fetch_feed(url, store=None, timeout=None, limits=None, max_entries=None, cutoff=None):
+    """拉取 RSS feed
+    
+    通过共享的 HTTP 客户端请求（连接复用、超时和重试）。
+    提供 store 时发送条件请求（ETag / Last-Modified），
+    服务器返回 304 时直接复用上次缓存的条目，不再重新解析。
+    同时记录新条目出现的时间，按 limits（轮询间隔范围）计算下次轮询时间。
+    max_entries 和 cutoff 限制解析的条目，见 parse_feed_response
+    """
+    headers = {}
+    state = store.load(url) if store is not None else None
+    if state:
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('modified'):
+            headers['If-Modified-Since'] = state['modified']
+    limits = limits or polling.interval_limits({}, {})
+    
+    response = http_client.get(url, kind='feed', headers=headers, timeout=timeout)
+    if response.status_code == 304 and state:
+        try:
+            store.save_polling(url, state, polling.update(state.get('polling'), limits, []))
+        except Exception as e:
+            print(f"⚠️ 保存 feed 缓存失败 {url}: {e}")
+        return store.to_parsed(state)
+    
+    with metrics.stage('parse_feeds'):
+        parsed_feed = parse_feed_response(response, max_entries, cutoff)
+    if store is not None and response.status_code == 200:
+        try:
+            poll_state = polling.update(state and state.get('polling'), limits, parsed_feed.entries,
+                                        state['entries'] if state else None, parsed_feed.feed, response.content)
+            store.save(url, parsed_feed, poll_state)
+        except Exception as e:
+            print(f"⚠️ 保存 feed 缓存失败 {url}: {e}")
+    return parsed_feed
+
+@metrics.timed('fetch_feeds')
+def fetch_all_feeds(feeds, settings, store=None, budget=None):
+    """并发拉取所有 feed
+    
+    Args:
+        feeds: 需要拉取的 feed 配置列表
+        settings: 全局设置，读取 fetch_concurrency、fetch_per_host、adaptive_polling、max_history 和 max_entries
+        store: 可选的 FeedStateStore，用于条件请求和按更新频率跳过 feed
+        budget: 可选的 RunBudget，超出预算的 feed 视为拉取失败
+    
+    Returns:
+        与 feeds 顺序一致的解析结果列表，拉取失败的位置为 None；
+        未到轮询时间的 feed 为上次缓存的结果，带有 next_poll
+    """
+    max_workers = max(1, int(settings.get('fetch_concurrency', 8)))
+    per_host = max(1, int(settings.get('fetch_per_host', 2)))
+    adaptive = store is not None and settings.get('adaptive_polling', False)
+    # 早于 max_history 的条目在解析前就丢弃；多留一天余量，精确的过滤由 filter_entries 完成
+    max_history = settings.get('max_history', -1)
+    cutoff = time.time() - (max_history + 1) * 86400 if max_history != -1 else None
+    
+    # 每个主机一个信号量，避免同一个 RSSHub 实例被并发请求限流
+    host_limits = {}
+    host_lock = threading.Lock()
+    
+    def get_host_limit(url):
+        host = urlparse(url).netloc.lower()
+        with host_lock:
+            if host not in host_limits:
+                host_limits[host] = threading.Semaphore(per_host)
+            return host_limits[host]
+    
+    def fetch_one(feed):
+        url = feed['url']
+        limits = polling.interval_limits(feed, settings)
+        if adaptive:
+            state = store.load(url)
+            if state and not polling.is_due(state.get('polling')):
+                parsed_feed = store.to_parsed(state)
+                parsed_feed['next_poll'] = state['polling']['next_poll']
+                return parsed_feed, None, 0.0
+        with get_host_limit(url):
+            start = time.monotonic()
+            if budget is not None and budget.expired():
+                return None, TimeoutError('超出时间预算'), 0.0
+            timeout = budget.timeout(http_client.TIMEOUTS['feed']) if budget is not None else None
+            try:
+                parsed_feed = fetch_feed(url, store, timeout, limits,
+                                         feed.get('max_entries', settings.get('max_entries')), cutoff)
+                error = None
+            except Exception as e:
+                parsed_feed, error = None, e
+            return parsed_feed, error, time.monotonic() - start
+    
+    print(f"📡 开始拉取 {len(feeds)} 个 feed（并发 {max_workers}，每主机 {per_host}）...")
+    start = time.monotonic()
+    results = []
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    # 结果按提交顺序返回，保证目录顺序稳定
+    outcomes = map_within_budget(executor, fetch_one, feeds, budget, 'feed 拉取')
+    for feed, outcome in zip(feeds, outcomes):
+        parsed_feed, error, elapsed = outcome or (None, TimeoutError('超出时间预算'), 0.0)
+        name = feed.get('name') or feed.get('title') or feed['url']
+        if error is not None:
+            metrics.incr('feeds_failed')
+            print(f"  ✗ 拉取失败 {name}: {error}")
+        elif parsed_feed.get('next_poll'):
+            metrics.incr('feeds_skipped')
+            next_poll = datetime.fromtimestamp(parsed_feed['next_poll']).strftime('%m-%d %H:%M')
+            print(f"  ⏭️ {name} 未到轮询时间（下次 {next_poll}），使用缓存: {len(parsed_feed.entries)} 条")
+        elif parsed_feed.get('status') == 304:
+            metrics.incr('feeds_not_modified')
+            print(f"  ✓ {name} 未更新，使用缓存: {len(parsed_feed.entries)} 条，耗时 {elapsed:.2f}s")
+        else:
+            metrics.incr('feeds_fetched')
+            print(f"  ✓ 已拉取 {name}: {len(parsed_feed.entries)} 条，耗时 {elapsed:.2f}s")
+        results.append(parsed_feed)
+    print(f"📡 feed 拉取完成，总耗时 {time.monotonic() - start:.2f}s")
+    return results
+
+def filter_entries(entries, max_history, ledger=None):
+    """按日期过滤 RSS 条目，提供 ledger 时同时去掉已经投递过的条目
+    
+    使用发布时间，没有发布时间时使用更新时间；两者都没有的条目被丢弃
+    """
+    if ledger is not None:
+        entries = ledger.filter_new(entries)
     if max_history == -1:
         return entries
     cutoff_date = datetime.now() - timedelta(days=max_history)
     filtered = []
     for entry in entries:
-        if 'published_parsed' in entry:
-            entry_date = datetime(*entry.published_parsed[:6])
+        date_parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+        if date_parsed:
+            entry_date = datetime(*date_parsed[:6])
             if entry_date >= cutoff_date:
                 filtered.append(entry)
     return filtered
@@ -75,193 +304,258 @@ def sanitize_filename(name):
     """清理文件名非法字符"""
     return "".join(c if c.isalnum() else "_" for c in name)
 
-def resolve_link_content(url, config=None):
+def compile_selectors(selectors):
+    """把逗号分隔的选择器字符串（或列表）编译为 CSSSelector 列表，保持原有顺序"""
+    from lxml.cssselect import CSSSelector
+    from cssselect import SelectorError
+    if isinstance(selectors, str):
+        selectors = [s.strip() for s in selectors.split(',')]
+    compiled = []
+    for selector in selectors or []:
+        if not selector:
+            continue
+        try:
+            compiled.append(CSSSelector(selector, translator='html'))
+        except SelectorError as e:
+            print(f"⚠️ 无效的CSS选择器 {selector}: {e}")
+    return compiled
+
+def compile_resolve_config(config):
+    """预编译 feed 的解析配置，每个 feed 每次运行只需编译一次
+    
+    结果中的 key 是配置的指纹，用作全文缓存键的一部分，修改选择器后缓存自动失效
+    """
+    if not config or not isinstance(config, dict):
+        return {'compiled': True, 'remove': [], 'content': [], 'config': config, 'key': 'default'}
+    if config.get('compiled'):
+        return config
+    selectors = config.get('selectors') or {}
+    config_json = json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+    return {
+        'compiled': True,
+        'remove': compile_selectors(selectors.get('remove')),
+        'content': compile_selectors(selectors.get('content')),
+        'config': config,
+        'key': hashlib.sha1(config_json.encode('utf-8')).hexdigest()[:16],
+    }
+
+def parse_html_document(response):
+    """用 lxml 解析网页，编码优先取 HTTP 头，其次取页面声明"""
+    import lxml.html
+    from readability.encoding import get_encoding
+    content_type = response.headers.get('content-type', '')
+    if 'charset=' in content_type.lower():
+        encoding = response.encoding
+    else:
+        encoding = get_encoding(response.content)
+    parser = lxml.html.HTMLParser(encoding=encoding)
+    return lxml.html.document_fromstring(response.content, parser=parser)
+
+def open_article_cache(settings):
+    """根据设置创建全文缓存，article_cache 为 false 时返回 None"""
+    if not settings.get('article_cache', True):
+        return None
+    max_mb = settings.get('article_cache_max_mb', 100)
+    return shared(
+        ArticleCache,
+        settings.get('cache_dir') or DEFAULT_CACHE_DIR,
+        max_bytes=int(max_mb * 1024 * 1024) if max_mb else None,
+        ttl=float(settings.get('article_cache_ttl_hours', 24)) * 3600,
+        failure_ttl=float(settings.get('article_cache_failure_ttl_hours', 6)) * 3600,
+    )
+
+@metrics.timed('extract_articles')
+def extract_article(response, compiled):
+    """从网页响应中提取正文"""
+    import lxml.html
+    from readability import Document
+    # 只解析一次，选择器和 readability 共用同一棵文档树
+    doc_tree = parse_html_document(response)
+    
+    # 方案3: CSS选择器提取
+    # 移除不需要的元素
+    for selector in compiled['remove']:
+        for elem in selector(doc_tree):
+            elem.drop_tree()
+    
+    # 提取内容，找到第一个匹配的选择器就停止
+    for selector in compiled['content']:
+        elements = selector(doc_tree)
+        if elements:
+            return '\n'.join(lxml.html.tostring(elem, encoding='unicode', with_tail=False) for elem in elements)
+    
+    # 方案2: 选择器未配置或失败时使用readability自动提取
+    doc = Document(doc_tree, url=response.url)
+    return doc.summary()
+
+def resolve_link_content(url, config=None, cache=None, budget=None):
     """从原始链接解析内容
     
     Args:
         url: 要解析的URL
-        config: 解析配置，包含选择器等信息
+        config: 解析配置，包含选择器等信息（也可以是 compile_resolve_config 的结果）
+        cache: 可选的 ArticleCache，有效期内直接返回缓存，过期后用条件请求重新验证
+        budget: 可选的 RunBudget，请求超时不超过剩余预算
     
     Returns:
         解析后的HTML内容，失败返回None
     """
+    compiled = compile_resolve_config(config)
+    cached = cache.lookup(url, compiled['key']) if cache is not None else None
+    if cached and cached['fresh']:
+        return cached['content']
+    
+    # 超时被预算缩短时失败不代表站点有问题，不记录失败
+    timeout = budget.timeout(http_client.TIMEOUTS['page']) if budget is not None else None
+    cache_failure = cache is not None and (timeout is None or timeout >= http_client.TIMEOUTS['page'])
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-        }
+        headers = {}
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
         
-        response = requests.get(url, headers=headers, timeout=15, verify=False)
+        response = http_client.get(url, kind='page', headers=headers, timeout=timeout)
+        if response.status_code == 304 and cached:
+            cache.refresh(cached['key'])
+            return cached['content']
         if response.status_code != 200:
+            if cache is not None:
+                cache.put_failure(url, compiled['key'])
             return None
-            
-        html_content = response.text
-        soup = BeautifulSoup(html_content, 'html.parser')
         
-        # 如果配置中有选择器，优先使用选择器
-        if config and isinstance(config, dict):
-            # 方案3: CSS选择器提取
-            if 'selectors' in config:
-                selectors = config['selectors']
-                
-                # 移除不需要的元素
-                if 'remove' in selectors:
-                    remove_selectors = selectors['remove']
-                    if isinstance(remove_selectors, str):
-                        remove_selectors = [s.strip() for s in remove_selectors.split(',')]
-                    
-                    for selector in remove_selectors:
-                        for elem in soup.select(selector):
-                            elem.decompose()
-                
-                # 提取内容
-                if 'content' in selectors:
-                    content_selectors = selectors['content']
-                    if isinstance(content_selectors, str):
-                        content_selectors = [s.strip() for s in content_selectors.split(',')]
-                    
-                    extracted_content = []
-                    for selector in content_selectors:
-                        elements = soup.select(selector)
-                        if elements:
-                            for elem in elements:
-                                extracted_content.append(str(elem))
-                            break  # 找到第一个匹配的选择器就停止
-                    
-                    if extracted_content:
-                        return '\n'.join(extracted_content)
-            
-            # 如果配置指定使用readability或选择器失败，使用fallback
-            if config.get('method') == 'readability' or config.get('fallback') == 'readability':
-                # 方案2: 使用readability自动提取
-                doc = Document(html_content)
-                return doc.summary()
-        
-        # 默认使用readability
-        doc = Document(html_content)
-        return doc.summary()
+        content = extract_article(response, compiled)
+        if cache is not None:
+            if content:
+                cache.put(url, response.url, compiled['key'], content,
+                          response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            else:
+                cache.put_failure(url, compiled['key'])
+        return content
         
     except Exception as e:
         print(f"解析链接失败 {url}: {e}")
+        if cache_failure:
+            cache.put_failure(url, compiled['key'])
         return None
 
-def extract_images_from_html(html_content):
-    """从 HTML 内容中提取图片 URL"""
-    img_pattern = r'<img[^>]+src=["\']([^"\']+)["\'][^>]*>'
-    return re.findall(img_pattern, html_content, re.IGNORECASE)
+# 懒加载图片常用的真实地址属性，优先于 src（src 往往是占位图）
+LAZY_SRC_ATTRS = ('data-src', 'data-original', 'data-lazy-src', 'data-actualsrc')
+LAZY_SRCSET_ATTRS = ('data-srcset', 'srcset')
 
-def download_image_as_base64(url, timeout=10):
-    """下载图片并转换为 base64，WebP格式自动转换为JPEG"""
-    try:
-        # 更完整的请求头，模拟真实浏览器
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Cache-Control': 'no-cache',
-            'Pragma': 'no-cache',
-            'Sec-Fetch-Dest': 'image',
-            'Sec-Fetch-Mode': 'no-cors',
-            'Sec-Fetch-Site': 'cross-site',
-        }
-        
-        # 添加 Referer 头（从 URL 推断）
-        parsed = urlparse(url)
-        if parsed.netloc:
-            headers['Referer'] = f'{parsed.scheme}://{parsed.netloc}/'
-        
-        response = requests.get(url, timeout=timeout, headers=headers, verify=False)
-        if response.status_code == 200:
-            # 获取图片类型
-            content_type = response.headers.get('content-type', 'image/jpeg')
-            if 'image' in content_type or len(response.content) > 100:  # 确保有内容
-                # 检查是否为WebP格式
-                is_webp = 'webp' in content_type.lower() or url.lower().endswith('.webp')
-                
-                if is_webp:
-                    try:
-                        # 将WebP转换为JPEG
-                        img = Image.open(io.BytesIO(response.content))
-                        # 如果是RGBA模式，转换为RGB
-                        if img.mode == 'RGBA':
-                            # 创建白色背景
-                            background = Image.new('RGB', img.size, (255, 255, 255))
-                            background.paste(img, mask=img.split()[3])  # 使用alpha通道作为mask
-                            img = background
-                        elif img.mode != 'RGB':
-                            img = img.convert('RGB')
-                        
-                        # 转换为JPEG
-                        output = io.BytesIO()
-                        img.save(output, format='JPEG', quality=85)
-                        img_data = output.getvalue()
-                        img_base64 = base64.b64encode(img_data).decode('utf-8')
-                        content_type = 'image/jpeg'
-                    except Exception:
-                        # 如果转换失败，使用原始数据
-                        img_base64 = base64.b64encode(response.content).decode('utf-8')
-                else:
-                    # 非WebP格式，直接使用
-                    img_base64 = base64.b64encode(response.content).decode('utf-8')
-                
-                # 如果没有明确的 content-type，尝试从 URL 推断
-                if 'image' not in content_type:
-                    if '.png' in url.lower():
-                        content_type = 'image/png'
-                    elif '.gif' in url.lower():
-                        content_type = 'image/gif'
-                    else:
-                        content_type = 'image/jpeg'
-                return f"data:{content_type};base64,{img_base64}"
-    except Exception as e:
-        # 静默处理错误，避免过多输出
-        pass
-    return None
+def pick_srcset_url(srcset):
+    """从 srcset 中选出分辨率最高的候选地址"""
+    best_url, best_size = None, -1.0
+    for candidate in srcset.split(','):
+        parts = candidate.strip().split()
+        if not parts:
+            continue
+        size = 1.0
+        if len(parts) > 1 and parts[1][-1:] in ('w', 'x'):
+            try:
+                size = float(parts[1][:-1])
+            except ValueError:
+                pass
+        if size > best_size:
+            best_url, best_size = parts[0], size
+    return best_url
 
-def process_content_images(content, load_images=True):
-    """处理内容中的图片，将其转换为 base64 嵌入"""
-    if not load_images:
-        # 如果不加载图片，移除所有 img 标签
-        return re.sub(r'<img[^>]*>', '', content)
-    
-    # 提取所有图片 URL
-    img_urls = extract_images_from_html(content)
-    
-    # 存储成功下载的图片
-    embedded_images = []
-    
-    # 替换图片 URL 为 base64
-    for img_url in img_urls:
-        base64_img = download_image_as_base64(img_url)
-        if base64_img:
-            # 创建新的 img 标签，确保格式正确
-            new_img_tag = f'<img src="{base64_img}" alt="图片"/>'
-            # 替换原始的 img 标签
-            img_pattern = f'<img[^>]*src=["\']?{re.escape(img_url)}["\']?[^>]*>'
-            content = re.sub(img_pattern, new_img_tag, content)
-            embedded_images.append(img_url[:50])
-        else:
-            # 如果无法下载，保留原始 URL
-            pass
+def get_image_url(img, base_url=None):
+    """获取 img（或 picture 中 source）元素的真实图片地址，没有可下载地址时返回 None"""
+    url = None
+    for attr in LAZY_SRC_ATTRS:
+        if img.get(attr):
+            url = img[attr]
+            break
+    if not url and img.get('src') and not img['src'].startswith('data:'):
+        url = img['src']
+    if not url:
+        for attr in LAZY_SRCSET_ATTRS:
+            if img.get(attr):
+                url = pick_srcset_url(img[attr])
+                if url:
+                    break
+    if not url and img.parent is not None and img.parent.name == 'picture':
+        for source in img.parent.find_all('source'):
+            if source.get('srcset'):
+                url = pick_srcset_url(source['srcset'])
+                if url:
+                    break
+    if not url or url.startswith('data:'):
+        return None
+    url = url.strip()
+    if base_url:
+        url = urljoin(base_url, url)
+    return url
+
+def parse_html_fragment(html_content):
+    """解析文章 HTML 片段"""
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html_content, 'html.parser')
+
+def extract_images_from_html(html_content, base_url=None):
+    """从 HTML 内容中提取图片 URL（支持懒加载属性、srcset 和 picture）"""
+    soup = parse_html_fragment(html_content)
+    urls = []
+    for img in soup.find_all('img'):
+        url = get_image_url(img, base_url)
+        if url:
+            urls.append(url)
+    return urls
+
+def rewrite_images(html_content, replace, base_url=None, drop_urls=None):
+    """一次遍历替换 HTML 中的所有图片
     
-    if embedded_images:
-        print(f"  ✓ 成功嵌入 {len(embedded_images)} 张图片")
+    Args:
+        html_content: 文章 HTML
+        replace: 回调函数，参数为图片 URL，返回新的 src；返回 None 时保留原图片
+        base_url: 解析相对地址使用的基准 URL
+        drop_urls: replace 返回 None 时，地址在其中的图片被移除，其他图片保留原样
     
-    return content
+    Returns:
+        替换后的 HTML
+    """
+    soup = parse_html_fragment(html_content)
+    for img in soup.find_all('img'):
+        url = get_image_url(img, base_url)
+        new_src = replace(url) if url else None
+        # picture 中的其他 source 不再需要，整体替换为单个 img
+        target = img.parent if img.parent is not None and img.parent.name == 'picture' else img
+        if not new_src:
+            if drop_urls and url in drop_urls:
+                target.decompose()
+            continue
+        target.replace_with(soup.new_tag('img', src=new_src, alt=img.get('alt') or '图片'))
+    return str(soup)
+
+def strip_images(html_content):
+    """移除 HTML 中的所有图片（包括 picture 元素）"""
+    soup = parse_html_fragment(html_content)
+    for elem in soup.find_all(['picture', 'img']):
+        elem.decompose()
+    return str(soup)
 
-def download_and_add_image(book, url, img_id):
-    """下载图片并添加到 EPUB 书籍中，WebP格式自动转换为JPEG"""
+def download_image(url, timeout=10, cache=None):
+    """下载图片，WebP格式自动转换为JPEG
+    
+    Args:
+        url: 图片 URL
+        timeout: 请求超时（秒）
+        cache: 可选的 ImageCache，命中时跳过下载和格式转换
+    
+    Returns:
+        (图片内容, 扩展名, 媒体类型)，失败返回 None
+    """
+    if cache is not None:
+        cached = cache.get(url)
+        if cached:
+            return cached
+    
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-            'Referer': urlparse(url).scheme + '://' + urlparse(url).netloc + '/'
-        }
-        
-        response = requests.get(url, timeout=10, headers=headers, verify=False)
+        # 添加 Referer 头（从 URL 推断），部分站点的防盗链需要
+        headers = {'Referer': urlparse(url).scheme + '://' + urlparse(url).netloc + '/'}
+        response = http_client.get(url, kind='image', headers=headers, timeout=timeout)
         if response.status_code == 200 and len(response.content) > 100:
             # 确定图片类型
             content_type = response.headers.get('content-type', '')
@@ -272,6 +566,7 @@ def download_and_add_image(book, url, img_id):
             
             if is_webp:
                 try:
+                    from PIL import Image
                     # 将WebP转换为JPEG
                     img = Image.open(io.BytesIO(response.content))
                     # 如果是RGBA模式，转换为RGB
@@ -303,428 +598,459 @@ def download_and_add_image(book, url, img_id):
                 ext = 'jpg'
                 media_type = 'image/jpeg'
             
-            # 创建 EPUB 图片项
-            img_name = f'img_{img_id}.{ext}'
-            img_item = epub.EpubImage()
-            img_item.uid = f'image_{img_id}'
-            img_item.file_name = f'images/{img_name}'
-            img_item.media_type = media_type
-            img_item.content = img_content
-            
-            book.add_item(img_item)
-            return f'images/{img_name}'
+            if cache is not None:
+                cache.put(url, img_content, ext, media_type)
+            return img_content, ext, media_type
     except:
         pass
     return None
 
-def convert_to_epub(feeds, load_images=True, feeds_config=None, custom_filename=None):
-    """将 RSS feed 转换为精美的 EPUB 电子书"""
-    book = epub.EpubBook()
-    
-    # 设置书籍元数据
-    current_date = datetime.now()
-    book.set_identifier(f'rss-compilation-{current_date.strftime("%Y%m%d%H%M%S")}')
-    book.set_title('RSS 推送')
-    book.set_language('zh')
-    book.add_author('KindleRSS')
-    book.add_metadata('DC', 'description', '精心整理的 RSS 订阅内容合集')
-    book.add_metadata('DC', 'date', current_date.strftime('%Y-%m-%d'))
-    
-    # 创建自定义主目录页 (Primary TOC)
-    main_toc_page = epub.EpubHtml(title='目录', file_name='main_toc.xhtml', lang='zh')
-    main_toc_content = f'''
-    <html xmlns="http://www.w3.org/1999/xhtml">
-    <head>
-        <title>目录</title>
-        <style>
-            a {{ color: black; text-decoration: underline; }}
-            ul {{ margin: 30px auto; max-width: 600px; }}
-            li {{ margin: 15px 0; }}
-            img {{ 
-                page-break-inside: avoid;
-                break-inside: avoid;
-                display: block;
-                max-width: 100%;
-                height: auto;
-            }}
-            figure {{
-                page-break-inside: avoid;
-                break-inside: avoid;
-            }}
-        </style>
-    </head>
-    <body>
-        <center>
-            <h1>RSS 推送</h1>
-            <p>{datetime.now().strftime('%Y-%m-%d')}</p>
-        </center>
-        <br/>
-        <ul>
-    '''
-    
-    book.spine = ['nav', main_toc_page]  # nav first, then custom TOC
-    book.toc = []
-    all_articles = []  # 存储所有文章用于导航
-    img_counter = 0  # 图片计数器
-    feed_index_pages = []  # 存储所有 feed 索引页信息
-    
-    feed_list = list(feeds.items())
-    for feed_idx, (feed_key, feed_data) in enumerate(feed_list):
-        # 处理新旧数据格式兼容性
-        if isinstance(feed_data, dict) and 'entries' in feed_data:
-            entries = feed_data['entries']
-            feed_meta = feed_data.get('feed_meta', {})
-            config_name = feed_data.get('config_name')
+def add_image_to_book(writer, img_id, img_content, ext, media_type):
+    """将已下载的图片写入 EPUB，返回书内路径"""
+    img_path = f'images/img_{img_id}.{ext}'
+    writer.add_image(img_path, img_content, media_type)
+    return img_path
+
+def open_image_cache(settings):
+    """根据设置创建图片缓存，image_cache 为 false 时返回 None"""
+    if not settings.get('image_cache', True):
+        return None
+    max_mb = settings.get('image_cache_max_mb', 200)
+    max_age_days = settings.get('image_cache_max_age_days')
+    return shared(
+        ImageCache,
+        settings.get('cache_dir') or DEFAULT_CACHE_DIR,
+        max_bytes=int(max_mb * 1024 * 1024) if max_mb else None,
+        max_age=max_age_days * 86400 if max_age_days else None,
+    )
+
+def get_transcode_options(settings):
+    """读取图片转码设置，全部未开启时返回 None"""
+    options = {
+        'max_width': int(settings.get('image_max_width') or 0) or None,
+        'grayscale': bool(settings.get('image_grayscale', False)),
+        'max_bytes': int((settings.get('image_max_kb') or 0) * 1024) or None,
+    }
+    if not any(options.values()):
+        return None
+    return options
+
+def format_size(num_bytes):
+    """把字节数格式化为便于阅读的字符串"""
+    if num_bytes >= 1024 * 1024:
+        return f"{num_bytes / (1024 * 1024):.2f} MB"
+    return f"{num_bytes / 1024:.1f} KB"
+
+def open_transcode_pool(max_workers=None):
+    """创建图片转码进程池，充分利用多核执行 Pillow 处理
+
+    子进程在下载线程中按需启动，此时其他线程可能持有锁（连接池、sqlite 等），
+    fork 出的子进程可能因此死锁，所以用 spawn 启动（子进程只需要导入 image_transcode）。
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    try:
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 无法使用进程池转码图片，改为在下载线程中处理: {e}")
+        return None
+
+# download_images 中因时间预算用完而没有下载的图片
+BUDGET_SKIPPED = object()
+
+@metrics.timed('download_images')
+def download_images(writer, urls, max_workers=8, cache=None, transcode_options=None, transcode_workers=None,
+                    budget=None, skipped=None):
+    """下载一本书用到的全部图片，每个 URL 只下载并保存一次
+    
+    每张图片下载、转码后立即写入 EPUB 并释放，内存中最多只有并发数量的图片。
+    
+    Args:
+        writer: StreamingEpubWriter
+        urls: 图片 URL 列表（可以重复），按优先级排列
+        max_workers: 同时下载的图片数量
+        cache: 可选的 ImageCache
+        transcode_options: 可选的转码设置，见 get_transcode_options
+        transcode_workers: 转码进程数
+        budget: 可选的 RunBudget，超出预算的图片不再下载，来不及转码的图片保持原样
+        skipped: 可选的集合，加入因时间预算用完而没有下载的 URL（不包括普通的下载失败）
+    
+    Returns:
+        {url: 书内路径}，下载失败的 URL 不在结果中
+    """
+    unique_urls = list(dict.fromkeys(urls))
+    if not unique_urls:
+        return {}
+    from concurrent.futures.process import BrokenProcessPool
+    from image_transcode import transcode_job
+    
+    # 转码结果以 “URL#转码参数” 为键缓存，修改转码设置后自动失效
+    variant = None
+    pool = None
+    if transcode_options:
+        variant = '#' + ','.join(f'{k}={v}' for k, v in sorted(transcode_options.items()))
+        pool = open_transcode_pool(transcode_workers)
+    pool_lock = threading.Lock()
+    
+    def transcode(url, image):
+        """转码一张图片，返回 (结果, 是否完成转码)"""
+        nonlocal pool
+        job = (*image, transcode_options)
+        if pool is not None:
+            try:
+                future = pool.submit(transcode_job, job)
+                return future.result(timeout=budget.remaining() if budget is not None else None), True
+            except FutureTimeoutError:
+                budget.mark_exhausted('图片转码')
+                return image, False
+            except (OSError, BrokenProcessPool) as e:
+                # 无法创建子进程时（例如受限环境）退回到当前线程中处理
+                with pool_lock:
+                    if pool is not None:
+                        print(f"⚠️ 无法使用进程池转码图片，改为在下载线程中处理: {e}")
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        pool = None
+        if budget is not None and budget.expired():
+            return image, False
+        return transcode_job(job), True
+    
+    def fetch_one(item):
+        img_id, url = item
+        if variant and cache is not None:
+            cached = cache.get(url + variant)
+            if cached:
+                return add_image_to_book(writer, img_id, *cached), None
+        if budget is None:
+            image = download_image(url, cache=cache)
+        elif budget.expired():
+            return BUDGET_SKIPPED
         else:
-            # 兼容旧格式（直接是 entries 列表）
-            entries = feed_data
-            feed_meta = {}
-            config_name = None
-            
-        if not entries:
+            image = download_image(url, budget.timeout(http_client.TIMEOUTS['image']), cache)
+        if not image:
+            # 下载超时被预算截短时也算作因预算跳过；普通的下载失败返回 False
+            return BUDGET_SKIPPED if budget is not None and budget.expired() else False
+        sizes = None
+        if variant:
+            with metrics.overlapping_stage('transcode_images'):
+                result, done = transcode(url, image)
+            if done:
+                sizes = (len(image[0]), len(result[0]))
+                if cache is not None:
+                    cache.put(url + variant, *result)
+            image = result
+        return add_image_to_book(writer, img_id, *image), sizes
+    
+    print(f"🖼️ 开始下载 {len(unique_urls)} 张图片（共 {len(urls)} 处引用，并发 {max_workers}）...")
+    start = time.monotonic()
+    local_images = {}
+    transcoded = total_before = total_after = 0
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    jobs = list(enumerate(unique_urls, 1))
+    try:
+        outcomes = map_within_budget(executor, fetch_one, jobs, budget, '图片下载')
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    for url, outcome in zip(unique_urls, outcomes):
+        if outcome is None or outcome is BUDGET_SKIPPED:
+            # 没有在预算内完成（map_within_budget 对未完成的任务返回 None）
+            if skipped is not None:
+                skipped.add(url)
+            outcome = None
+        if not outcome:
+            metrics.incr('images_failed')
             continue
-            
-        # 优先使用 config name, 其次 feed title, 最后用 feed_key
-        feed_name = config_name or feed_meta.get('title', feed_key)
-        
-        # 创建 feed 索引页（Secondary TOC）
-        index_file = sanitize_filename(feed_name) + "_toc.xhtml"
-        feed_index_page = epub.EpubHtml(title=feed_name, file_name=index_file, lang='zh')
-        
-        # 添加到主目录页
-        main_toc_content += f'            <li><a href="{index_file}">{feed_name}</a></li>\n'
-        
-        # 确定前后导航
-        prev_feed_link = ""
-        next_feed_link = ""
-        if feed_idx > 0:
-            # 获取前一个 feed 的名称
-            prev_key, prev_data = feed_list[feed_idx-1]
-            if isinstance(prev_data, dict) and 'entries' in prev_data:
-                prev_name = prev_data.get('config_name') or prev_data.get('feed_meta', {}).get('title', prev_key)
-            else:
-                prev_name = prev_key
-            prev_feed_file = sanitize_filename(prev_name) + "_toc.xhtml"
-            prev_feed_link = f'<a href="{prev_feed_file}">Prev</a>'
-        if feed_idx < len(feed_list) - 1:
-            # 获取下一个 feed 的名称
-            next_key, next_data = feed_list[feed_idx+1]
-            if isinstance(next_data, dict) and 'entries' in next_data:
-                next_name = next_data.get('config_name') or next_data.get('feed_meta', {}).get('title', next_key)
-            else:
-                next_name = next_key
-            next_feed_file = sanitize_filename(next_name) + "_toc.xhtml"
-            next_feed_link = f'<a href="{next_feed_file}">Next</a>'
+        metrics.incr('images_downloaded')
+        local_images[url], sizes = outcome
+        if sizes:
+            transcoded += 1
+            total_before += sizes[0]
+            total_after += sizes[1]
+            print(f"    {format_size(sizes[0])} → {format_size(sizes[1])}  {url[:80]}")
+    if transcoded:
+        print(f"🖼️ 图片转码：{transcoded} 张，{format_size(total_before)} → {format_size(total_after)}")
+        metrics.incr('images_transcoded', transcoded)
+        metrics.incr('image_bytes_original', total_before)
+        metrics.incr('image_bytes_transcoded', total_after)
+    
+    cache_info = ""
+    if cache is not None:
+        cache.save()
+        metrics.incr('image_cache_hits', cache.hits)
+        metrics.incr('image_cache_misses', cache.misses)
+        cache_info = f"，缓存命中 {cache.hits}"
+    print(f"🖼️ 图片处理完成：成功 {len(local_images)}/{len(unique_urls)}{cache_info}，耗时 {time.monotonic() - start:.2f}s")
+    return local_images
+
+def get_entry_content(entry, resolved_content=None):
+    """返回文章正文：优先使用解析到的原始内容，否则使用RSS摘要"""
+    if resolved_content:
+        return resolved_content
+    return entry.get('summary', entry.get('description', '暂无摘要'))
+
+def get_extra_images(entry):
+    """收集条目附带的媒体图片（media_content 或图片类型的 enclosure）"""
+    extra_images = []
+    if hasattr(entry, 'media_content') and entry.media_content:
+        for media in entry.media_content:
+            if 'url' in media:
+                extra_images.append(media['url'])
+    elif hasattr(entry, 'enclosures') and entry.enclosures:
+        for enclosure in entry.enclosures:
+            if enclosure.type and enclosure.type.startswith('image/'):
+                extra_images.append(enclosure.href)
+    return extra_images
+
+def get_feed_entries(feed_data):
+    """兼容新旧数据格式，返回 feed 的条目列表"""
+    if isinstance(feed_data, dict) and 'entries' in feed_data:
+        return feed_data['entries']
+    return feed_data
+
+def get_feed_config(feeds_config, feed_key, feed_data):
+    """查找 feed 的配置：feeds_config 与 feeds 使用相同的键，兼容按配置名称索引的旧调用方式"""
+    if not feeds_config:
+        return {}
+    config_name = feed_data.get('config_name') if isinstance(feed_data, dict) else None
+    return feeds_config.get(feed_key) or feeds_config.get(config_name) or {}
+
+def feeds_by_priority(feeds, feeds_config=None):
+    """按 feed 配置中的 priority（越大越优先）排序，优先级相同时保持原顺序"""
+    return sorted(feeds.items(),
+                  key=lambda item: -get_feed_config(feeds_config, *item).get('priority', 0))
+
+def remove_duplicate_entries(feeds, feeds_config=None, max_distance=dedup.DEFAULT_MAX_DISTANCE):
+    """跨 feed 去重：同一篇文章只保留优先级最高的 feed 中的一份
+    
+    被去掉的条目不再解析全文和下载图片，记在所在 feed 的 duplicates 中：
+    [(条目, 保留的 feed 标识, 保留的条目)]，该 feed 的索引页链接到保留的那一份。
+    
+    Returns:
+        去掉的条目数量
+    """
+    ordered = [(feed_key, get_feed_entries(feed_data) or [])
+               for feed_key, feed_data in feeds_by_priority(feeds, feeds_config)]
+    duplicates = dedup.find_duplicates(ordered, max_distance)
+    for feed_key, entries in ordered:
+        removed = [(entry, *duplicates[(feed_key, position)])
+                   for position, entry in enumerate(entries) if (feed_key, position) in duplicates]
+        if removed:
+            feeds[feed_key]['entries'] = [entry for position, entry in enumerate(entries)
+                                          if (feed_key, position) not in duplicates]
+            feeds[feed_key]['duplicates'] = removed
+    return len(duplicates)
+
+@metrics.timed('resolve_articles')
+def resolve_articles(feeds, feeds_config=None, max_workers=8, cache=None, budget=None):
+    """并发解析所有需要提取全文的文章
+    
+    Args:
+        feeds: {feed 标题: {'entries': 条目列表, 'config_name': 配置名称, 'feed_meta': feed 元数据}}
+        feeds_config: 每个 feed 的配置
+        max_workers: 同时解析的文章数量
+        cache: 可选的 ArticleCache
+        budget: 可选的 RunBudget，高优先级 feed 先解析，超出预算的文章使用RSS摘要
+    
+    Returns:
+        {feed_key: {条目标识（entry_key）: 解析后的内容或 None}}
+    """
+    results = {}
+    jobs = []
+    for feed_key, feed_data in feeds_by_priority(feeds, feeds_config):
+        entries = get_feed_entries(feed_data) or []
+        results[feed_key] = {}
         
-        # 构建导航栏 - 根据上下文调整文字
-        nav_parts = []
-        has_prev = bool(prev_feed_link)
-        has_next = bool(next_feed_link)
+        feed_config = get_feed_config(feeds_config, feed_key, feed_data)
+        resolve_config = feed_config.get('resolve_link', None)
+        if not resolve_config:
+            continue
+        # 每个 feed 的选择器只编译一次
+        resolve_config = compile_resolve_config(resolve_config)
         
-        if has_prev and has_next:
-            # 完整导航: Prev | Main menu | Next
-            nav_parts.append(prev_feed_link)
-            nav_parts.append('<a href="main_toc.xhtml">Main menu</a>')
-            nav_parts.append(next_feed_link)
-        elif has_prev and not has_next:
-            # 最后一个: Previous | Main menu
-            prev_feed_link = prev_feed_link.replace('>Prev<', '>Previous<')
-            nav_parts.append(prev_feed_link)
-            nav_parts.append('<a href="main_toc.xhtml">Main menu</a>')
-        elif not has_prev and has_next:
-            # 第一个: Main menu | Next
-            nav_parts.append('<a href="main_toc.xhtml">Main menu</a>')
-            nav_parts.append(next_feed_link)
+        for entry in entries:
+            if entry.get('link'):
+                jobs.append((feed_key, entry_key(entry), entry, resolve_config))
+    
+    if not jobs:
+        return results
+    
+    def resolve_one(job):
+        _, _, entry, resolve_config = job
+        if budget is not None and budget.expired():
+            return None
+        return resolve_link_content(entry.link, resolve_config, cache, budget)
+    
+    print(f"🔍 开始解析 {len(jobs)} 篇文章的原始内容（并发 {max_workers}）...")
+    start = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    for (feed_key, key, entry, _), content in zip(jobs, map_within_budget(executor, resolve_one, jobs, budget, '全文解析')):
+        results[feed_key][key] = content
+        title = entry.get('title', '')
+        if content:
+            metrics.incr('articles_resolved')
+            print(f"  ✓ 已解析原始内容: {title[:30]}...")
         else:
-            # 只有一个 feed: Main menu
-            nav_parts.append('<a href="main_toc.xhtml">Main menu</a>')
-            
-        navigation_bar = ' | '.join(nav_parts)
-        
-        # 获取 feed subtitle
-        feed_subtitle = ""
-        if 'title_detail' in feed_meta and 'subtitle' in feed_meta.get('title_detail', {}):
-            feed_subtitle = feed_meta['title_detail']['subtitle']
-        elif 'subtitle' in feed_meta:
-            feed_subtitle = feed_meta.get('subtitle', '')
-            
-        # 构建 feed 索引页内容
-        index_content = f'''
-        <html xmlns="http://www.w3.org/1999/xhtml">
-        <head>
-            <title>{feed_name}</title>
-            <style>
-                a {{ color: black; text-decoration: underline; }}
-                .nav {{ margin: 20px 0; padding: 10px; }}
-                .description-preview {{ 
-                    color: #666; 
-                    font-size: 0.9em; 
-                    margin-left: 20px; 
-                    margin-top: 5px;
-                }}
-                img {{ 
-                    page-break-inside: avoid;
-                    break-inside: avoid;
-                    display: block;
-                    max-width: 100%;
-                    height: auto;
-                }}
-                figure {{
-                    page-break-inside: avoid;
-                    break-inside: avoid;
-                }}
-            </style>
-        </head>
-        <body>
-            <center>
-                <div class="nav">{navigation_bar}</div>
-            </center>
-            <hr/>
-            <center>
-                <h1>{feed_name}</h1>
-                {f'<p><i>{feed_subtitle}</i></p>' if feed_subtitle else ''}
-            </center>
-            <ul>
-        '''
-        
-        # 处理每篇文章
-        article_toc = []
-        feed_articles = []  # 当前 feed 的文章列表
-        
-        for idx, entry in enumerate(entries, 1):
-            entry_file = f"{sanitize_filename(feed_name)}_{idx:03d}.xhtml"
-            
-            # 获取发布时间
-            pub_date = ""
-            if hasattr(entry, 'published_parsed') and entry.published_parsed:
-                pub_date = datetime(*entry.published_parsed[:6]).strftime('%Y-%m-%d %H:%M')
-            elif hasattr(entry, 'updated_parsed') and entry.updated_parsed:
-                pub_date = datetime(*entry.updated_parsed[:6]).strftime('%Y-%m-%d %H:%M')
-            
-            # 获取描述预览（前100个字符）
-            description_preview = ""
-            raw_desc = entry.get('summary', entry.get('description', ''))
-            if raw_desc:
-                # 移除HTML标签
-                import re
-                clean_desc = re.sub(r'<[^>]+>', '', raw_desc)
-                clean_desc = clean_desc.strip()
-                if len(clean_desc) > 100:
-                    description_preview = clean_desc[:100] + '[...]'
-                else:
-                    description_preview = clean_desc
-            
-            # 添加到索引页（使用HTML列表）
-            index_content += f'''
-                <li>
-                    <a href="{entry_file}">{entry.title} - {pub_date}</a>
-                    {f'<div class="description-preview">{description_preview}</div>' if description_preview else ''}
-                </li>
-            '''
-            
-            # 创建文章页面
-            chapter = epub.EpubHtml(title=entry.title, file_name=entry_file, lang='zh')
-            
-            # 存储文章信息用于导航
-            article_info = {
-                'chapter': chapter,
-                'feed_name': feed_name,
-                'index_file': index_file,
-                'entry_file': entry_file,
-                'title': entry.title,
-                'feed_idx': feed_idx
-            }
-            feed_articles.append(article_info)
-            all_articles.append(article_info)
-            
-            # 获取并处理文章内容
-            raw_content = entry.get('summary', entry.get('description', '暂无摘要'))
-            
-            # 检查是否需要解析原始链接内容
-            feed_config = feeds_config.get(feed_name, {}) if feeds_config else {}
-            resolve_config = feed_config.get('resolve_link', None)
-            if resolve_config and entry.get('link'):
-                resolved_content = resolve_link_content(entry.link, resolve_config)
-                if resolved_content:
-                    # 成功解析，使用解析后的内容
-                    raw_content = resolved_content
-                    print(f"  ✓ 已解析原始内容: {entry.title[:30]}...")
-                else:
-                    print(f"  ✗ 无法解析原始内容，使用RSS摘要: {entry.title[:30]}...")
-            
-            # 处理内容中的图片
-            processed_content = raw_content
-            if load_images:
-                # 提取并替换图片
-                img_urls = extract_images_from_html(raw_content)
-                for img_url in img_urls:
-                    img_counter += 1
-                    local_img = download_and_add_image(book, img_url, img_counter)
-                    if local_img:
-                        # 替换为本地图片路径
-                        img_pattern = f'<img[^>]*src=["\']?{re.escape(img_url)}["\']?[^>]*>'
-                        new_img = f'<img src="{local_img}" alt="图片"/>'
-                        processed_content = re.sub(img_pattern, new_img, processed_content)
-            else:
-                # 移除所有图片标签
-                processed_content = re.sub(r'<img[^>]*>', '', processed_content)
-            
-            # 暂时保存基本内容，导航将在后面添加
-            article_base_content = f'''
-                <hr/>
-                <center><h1>{entry.title}</h1></center>
-                <p>
-                    <small>
-                        {f'发布时间：{pub_date}' if pub_date else ''}
-                        {f'来源：{feed_name}' if feed_name else ''}
-                    </small>
-                </p>
-                <br/>
-                <blockquote>
-                    {processed_content}
-                </blockquote>
-            '''
-            
-            # 处理额外的媒体图片（如果有）
-            if load_images:
-                extra_images = []
-                
-                # 收集额外的媒体图片
-                if hasattr(entry, 'media_content') and entry.media_content:
-                    for media in entry.media_content:
-                        if 'url' in media:
-                            extra_images.append(media['url'])
-                elif hasattr(entry, 'enclosures') and entry.enclosures:
-                    for enclosure in entry.enclosures:
-                        if enclosure.type and enclosure.type.startswith('image/'):
-                            extra_images.append(enclosure.href)
-                
-                # 如果有额外图片，下载并嵌入
-                if extra_images:
-                    article_base_content += '<br/><h2>▣ 附加图片</h2>'
-                    for img_url in extra_images:
-                        img_counter += 1
-                        local_img = download_and_add_image(book, img_url, img_counter)
-                        if local_img:
-                            article_base_content += f'<p><img src="{local_img}" alt="文章配图"/></p>'
-                        else:
-                            # 如果下载失败，使用原始 URL
-                            article_base_content += f'<p><img src="{img_url}" alt="文章配图"/></p>'
-            
-            # 暂时保存内容，稍后添加导航
-            chapter.base_content = article_base_content
-            book.add_item(chapter)
-            # 不在这里添加到 spine，稍后统一处理
-            article_toc.append(chapter)
-        
-        # 为当前 feed 的文章添加导航
-        for i, article_info in enumerate(feed_articles):
-            # 构建导航元素
-            nav_parts = []
-            
-            has_prev = i > 0
-            has_next = i < len(feed_articles) - 1
-            
-            # 根据前后文确定导航文字
-            if has_prev and has_next:
-                # 完整导航: Prev | Sec | Main menu | Next
-                nav_parts.append(f'<a href="{feed_articles[i-1]["entry_file"]}">Prev</a>')
-                nav_parts.append(f'<a href="{index_file}">Sec</a>')
-                nav_parts.append('<a href="main_toc.xhtml">Main menu</a>')
-                nav_parts.append(f'<a href="{feed_articles[i+1]["entry_file"]}">Next</a>')
-            elif has_prev and not has_next:
-                # 最后一篇: Prev | Sec | Main menu
-                nav_parts.append(f'<a href="{feed_articles[i-1]["entry_file"]}">Prev</a>')
-                nav_parts.append(f'<a href="{index_file}">Sec</a>')
-                nav_parts.append('<a href="main_toc.xhtml">Main menu</a>')
-            elif not has_prev and has_next:
-                # 第一篇: Sec | Main menu | Next
-                nav_parts.append(f'<a href="{index_file}">Sec</a>')
-                nav_parts.append('<a href="main_toc.xhtml">Main menu</a>')
-                nav_parts.append(f'<a href="{feed_articles[i+1]["entry_file"]}">Next</a>')
-            else:
-                # 只有一篇: Section | Main menu
-                nav_parts.append(f'<a href="{index_file}">Section</a>')
-                nav_parts.append('<a href="main_toc.xhtml">Main menu</a>')
-            
-            navigation_bar = ' | '.join(nav_parts)
-            
-            # 构建完整的文章页面
-            article_content = f'''
-            <html xmlns="http://www.w3.org/1999/xhtml">
-            <head>
-                <title>{article_info["title"]}</title>
-                <style>
-                    a {{ color: black; text-decoration: underline; }}
-                    .nav {{ margin: 20px 0; padding: 10px; }}
-                    img {{ 
-                        page-break-inside: avoid;
-                        break-inside: avoid;
-                        display: block;
-                        max-width: 100%;
-                        height: auto;
-                    }}
-                    figure {{
-                        page-break-inside: avoid;
-                        break-inside: avoid;
-                    }}
-                    p {{
-                        orphans: 2;
-                        widows: 2;
-                    }}
-                </style>
-            </head>
-            <body>
-                <center>
-                    <div class="nav">{navigation_bar}</div>
-                </center>
-                {article_info['chapter'].base_content}
-            </body>
-            </html>
-            '''
-            
-            article_info['chapter'].content = article_content
-            del article_info['chapter'].base_content
-        
-        # 完成索引页并添加底部导航
-        index_content += f'''
-            </ul>
-            <hr/>
-            <center>
-                <div class="nav">{navigation_bar}</div>
-            </center>
-        </body>
-        </html>
-        '''
-        
-        feed_index_page.content = index_content
-        book.add_item(feed_index_page)
-        book.spine.append(feed_index_page)  # 先添加索引页
-        
-        # 然后添加该 feed 的所有文章
-        for chapter in article_toc:
-            book.spine.append(chapter)
-        
-        # 添加到内置 TOC
-        book.toc.append(feed_index_page)
-    
-    # 完成主目录页
-    main_toc_content += '''
-        </ul>
-    </body>
-    </html>
-    '''
-    main_toc_page.content = main_toc_content
-    book.add_item(main_toc_page)
-    
-    # 添加导航文件
-    book.add_item(epub.EpubNcx())
-    book.add_item(epub.EpubNav())
-    
-    # 生成文件名
+            metrics.incr('articles_fallback')
+            print(f"  ✗ 无法解析原始内容，使用RSS摘要: {title[:30]}...")
+    cache_info = ""
+    if cache is not None:
+        cache.save()
+        metrics.incr('article_cache_hits', cache.hits)
+        metrics.incr('article_cache_misses', cache.misses)
+        cache_info = f"，缓存命中 {cache.hits}"
+    print(f"🔍 原始内容解析完成{cache_info}，耗时 {time.monotonic() - start:.2f}s")
+    return results
+
+# 邮件附件经过 base64 编码后会增大约 1/3，18MB 的 EPUB 对应约 25MB 的邮件
+DEFAULT_MAX_EPUB_MB = 18
+# 每卷为目录页、导航文件和 content.opf 预留的字节数
+VOLUME_OVERHEAD_BYTES = 64 * 1024
+# 估算压缩后 XHTML 大小时使用的保守压缩率
+TEXT_COMPRESSION_RATIO = 0.5
+# 图片需要压缩到原来的这个比例以下才能放进一卷时，不再降低画质而是直接分卷
+MIN_IMAGE_SHRINK_RATIO = 0.5
+
+def prepare_content(feeds, load_images=True, feeds_config=None, settings=None, budget=None):
+    """解析全文并下载图片，结果可以供多本 EPUB 共用
+
+    图片暂存到磁盘（ImageSpool），用完后需要调用 prepared['spool'].cleanup()。
+    提供 budget 时按优先级使用时间预算：先解析全文，再下载图片；
+    预算用完后文章退回到RSS摘要、来不及下载的图片直接丢弃，保证按时生成。
+
+    Returns:
+        {'resolved': resolve_articles 的结果, 'spool': ImageSpool, 'local_images': {url: 书内路径},
+         'load_images': 是否加载图片, 'skipped_images': 因时间预算用完而没有下载的图片 URL}
+    """
+    settings = settings or {}
+
+    # 先并发解析全文，组装阶段只使用解析结果
+    resolved_contents = resolve_articles(feeds, feeds_config, int(settings.get('resolve_concurrency', 8)),
+                                         open_article_cache(settings), budget)
+
+    max_mb = settings.get('max_epub_mb', DEFAULT_MAX_EPUB_MB)
+    max_bytes = int(max_mb * 1024 * 1024) if max_mb else None
+
+    # 图片先暂存到磁盘，写入时每卷只包含本卷文章用到的图片
+    spool = ImageSpool()
+    try:
+        # 先收集全书的图片 URL，统一去重并发下载，同一张图片只保存一次
+        # 高优先级 feed 的图片排在前面，时间预算不足时优先下载
+        local_images = {}
+        skipped_images = set()
+        if load_images:
+            image_urls = []
+            text_bytes = 0
+            for feed_key, feed_data in feeds_by_priority(feeds, feeds_config):
+                for entry in get_feed_entries(feed_data) or []:
+                    content = get_entry_content(entry, resolved_contents[feed_key].get(entry_key(entry)))
+                    text_bytes += len(content)
+                    image_urls.extend(extract_images_from_html(content, entry.get('link')))
+                    image_urls.extend(get_extra_images(entry))
+            local_images = download_images(spool, image_urls, int(settings.get('image_concurrency', 8)),
+                                           open_image_cache(settings), get_transcode_options(settings),
+                                           settings.get('image_workers'), budget, skipped_images)
+            # 之后仍在运行的下载线程写入的图片没有被引用，直接丢弃
+            spool.close()
+            if max_bytes and settings.get('image_shrink_to_fit', False):
+                image_budget = max_bytes - VOLUME_OVERHEAD_BYTES - int(text_bytes * TEXT_COMPRESSION_RATIO)
+                local_images = shrink_images_to_fit(spool, local_images, image_budget,
+                                                    settings.get('image_workers'), budget)
+    except BaseException:
+        spool.cleanup()
+        raise
+
+    return {
+        'resolved': resolved_contents,
+        'spool': spool,
+        'local_images': local_images,
+        'load_images': load_images,
+        # 因时间预算用完而没有下载的图片直接丢弃，不保留远程地址；普通的下载失败仍保留原地址
+        'skipped_images': skipped_images,
+    }
+
+@metrics.timed('build_epub')
+def build_epub(prepared, feeds, filename, settings=None):
+    """用 prepare_content 的结果生成一本（或分卷的多本）EPUB
+
+    Args:
+        prepared: prepare_content 的返回值
+        feeds: 要写入的 feed，条目可以是准备阶段全部条目的子集
+        filename: EPUB 文件名
+        settings: 全局设置（max_epub_mb）
+
+    Returns:
+        [(文件名, {feed 名称: [条目, ...]})]，每卷一项
+    """
+    settings = settings or {}
+    max_mb = settings.get('max_epub_mb', DEFAULT_MAX_EPUB_MB)
+    max_bytes = int(max_mb * 1024 * 1024) if max_mb else None
+
+    volumes = EpubVolumes(filename, datetime.now(), max_bytes, prepared['spool'])
+    write_articles(volumes, feeds, prepared)
+    results = volumes.finish()
+
+    for volume_file, _ in results:
+        size = os.path.getsize(volume_file)
+        metrics.incr('epub_volumes')
+        metrics.incr('epub_bytes', size)
+        print(f"✅ EPUB 电子书已生成：{volume_file}（{format_size(size)}）")
+    return results
+
+@metrics.timed('shrink_images')
+def shrink_images_to_fit(spool, local_images, image_budget, max_workers=None, budget=None):
+    """整本书超出大小上限时，先按比例降低图片画质，尽量避免分卷
+
+    Args:
+        spool: 暂存图片的 ImageSpool
+        local_images: {url: 书内路径}
+        image_budget: 一卷中可以留给图片的字节数
+        max_workers: 转码进程数
+        budget: 可选的 RunBudget，预算已用完时不再压缩
+
+    Returns:
+        更新后的 {url: 书内路径}（转码后图片的扩展名可能变化）
+    """
+    # 只计算文章引用的图片
+    names = sorted(set(local_images.values()))
+    total = sum(spool.size(name) for name in names)
+    if total <= image_budget or (budget is not None and budget.expired()):
+        return local_images
+    ratio = image_budget / total if image_budget > 0 else 0
+    if ratio < MIN_IMAGE_SHRINK_RATIO:
+        print(f"📦 图片需要压缩到 {ratio:.0%} 才能放进一卷，改为分卷")
+        return local_images
+    from concurrent.futures.process import BrokenProcessPool
+    from image_transcode import transcode_job
+
+    pool = open_transcode_pool(max_workers)
+
+    def shrink_one(name):
+        content, media_type = spool.read(name)
+        job = (content, name.rsplit('.', 1)[-1], media_type, {'max_bytes': max(1, int(len(content) * ratio))})
+        try:
+            result = pool.submit(transcode_job, job).result() if pool is not None else transcode_job(job)
+        except (OSError, BrokenProcessPool):
+            result = transcode_job(job)
+        if len(result[0]) >= len(content):
+            return name
+        new_name = f"{name.rsplit('.', 1)[0]}.{result[1]}"
+        spool.replace(name, new_name, result[0], result[2])
+        return new_name
+
+    try:
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 2) as executor:
+            renamed = dict(zip(names, executor.map(shrink_one, names)))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    print(f"📦 为避免分卷压缩图片：{format_size(total)} → {format_size(sum(spool.size(name) for name in renamed.values()))}")
+    return {url: renamed.get(path, path) for url, path in local_images.items()}
+
+def generate_filename(custom_filename=None, current_date=None):
+    """根据文件名模板生成 EPUB 文件名"""
+    current_date = current_date or datetime.now()
     if custom_filename:
         # 使用自定义文件名，替换日期占位符
-        current_date = datetime.now()
         replacements = {
             '{year}': str(current_date.year),
             '{month}': f'{current_date.month:02d}',
@@ -739,7 +1065,7 @@ def convert_to_epub(feeds, load_images=True, feeds_config=None, custom_filename=
         filename = custom_filename
         for placeholder, value in replacements.items():
             filename = filename.replace(placeholder, value)
-        
+
         # 确保文件扩展名为.epub
         if not filename.endswith('.epub'):
             filename += '.epub'
@@ -747,33 +1073,573 @@ def convert_to_epub(feeds, load_images=True, feeds_config=None, custom_filename=
         # 默认文件名格式
         timestamp = current_date.strftime('%Y%m%d_%H%M%S')
         filename = f'rss_feed_{timestamp}.epub'
-    
-    # 输出 EPUB
-    epub.write_epub(filename, book, {})
-    print(f"✅ EPUB 电子书已生成：{filename}")
+    return filename
 
-def main():
-    config = load_config()
-    all_feeds = {}
+def volume_filename(filename, number):
+    """第 number 卷的文件名，例如 RSS_part2.epub"""
+    base, ext = os.path.splitext(filename)
+    return f'{base}_part{number}{ext}'
+
+def feed_navigation(prev_file=None, next_file=None):
+    """feed 索引页的导航栏 - 根据上下文调整文字"""
+    if prev_file and next_file:
+        # 完整导航: Prev | Main menu | Next
+        return f'<a href="{prev_file}">Prev</a> | <a href="main_toc.xhtml">Main menu</a> | <a href="{next_file}">Next</a>'
+    if prev_file:
+        # 最后一个: Previous | Main menu
+        return f'<a href="{prev_file}">Previous</a> | <a href="main_toc.xhtml">Main menu</a>'
+    if next_file:
+        # 第一个: Main menu | Next
+        return f'<a href="main_toc.xhtml">Main menu</a> | <a href="{next_file}">Next</a>'
+    # 只有一个 feed: Main menu
+    return '<a href="main_toc.xhtml">Main menu</a>'
+
+def article_navigation(index_file, prev_file=None, next_file=None):
+    """文章页的导航栏 - 根据前后文确定导航文字"""
+    nav_parts = []
+    if prev_file and next_file:
+        # 完整导航: Prev | Sec | Main menu | Next
+        nav_parts.append(f'<a href="{prev_file}">Prev</a>')
+        nav_parts.append(f'<a href="{index_file}">Sec</a>')
+        nav_parts.append('<a href="main_toc.xhtml">Main menu</a>')
+        nav_parts.append(f'<a href="{next_file}">Next</a>')
+    elif prev_file:
+        # 最后一篇: Prev | Sec | Main menu
+        nav_parts.append(f'<a href="{prev_file}">Prev</a>')
+        nav_parts.append(f'<a href="{index_file}">Sec</a>')
+        nav_parts.append('<a href="main_toc.xhtml">Main menu</a>')
+    elif next_file:
+        # 第一篇: Sec | Main menu | Next
+        nav_parts.append(f'<a href="{index_file}">Sec</a>')
+        nav_parts.append('<a href="main_toc.xhtml">Main menu</a>')
+        nav_parts.append(f'<a href="{next_file}">Next</a>')
+    else:
+        # 只有一篇: Section | Main menu
+        nav_parts.append(f'<a href="{index_file}">Section</a>')
+        nav_parts.append('<a href="main_toc.xhtml">Main menu</a>')
+    return ' | '.join(nav_parts)
+
+def article_filename(feed_name, idx):
+    """feed 中第 idx 篇文章的页面文件名"""
+    return f"{sanitize_filename(feed_name)}_{idx:03d}.xhtml"
+
+def render_article(feed_key, feed_name, index_file, idx, entry, raw_content, load_images, local_images,
+                   skipped_images=frozenset()):
+    """生成一篇文章的正文（不含导航栏）及其索引条目，返回字典"""
+    entry_file = article_filename(feed_name, idx)
+
+    # 获取发布时间
+    pub_date = ""
+    if hasattr(entry, 'published_parsed') and entry.published_parsed:
+        pub_date = datetime(*entry.published_parsed[:6]).strftime('%Y-%m-%d %H:%M')
+    elif hasattr(entry, 'updated_parsed') and entry.updated_parsed:
+        pub_date = datetime(*entry.updated_parsed[:6]).strftime('%Y-%m-%d %H:%M')
+
+    # 获取描述预览（前100个字符，移除HTML标签）
+    description_preview = templates.plain_text(entry.get('summary', entry.get('description', '')), 100)
+
+    # 索引页中的条目（使用HTML列表）
+    index_item = templates.render_index_item(entry_file, f'{entry.title} - {pub_date}', description_preview)
+
+    # 处理内容中的图片，记录本文用到的本地图片，分卷时一起写入
+    images = []
+
+    def use_image(url):
+        path = local_images.get(url)
+        if path:
+            images.append(path)
+        return path
+
+    if load_images:
+        # 一次遍历替换为已下载的本地图片
+        processed_content = rewrite_images(raw_content, use_image, entry.get('link'), skipped_images)
+    else:
+        # 移除所有图片
+        processed_content = strip_images(raw_content)
+
+    meta = ' '.join(part for part in (f'发布时间：{pub_date}' if pub_date else '',
+                                      f'来源：{feed_name}' if feed_name else '') if part)
+
+    # 处理额外的媒体图片（如果有），嵌入已下载的图片，下载失败时使用原始 URL
+    extra_images = []
+    if load_images:
+        for img_url in get_extra_images(entry):
+            local_img = use_image(img_url)
+            if local_img:
+                extra_images.append(local_img)
+            elif img_url not in skipped_images:
+                extra_images.append(img_url)
+
+    body = templates.render_article_body(entry.title, meta, processed_content, extra_images)
+
+    return {
+        'feed_key': feed_key,
+        'feed_name': feed_name,
+        'index_file': index_file,
+        'entry': entry,
+        'file': entry_file,
+        'title': entry.title,
+        'body': body,
+        'index_item': index_item,
+        'images': list(dict.fromkeys(images)),
+    }
+
+class EpubVolumes:
+    """按大小上限把文章写入一卷或多卷 EPUB
+
+    每卷都有自己的目录页和 feed 索引页，导航只链接同一卷中的页面。
+    写入每篇文章前估算它（以及下一篇）的压缩后大小，超出上限前在文章边界处换卷；
+    单篇文章本身超出上限时单独成卷。
+    """
+
+    def __init__(self, filename, current_date, max_bytes=None, spool=None):
+        self.filename = filename
+        self.current_date = current_date
+        self.max_bytes = max_bytes
+        self.spool = spool
+        self.results = []  # [(文件名, {feed 名称: [条目, ...]})]
+        self.writer = None
+        # 全部文章都与其他 feed 重复的 feed：[(名称, 索引页文件名, feed 元数据, 重复文章的链接)]
+        self.duplicate_feeds = []
+
+    def start(self):
+        """开始新的一卷"""
+        number = len(self.results) + 1
+        path = self.filename if number == 1 else volume_filename(self.filename, number)
+        self.writer = StreamingEpubWriter(
+            path,
+            identifier=f'rss-compilation-{self.current_date.strftime("%Y%m%d%H%M%S")}',
+            title='RSS 推送',
+            language='zh',
+            author='KindleRSS',
+            description='精心整理的 RSS 订阅内容合集',
+            date=self.current_date.strftime('%Y-%m-%d'),
+        )
+        self.writer.spine.append('main_toc.xhtml')  # nav first, then custom TOC
+        # 所有页面共用一个样式表
+        self.writer.add_stylesheet(templates.STYLESHEET_FILE, templates.STYLESHEET)
+        self.images = set()
+        self.feeds = []  # 本卷中的 feed：(名称, 索引页文件名)
+        self.entries = {}
+        self.feed_header = None
+        self.index_items = []
+        self.pending_indexes = []  # 本卷结束时才写入的索引页，此时才知道哪些文章在本卷中
+
+    def article_cost(self, article):
+        """估算写入一篇文章会增加的压缩后字节数"""
+        cost = int(len(article['body']) * TEXT_COMPRESSION_RATIO) + len(article['index_item'])
+        for path in article['images']:
+            if path not in self.images:
+                cost += self.spool.size(path)
+        return cost
+
+    def fits(self, *articles):
+        """这些文章能否继续写入当前卷"""
+        if not self.max_bytes:
+            return True
+        total = self.writer.compressed_size() + VOLUME_OVERHEAD_BYTES
+        return total + sum(self.article_cost(article) for article in articles) <= self.max_bytes
+
+    def begin_feed(self, feed_name, index_file, feed_meta, duplicate_links=None):
+        """本卷中开始一个新的 feed
+
+        Args:
+            duplicate_links: 去重时从本 feed 去掉的文章，[(条目, 保留的文章页, 保留的 feed 名称)]，
+                保留的文章在本卷中时，索引页链接到它
+        """
+        self.writer.spine.append(index_file)  # 先添加索引页，然后是该 feed 的所有文章
+        self.writer.toc.append((feed_name, index_file))
+        self.feeds.append((feed_name, index_file))
+
+        # 获取 feed subtitle
+        feed_subtitle = ""
+        if 'title_detail' in feed_meta and 'subtitle' in feed_meta.get('title_detail', {}):
+            feed_subtitle = feed_meta['title_detail']['subtitle']
+        elif 'subtitle' in feed_meta:
+            feed_subtitle = feed_meta.get('subtitle', '')
+        # subtitle 可能是 HTML，只保留文本
+        feed_subtitle = templates.plain_text(feed_subtitle)
+        self.feed_header = (feed_name, index_file, feed_subtitle, duplicate_links or [])
+        self.index_items = []
+
+    def add_article(self, article, prev_file=None, next_file=None):
+        """写入一篇文章及其用到的图片"""
+        for path in article['images']:
+            if path not in self.images:
+                self.spool.copy_to(self.writer, path)
+                self.images.add(path)
+
+        navigation_bar = article_navigation(article['index_file'], prev_file, next_file)
+
+        # 构建完整的文章页面
+        article_content = templates.render_article_page(navigation_bar, article['body'])
+
+        self.writer.spine.append(article['file'])
+        self.writer.add_page(article['file'], article['title'], article_content)
+        self.index_items.append(article['index_item'])
+        self.entries.setdefault(article['feed_key'], []).append(article['entry'])
+        # 其他 feed 中与它重复的文章随它一起记为已投递
+        for feed_key, entry in article.get('duplicates', ()):
+            self.entries.setdefault(feed_key, []).append(entry)
+
+    def end_feed(self, next_index_file=None):
+        """结束当前 feed 在本卷中的部分，索引页在本卷完成时写入"""
+        feed_name, index_file, feed_subtitle, duplicate_links = self.feed_header
+        prev_index_file = self.feeds[-2][1] if len(self.feeds) > 1 else None
+        self.pending_indexes.append({
+            'feed_name': feed_name,
+            'index_file': index_file,
+            'feed_subtitle': feed_subtitle,
+            'prev_index_file': prev_index_file,
+            'next_index_file': next_index_file,
+            'index_items': self.index_items,
+            'duplicate_links': duplicate_links,
+        })
+        self.feed_header = None
+        self.index_items = []
+
+    def add_duplicate_feeds(self):
+        """为全部文章都重复的 feed 在本卷末尾加上索引页，只链接到本卷中保留的文章"""
+        for feed_name, index_file, feed_meta, duplicate_links in self.duplicate_feeds:
+            pages = set(self.writer.spine)
+            if not any(target_file in pages for _, target_file, _ in duplicate_links):
+                continue
+            if self.pending_indexes:
+                self.pending_indexes[-1]['next_index_file'] = index_file
+            self.begin_feed(feed_name, index_file, feed_meta, duplicate_links)
+            self.end_feed()
+
+    def write_index(self, pending):
+        """写入一个 feed 的索引页，并链接到本卷中保留的重复文章"""
+        pages = set(self.writer.spine)
+        items = pending['index_items'] + [
+            templates.render_duplicate_item(target_file, entry.get('title', ''), target_feed)
+            for entry, target_file, target_feed in pending['duplicate_links'] if target_file in pages]
+        navigation_bar = feed_navigation(pending['prev_index_file'], pending['next_index_file'])
+        index_content = templates.render_index_page(pending['feed_name'], pending['feed_subtitle'],
+                                                    navigation_bar, items)
+        self.writer.add_page(pending['index_file'], pending['feed_name'], index_content)
+
+    def finish_volume(self, split):
+        """写入本卷的目录页并完成本卷
+
+        Args:
+            split: 是否分为多卷（决定书名和目录中是否显示卷号）
+        """
+        self.add_duplicate_feeds()
+        for pending in self.pending_indexes:
+            self.write_index(pending)
+        self.pending_indexes = []
+
+        number = len(self.results) + 1
+        title = f'RSS 推送（第 {number} 卷）' if split else 'RSS 推送'
+        if split:
+            self.writer.title = title
+            self.writer.identifier += f'-{number}'
+
+        # 创建自定义主目录页 (Primary TOC)
+        main_toc_content = templates.render_toc_page(title, self.current_date.strftime('%Y-%m-%d'), self.feeds)
+        self.writer.add_page('main_toc.xhtml', '目录', main_toc_content)
+        self.writer.close()
+        self.results.append((self.writer.path, self.entries))
+        self.writer = None
+
+    def finish(self):
+        """完成最后一卷；分为多卷时第一卷也改名为 …_part1.epub"""
+        if self.writer is None and not self.results:
+            self.start()
+        if self.writer is not None:
+            self.finish_volume(split=bool(self.results))
+        if len(self.results) > 1:
+            first_file, first_entries = self.results[0]
+            part_file = volume_filename(self.filename, 1)
+            os.replace(first_file, part_file)
+            self.results[0] = (part_file, first_entries)
+            print(f"📦 超出 {format_size(self.max_bytes)} 的大小上限，已分为 {len(self.results)} 卷")
+        self.remove_stale_volumes()
+        return self.results
+
+    def remove_stale_volumes(self):
+        """删除同名文件之前运行留下的多余分卷，避免仅发送模式把它们当作本次的分卷"""
+        number = len(self.results) + 1 if len(self.results) > 1 else 1
+        while os.path.exists(volume_filename(self.filename, number)):
+            os.remove(volume_filename(self.filename, number))
+            number += 1
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+
+def write_articles(volumes, feeds, prepared):
+    """逐篇生成文章并写入 EPUB，每篇文章写入后立即释放
+
+    生成下一篇文章后再写入当前文章，这样就能知道下一篇是否还在同一卷中，
+    从而生成正确的导航链接；内存中最多同时保留两篇文章。
+    """
+    feed_list = []
+    empty_feeds = {}  # 全部文章都被去重的 feed：{feed 标识: (名称, feed 元数据)}
+    for feed_key, feed_data in feeds.items():
+        # 处理新旧数据格式兼容性
+        if isinstance(feed_data, dict) and 'entries' in feed_data:
+            entries = feed_data['entries']
+            feed_meta = feed_data.get('feed_meta', {})
+            config_name = feed_data.get('config_name')
+        else:
+            # 兼容旧格式（直接是 entries 列表）
+            entries = feed_data
+            feed_meta = {}
+            config_name = None
+
+        # 优先使用 config name, 其次 feed title, 最后用 feed_key
+        feed_name = config_name or feed_meta.get('title', feed_key)
+        if entries:
+            feed_list.append((feed_key, feed_name, feed_meta, entries))
+        elif isinstance(feed_data, dict) and feed_data.get('duplicates'):
+            empty_feeds[feed_key] = (feed_name, feed_meta)
+
+    # 去重时去掉的文章：所在 feed 的索引页链接到保留的文章页，保留的文章记下它们以便一起记为已投递
+    entry_files = {id(entry): (article_filename(feed_name, idx), feed_name)
+                   for _, feed_name, _, entries in feed_list for idx, entry in enumerate(entries, 1)}
+    duplicate_links = {}
+    kept_duplicates = {}
+    for feed_key, feed_data in feeds.items():
+        duplicates = feed_data.get('duplicates') if isinstance(feed_data, dict) else None
+        for entry, _, kept_entry in duplicates or []:
+            if id(kept_entry) in entry_files:
+                duplicate_links.setdefault(feed_key, []).append((entry, *entry_files[id(kept_entry)]))
+                kept_duplicates.setdefault(id(kept_entry), []).append((feed_key, entry))
+    # 这些 feed 没有文章页，只在保留的文章所在的卷中写入链接到它们的索引页
+    volumes.duplicate_feeds = [(feed_name, sanitize_filename(feed_name) + "_toc.xhtml", feed_meta,
+                                duplicate_links[feed_key])
+                               for feed_key, (feed_name, feed_meta) in empty_feeds.items()
+                               if feed_key in duplicate_links]
+
+    def generate():
+        for feed_key, feed_name, feed_meta, entries in feed_list:
+            index_file = sanitize_filename(feed_name) + "_toc.xhtml"
+            resolved = prepared['resolved'].get(feed_key, {})
+            for idx, entry in enumerate(entries, 1):
+                # 获取文章内容：使用解析阶段得到的原始链接内容，失败时保留RSS摘要
+                raw_content = get_entry_content(entry, resolved.get(entry_key(entry)))
+                article = render_article(feed_key, feed_name, index_file, idx, entry, raw_content,
+                                         prepared['load_images'], prepared['local_images'],
+                                         prepared['skipped_images'])
+                article['feed_meta'] = feed_meta
+                article['duplicate_links'] = duplicate_links.get(feed_key)
+                article['duplicates'] = kept_duplicates.get(id(entry), [])
+                yield article
+
+    try:
+        articles = generate()
+        current = next(articles, None)
+        split_before = False
+        prev_file = None
+        while current is not None:
+            following = next(articles, None)
+            if volumes.writer is None or split_before:
+                if volumes.writer is not None:
+                    volumes.finish_volume(split=True)
+                volumes.start()
+            if volumes.feed_header is None:
+                volumes.begin_feed(current['feed_name'], current['index_file'], current['feed_meta'],
+                                   current['duplicate_links'])
+                prev_file = None
+
+            # 下一篇放不进本卷时，当前文章就是本卷的最后一篇
+            split_after = following is not None and not volumes.fits(current, following)
+            same_feed_next = (following is not None and not split_after
+                              and following['index_file'] == current['index_file'])
+            volumes.add_article(current, prev_file, following['file'] if same_feed_next else None)
+
+            if not same_feed_next:
+                next_index_file = following['index_file'] if following is not None and not split_after else None
+                volumes.end_feed(next_index_file)
+
+            prev_file = current['file']
+            split_before = split_after
+            current = following
+    except BaseException:
+        volumes.abort()
+        raise
+
+def load_profiles(config):
+    """读取投递目标（Profiles），未配置时返回一个包含全部 feed 的默认目标
+
+    每个目标可以指定 name、feeds（feed 的 name 或 title 列表）、filename_template
+    和 kindle_email（单个地址或列表，不填时使用邮件配置中的地址）
+    """
+    settings = config.get('Settings', {})
+    profiles = config.get('Profiles') or [{}]
+    result = []
+    for idx, profile in enumerate(profiles, 1):
+        name = profile.get('name') or (f'profile{idx}' if len(profiles) > 1 else None)
+        filename_template = profile.get('filename_template')
+        if not filename_template and len(profiles) > 1:
+            # 多个目标共用全局模板时加上目标名称，避免文件名冲突
+            base, _ = os.path.splitext(settings.get('filename_template') or 'rss_feed_{year}{month}{day}_{hour}{minute}{second}')
+            filename_template = f'{base}_{sanitize_filename(name)}.epub'
+        result.append({
+            'name': name,
+            'feeds': profile.get('feeds'),
+            'filename_template': filename_template or settings.get('filename_template'),
+            'kindle_email': profile.get('kindle_email'),
+        })
+    return result
+
+def profile_includes(profile, feed):
+    """投递目标是否订阅了这个 feed（未指定 feeds 时订阅全部）"""
+    if not profile['feeds']:
+        return True
+    return feed.get('name') in profile['feeds'] or feed.get('title') in profile['feeds']
+
+def merge_feeds(profile_feeds):
+    """合并各投递目标的文章，同一篇文章只保留一次，用于统一解析全文和下载图片"""
+    merged = {}
+    for feeds in profile_feeds:
+        for feed_title, feed_data in feeds.items():
+            target = merged.setdefault(feed_title, dict(feed_data, entries=[]))
+            known = {entry_key(entry) for entry in target['entries']}
+            target['entries'].extend(entry for entry in feed_data['entries'] if entry_key(entry) not in known)
+    return merged
+
+def build_deliveries(config=None):
+    """拉取 feed 并为每个投递目标生成 EPUB
+
+    feed 拉取、全文解析和图片下载对所有目标只做一次，然后按目标分别组装。
+
+    Returns:
+        [{'name': 目标名称, 'kindle_email': 收件地址或 None, 'files': [EPUB 文件名, ...]}]，
+        没有新文章的目标不在结果中
+    """
+    config = config or load_config()
     feeds_config = {}  # 存储每个feed的配置
     
-    for feed in config['Feeds']:
-        if feed.get('enabled', True):
-            parsed_feed = fetch_feed(feed['url'])
-            entries = filter_entries(parsed_feed.entries, config['Settings'].get('max_history', -1))
-            # 保存配置名称和 feed 元数据
-            feed_title = feed.get('title', feed.get('name', feed['url']))
-            all_feeds[feed_title] = {
-                'entries': entries,
-                'config_name': feed.get('name'),
-                'feed_meta': parsed_feed.feed  # 包含 feed 的元数据
-            }
-            # 保存feed配置
-            feeds_config[feed_title] = feed
-
-    # 获取自定义文件名（如果配置中有）
-    custom_filename = config.get('Settings', {}).get('filename_template')
-    convert_to_epub(all_feeds, config['Settings'].get('load_images', True), feeds_config, custom_filename)
+    settings = config['Settings']
+    http_client.configure(settings)
+    run_metrics = metrics.reset()
+    
+    # 整次运行的时间预算（max_build_seconds），为空时不限制
+    budget = RunBudget(settings.get('max_build_seconds'), settings.get('build_reserve_seconds'))
+    
+    # feed 状态缓存（ETag / Last-Modified），可通过 feed_cache: false 关闭
+    store = None
+    if settings.get('feed_cache', True):
+        store = shared(FeedStateStore, settings.get('cache_dir') or DEFAULT_CACHE_DIR)
+    
+    # 只拉取至少一个投递目标订阅的 feed，每个 feed 只拉取一次
+    profiles = load_profiles(config)
+    enabled_feeds = [
+        feed for feed in config['Feeds']
+        if feed.get('enabled', True) and any(profile_includes(profile, feed) for profile in profiles)
+    ]
+    parsed_feeds = fetch_all_feeds(enabled_feeds, settings, store, budget)
+    
+    # 增量模式：只推送上次成功投递之后的新文章，每个投递目标单独记录
+    ledgers = [open_ledger(settings, profile['name']) for profile in profiles]
+    profile_feeds = []
+    for profile, ledger in zip(profiles, ledgers):
+        all_feeds = {}
+        for feed, parsed_feed in zip(enabled_feeds, parsed_feeds):
+            if parsed_feed is not None and profile_includes(profile, feed):
+                entries = filter_entries(parsed_feed.entries, settings.get('max_history', -1), ledger)
+                # 保存配置名称和 feed 元数据
+                feed_title = feed.get('title', feed.get('name', feed['url']))
+                all_feeds[feed_title] = {
+                    'entries': entries,
+                    'config_name': feed.get('name'),
+                    'feed_meta': parsed_feed.feed  # 包含 feed 的元数据
+                }
+                # 保存feed配置
+                feeds_config[feed_title] = feed
+        # 跨 feed 去重，重复的文章只解析和下载一次
+        if settings.get('dedup', True):
+            removed = remove_duplicate_entries(all_feeds, feeds_config,
+                                               int(settings.get('dedup_max_distance', dedup.DEFAULT_MAX_DISTANCE)))
+            if removed:
+                metrics.incr('articles_deduplicated', removed)
+                print(f"🔁 跨 feed 去重：{removed} 篇重复的文章只保留一份")
+        profile_feeds.append(all_feeds)
+    
+    def has_entries(feeds):
+        return any(feed_data['entries'] for feed_data in feeds.values())
+    
+    deliveries = []
+    try:
+        if settings.get('only_new', False) and not any(has_entries(feeds) for feeds in profile_feeds):
+            print("📭 没有新文章，跳过生成EPUB")
+            return deliveries
+        
+        profiling.memory_checkpoint('转换前')
+        prepared = prepare_content(merge_feeds(profile_feeds), settings.get('load_images', True), feeds_config,
+                                   settings, budget)
+        try:
+            for profile, feeds, ledger in zip(profiles, profile_feeds, ledgers):
+                label = f"「{profile['name']}」" if profile['name'] else ''
+                if ledger is not None and not has_entries(feeds):
+                    print(f"📭 {label}没有新文章，跳过生成EPUB")
+                    continue
+                if label:
+                    print(f"📖 生成{label}的EPUB...")
+                volumes = build_epub(prepared, feeds, generate_filename(profile['filename_template']), settings)
+                
+                # 每卷单独记录，哪一卷发送成功就只把那一卷的文章记为已投递
+                if ledger is not None:
+                    for filename, feed_entries in volumes:
+                        ledger.record_build(filename, feed_entries)
+                deliveries.append({
+                    'name': profile['name'],
+                    'kindle_email': profile['kindle_email'],
+                    'files': [filename for filename, _ in volumes],
+                })
+        finally:
+            prepared['spool'].cleanup()
+            profiling.memory_checkpoint('转换后')
+    finally:
+        for ledger in ledgers:
+            if ledger is not None:
+                ledger.close()
+        # 出错时也写入指标，便于定位是哪个阶段出了问题
+        run_metrics.info['budget_exhausted'] = budget.exhausted_stages
+        metrics.write_reports(settings)
+    print(f"⏱️ 生成用时 {budget.elapsed():.1f} 秒")
+    metrics.print_summary()
+    return deliveries
+
+def main():
+    """生成 EPUB，返回本次生成的全部文件名"""
+    return [filename for delivery in build_deliveries() for filename in delivery['files']]
+
+def open_ledger(settings, profile=None):
+    """only_new 开启时打开已投递文章账本，否则返回 None"""
+    if not settings.get('only_new', False):
+        return None
+    ledger = ArticleLedger(settings.get('cache_dir') or DEFAULT_CACHE_DIR, profile)
+    # 超出历史窗口很久的记录已经用不到了
+    max_history = settings.get('max_history', -1)
+    ledger.prune(max(30, max_history * 2) if max_history != -1 else 365)
+    return ledger
+
+def mark_delivered(epub_file, config=None):
+    """EPUB 成功发送后调用，把其中的文章记为已投递
+
+    逐卷调用时应传入已加载的 config，避免每卷都重新读取配置文件
+    """
+    config = load_config() if config is None else config
+    ledger = open_ledger(config.get('Settings') or {})
+    if ledger is None:
+        return
+    count = ledger.mark_delivered(epub_file)
+    ledger.close()
+    if count:
+        print(f"📒 已记录 {count} 篇已投递文章")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='生成RSS EPUB')
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiler = profiling.from_args(args)
+    if profiler is None:
+        main()
+    else:
+        profiler.save(profiler.run(main))
@@ -0,0 +1,252 @@
+"""
+运行指标
+
+记录每次运行各阶段的耗时、每个主机的请求统计（请求数、字节数、耗时、失败和超时）以及缓存命中等计数。
+整次运行共用一个全局记录（与 http_client 的共享会话一样），在结束时写成 JSON 报告。
+也可以额外写成 Prometheus node_exporter textfile collector 能读取的格式，用于在仪表盘上观察趋势，
+找出拖慢整次推送的站点。
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+DEFAULT_METRICS_FILE = 'metrics.json'
+DEFAULT_CACHE_DIR = '.rss_cache'  # 与 cache.DEFAULT_CACHE_DIR 一致，不导入 cache 以免加载 feedparser
+
+# 主机统计的字段
+HOST_FIELDS = ('requests', 'bytes', 'seconds', 'errors', 'timeouts', 'not_modified')
+
+
+class RunMetrics:
+    """一次运行的指标，可以在多个线程中同时记录
+
+    stages 中的阶段分三种：fetch_feeds、download_images 等是整个阶段的墙钟时间；
+    parse_feeds、extract_articles 等逐项记录的阶段是各线程耗时之和，可以超过墙钟时间，calls 为处理的数量；
+    transcode_images 等用 overlapping_stage 记录的阶段是任一线程处于该阶段的墙钟时间，calls 为处理的数量。
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._start = time.monotonic()
+        self.stages = {}  # 阶段 -> {'seconds': 秒数, 'calls': 次数}
+        self.hosts = {}  # (主机, 请求类型) -> {字段: 数值}
+        self.counters = {}  # 名称 -> 数量
+        self.info = {}  # 其他说明信息，例如因时间预算被截断的阶段
+        self._lock = threading.Lock()
+        self._active = {}  # overlapping_stage 的阶段 -> [进行中的数量, 开始时间]
+
+    def add_time(self, name, seconds, calls=1):
+        with self._lock:
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            stage['seconds'] += seconds
+            stage['calls'] += calls
+
+    @contextmanager
+    def stage(self, name):
+        """记录一段代码的耗时（异常退出时同样记录）"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.monotonic() - start)
+
+    @contextmanager
+    def overlapping_stage(self, name):
+        """记录多个线程可能同时进入的阶段，只计入墙钟时间（重叠部分不重复计算）"""
+        with self._lock:
+            active = self._active.setdefault(name, [0, 0.0])
+            if not active[0]:
+                active[1] = time.monotonic()
+            active[0] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                active[0] -= 1
+                seconds = time.monotonic() - active[1] if not active[0] else 0.0
+            self.add_time(name, seconds)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_request(self, url, kind, seconds, status=None, num_bytes=0, timeout=False):
+        """记录一次 HTTP 请求（包括客户端内部的重试）
+
+        Args:
+            url: 请求地址，按主机汇总
+            kind: 请求类型（feed / page / image）
+            seconds: 耗时
+            status: 状态码，请求异常时为 None
+            num_bytes: 响应体字节数
+            timeout: 是否因超时失败
+        """
+        host = urlparse(url).netloc.lower() or url
+        with self._lock:
+            stats = self.hosts.setdefault((host, kind), dict.fromkeys(HOST_FIELDS, 0))
+            stats['requests'] += 1
+            stats['bytes'] += num_bytes
+            stats['seconds'] += seconds
+            if timeout:
+                stats['timeouts'] += 1
+            elif status is None or status >= 400:
+                stats['errors'] += 1
+            elif status == 304:
+                stats['not_modified'] += 1
+
+    def elapsed(self):
+        return time.monotonic() - self._start
+
+    def to_dict(self):
+        """转换为 JSON 报告的结构"""
+        with self._lock:
+            hosts = {}
+            for (host, kind), stats in sorted(self.hosts.items()):
+                hosts.setdefault(host, {})[kind] = dict(stats, seconds=round(stats['seconds'], 3))
+            return {
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.started_at)),
+                'duration_seconds': round(self.elapsed(), 3),
+                'stages': {name: dict(stage, seconds=round(stage['seconds'], 3))
+                           for name, stage in self.stages.items()},
+                'hosts': hosts,
+                'counters': dict(self.counters),
+                'info': dict(self.info),
+            }
+
+    def slowest_hosts(self, limit=3):
+        """按请求总耗时排序的主机，[(主机, 秒数, 请求数)]"""
+        with self._lock:
+            totals = {}
+            for (host, _), stats in self.hosts.items():
+                seconds, requests = totals.get(host, (0.0, 0))
+                totals[host] = (seconds + stats['seconds'], requests + stats['requests'])
+        ranked = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)
+        return [(host, seconds, requests) for host, (seconds, requests) in ranked[:limit]]
+
+
+_current = RunMetrics()
+
+
+def reset():
+    """开始新的一次运行，返回新的记录"""
+    global _current
+    _current = RunMetrics()
+    return _current
+
+
+def current():
+    return _current
+
+
+def stage(name):
+    return _current.stage(name)
+
+
+def overlapping_stage(name):
+    return _current.overlapping_stage(name)
+
+
+def add_time(name, seconds, calls=1):
+    _current.add_time(name, seconds, calls)
+
+
+def incr(name, amount=1):
+    _current.incr(name, amount)
+
+
+def record_request(url, kind, seconds, status=None, num_bytes=0, timeout=False):
+    _current.record_request(url, kind, seconds, status, num_bytes, timeout)
+
+
+def timed(name):
+    """装饰器：把函数的每次调用记为一个阶段"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _current.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _write_atomic(path, text):
+    """先写临时文件再替换，textfile collector 不会读到写了一半的文件"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def to_prometheus(report):
+    """把 JSON 报告转换为 Prometheus 文本格式"""
+    lines = []
+
+    def metric(name, help_text, samples):
+        lines.append(f'# HELP kindlerss_{name} {help_text}')
+        lines.append(f'# TYPE kindlerss_{name} gauge')
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{_label(val)}"' for key, val in labels.items())
+            lines.append(f'kindlerss_{name}{{{label_text}}} {value}' if label_text else f'kindlerss_{name} {value}')
+
+    metric('last_run_duration_seconds', 'Duration of the last run.', [({}, report['duration_seconds'])])
+    metric('last_run_timestamp_seconds', 'Unix time when the last run finished.', [({}, round(time.time()))])
+    metric('stage_seconds', 'Time spent in each stage during the last run.',
+           [({'stage': name}, stage['seconds']) for name, stage in report['stages'].items()])
+    metric('stage_calls', 'Number of calls or items processed in each stage during the last run.',
+           [({'stage': name}, stage['calls']) for name, stage in report['stages'].items()])
+    for field in HOST_FIELDS:
+        metric(f'host_{field}', f'HTTP {field.replace("_", " ")} per host and request kind during the last run.',
+               [({'host': host, 'kind': kind}, stats[field])
+                for host, kinds in report['hosts'].items() for kind, stats in kinds.items()])
+    metric('events', 'Counters such as cache hits and failures during the last run.',
+           [({'name': name}, value) for name, value in sorted(report['counters'].items())])
+    return '\n'.join(lines) + '\n'
+
+
+def write_reports(settings, metrics=None):
+    """按设置写入 JSON 报告和可选的 Prometheus 文件
+
+    metrics_file 默认写到缓存目录下的 metrics.json，设置为空或 false 时不写；
+    metrics_prometheus_file 设置后同时写入 Prometheus 文本格式。
+    """
+    metrics = metrics or _current
+    report = metrics.to_dict()
+    json_path = settings.get('metrics_file', os.path.join(settings.get('cache_dir') or DEFAULT_CACHE_DIR,
+                                                          DEFAULT_METRICS_FILE))
+    prometheus_path = settings.get('metrics_prometheus_file')
+    try:
+        if json_path:
+            _write_atomic(json_path, json.dumps(report, ensure_ascii=False, indent=2))
+        if prometheus_path:
+            _write_atomic(prometheus_path, to_prometheus(report))
+    except OSError as e:
+        print(f"⚠️ 写入运行指标失败: {e}")
+        return report
+    if json_path:
+        print(f"📈 运行指标已写入 {json_path}")
+    return report
+
+
+def print_summary(metrics=None):
+    """打印各阶段耗时和最慢的主机"""
+    metrics = metrics or _current
+    report = metrics.to_dict()
+    if report['stages']:
+        parts = [f"{name} {stage['seconds']:.1f}s" for name, stage in report['stages'].items()]
+        print(f"⏱️ 各阶段耗时：{'，'.join(parts)}")
+    slowest = metrics.slowest_hosts()
+    if slowest:
+        parts = [f"{host} {seconds:.1f}s/{requests} 次" for host, seconds, requests in slowest]
+        print(f"🐢 请求耗时最多的主机：{'，'.join(parts)}")
@@ -0,0 +1,174 @@
+"""
+按更新频率调整每个 feed 的轮询间隔
+
+FeedStateStore 中为每个 feed 记录出现新条目的时间，据此估计更新间隔并计算下次轮询时间；
+同时遵守 feed 自己声明的 <ttl>、sy:updatePeriod / sy:updateFrequency 和 skipHours / skipDays，
+以及配置中的 min_interval / max_interval。开启 adaptive_polling 后，未到轮询时间的 feed
+直接使用上次缓存的条目，不发送请求。
+"""
+
+import re
+import time
+import calendar
+
+# 保留的历史记录数量
+HISTORY_SIZE = 30
+# 默认的轮询间隔范围（小时）
+DEFAULT_MIN_INTERVAL = 0.5
+DEFAULT_MAX_INTERVAL = 24
+# 定时运行的时间会有偏差，提前这么多（间隔的 10%，至少 5 分钟）也视为到期
+DUE_SLACK_RATIO = 0.1
+DUE_SLACK_MIN = 300
+
+UPDATE_PERIODS = {
+    'hourly': 3600,
+    'daily': 86400,
+    'weekly': 7 * 86400,
+    'monthly': 30 * 86400,
+    'yearly': 365 * 86400,
+}
+DAY_NAMES = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# feedparser 只保留 skipHours / skipDays 中的最后一项，直接从原始 XML 中读取
+SKIP_HOURS_RE = re.compile(rb'<skipHours\b[^>]*>(.*?)</skipHours>', re.I | re.S)
+SKIP_DAYS_RE = re.compile(rb'<skipDays\b[^>]*>(.*?)</skipDays>', re.I | re.S)
+HOUR_RE = re.compile(rb'<hour\b[^>]*>\s*(\d+)\s*</hour>', re.I)
+DAY_RE = re.compile(rb'<day\b[^>]*>\s*(\w+)\s*</day>', re.I)
+
+
+def interval_limits(feed, settings):
+    """返回 feed 的轮询间隔范围 (最小秒数, 最大秒数)，feed 中的 min_interval / max_interval 优先"""
+    min_hours = feed.get('min_interval', settings.get('poll_min_interval', DEFAULT_MIN_INTERVAL))
+    max_hours = feed.get('max_interval', settings.get('poll_max_interval', DEFAULT_MAX_INTERVAL))
+    min_seconds = float(min_hours or 0) * 3600
+    return min_seconds, max(min_seconds, float(max_hours or 0) * 3600)
+
+
+def parse_hints(feed_meta, content=None):
+    """读取 feed 声明的更新提示：ttl、sy:updatePeriod、skipHours、skipDays"""
+    hints = {}
+    try:
+        if feed_meta.get('ttl'):
+            hints['ttl'] = int(feed_meta['ttl']) * 60
+    except (TypeError, ValueError):
+        pass
+    period = UPDATE_PERIODS.get(str(feed_meta.get('sy_updateperiod', '')).strip().lower())
+    if period:
+        try:
+            frequency = max(1, int(feed_meta.get('sy_updatefrequency') or 1))
+        except (TypeError, ValueError):
+            frequency = 1
+        hints['update_period'] = period / frequency
+    if content:
+        match = SKIP_HOURS_RE.search(content)
+        if match:
+            hours = sorted({int(hour) % 24 for hour in HOUR_RE.findall(match.group(1))})
+            if hours:
+                hints['skip_hours'] = hours
+        match = SKIP_DAYS_RE.search(content)
+        if match:
+            days = sorted({DAY_NAMES.index(day.decode().lower()) for day in DAY_RE.findall(match.group(1))
+                           if day.decode().lower() in DAY_NAMES})
+            if days:
+                hints['skip_days'] = days
+    return hints
+
+
+def entry_id(entry):
+    return entry.get('id') or entry.get('link') or entry.get('title')
+
+
+def entry_timestamp(entry):
+    """条目的发布（或更新）时间戳，没有日期时返回 None"""
+    parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+    return calendar.timegm(parsed) if parsed else None
+
+
+def record_entries(polling, entries, previous_entries=None, now=None):
+    """把新出现的条目记入历史
+
+    有日期的条目按发布时间记录；没有日期的条目按发现的时间记录
+    （第一次拉取时无法判断何时出现，不记录）。
+    """
+    now = now or time.time()
+    history = list(polling.get('history', []))
+    known = None if previous_entries is None else {entry_id(entry) for entry in previous_entries}
+    for entry in entries:
+        if known is not None and entry_id(entry) in known:
+            continue
+        timestamp = entry_timestamp(entry)
+        if timestamp is None or timestamp > now:
+            timestamp = now if known is not None else None
+        if timestamp is not None:
+            history.append(round(timestamp))
+    polling['history'] = sorted(set(history))[-HISTORY_SIZE:]
+    return polling
+
+
+def estimate_interval(history, now):
+    """按历史估计合适的轮询间隔（秒），历史不足时返回 None
+
+    取相邻更新间隔的中位数；距最近一次更新已经很久时按这段时间放慢，
+    最后除以 2，使一次更新周期内至少轮询两次。
+    """
+    gaps = sorted(later - earlier for earlier, later in zip(history, history[1:]) if later > earlier)
+    if not gaps:
+        return None
+    return max(gaps[len(gaps) // 2], now - history[-1]) / 2
+
+
+def skip_forward(timestamp, hints):
+    """把落在 skipHours / skipDays（UTC）中的时间推迟到允许轮询的第一个整点"""
+    skip_hours = set(hints.get('skip_hours', []))
+    skip_days = set(hints.get('skip_days', []))
+    if len(skip_hours) >= 24 or len(skip_days) >= 7:
+        return timestamp
+    for _ in range(24 * 8):
+        utc = time.gmtime(timestamp)
+        if utc.tm_hour not in skip_hours and utc.tm_wday not in skip_days:
+            break
+        timestamp = (timestamp // 3600 + 1) * 3600
+    return timestamp
+
+
+def schedule(polling, limits, now=None):
+    """计算下次轮询时间，写入 polling 的 interval 和 next_poll"""
+    now = now or time.time()
+    min_interval, max_interval = limits
+    hints = polling.get('hints', {})
+    interval = estimate_interval(polling.get('history', []), now) or min_interval
+    # ttl 和 sy:updatePeriod 表示更短的间隔没有意义；max_interval 保证不会太久不检查
+    interval = max(interval, min_interval, hints.get('ttl', 0), hints.get('update_period', 0))
+    interval = min(interval, max_interval)
+    polling['interval'] = round(interval)
+    polling['next_poll'] = round(skip_forward(now + interval, hints))
+    return polling
+
+
+def update(polling, limits, entries, previous_entries=None, feed_meta=None, content=None, now=None):
+    """一次成功拉取（包括 304）后更新轮询状态，返回新的 polling
+
+    Args:
+        polling: 上次保存的轮询状态，没有时为 None
+        limits: interval_limits 返回的间隔范围
+        entries: 本次的条目
+        previous_entries: 上次缓存的条目，第一次拉取时为 None
+        feed_meta: feed 元数据，用于读取 ttl 和 sy:updatePeriod；304 时为 None，沿用上次的提示
+        content: 原始 XML，用于读取 skipHours / skipDays
+    """
+    now = now or time.time()
+    polling = dict(polling or {})
+    if feed_meta is not None:
+        polling['hints'] = parse_hints(feed_meta, content)
+    record_entries(polling, entries, previous_entries, now)
+    polling['checked_at'] = round(now)
+    return schedule(polling, limits, now)
+
+
+def is_due(polling, now=None):
+    """是否到了轮询时间，没有轮询状态时总是到期"""
+    if not polling or not polling.get('next_poll'):
+        return True
+    now = now or time.time()
+    slack = max(DUE_SLACK_MIN, polling.get('interval', 0) * DUE_SLACK_RATIO)
+    return now >= polling['next_poll'] - slack
@@ -0,0 +1,257 @@
+"""
+性能剖析
+
+为 main.py 和 rss_and_send.py 提供 --profile / --trace-memory 选项，不需要修改代码就能剖析一次慢的运行：
+- cprofile：确定性剖析，保存为 .prof 文件（可以用 pstats、snakeviz 等工具查看）；
+  除主线程外，也会剖析运行期间新建的线程（Python 3.12 起同一时间只能有一个 cProfile，只剖析主线程）
+- sample：采样剖析，定时抓取所有线程的调用栈，开销小且能看到线程池中的工作，
+  保存为 folded stacks 格式（flamegraph.pl、speedscope 可以直接打开）
+- trace-memory：用 tracemalloc 在 EPUB 转换前后各拍一次快照，报告内存峰值和新增内存最多的代码行
+
+结果文件保存在 EPUB 旁边（与第一个 EPUB 同名、扩展名不同），方便附在针对具体 feed 的问题报告中。
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+# 采样间隔（秒）
+SAMPLE_INTERVAL = 0.005
+# 线程池、HTTP 服务器等空闲等待时所在的函数，采样时跳过，避免淹没真正的热点
+IDLE_FRAMES = {
+    ('threading.py', 'wait'),
+    ('queue.py', 'get'),
+    ('thread.py', '_worker'),
+    ('selectors.py', 'select'),
+}
+
+_memory_tracer = None
+
+
+def add_arguments(parser):
+    """给命令行解析器加上剖析相关的选项"""
+    parser.add_argument('--profile', nargs='?', const='cprofile', choices=['cprofile', 'sample'],
+                        help='剖析生成过程：cprofile（默认）或 sample（采样，包括所有线程），结果保存在 EPUB 旁边')
+    parser.add_argument('--profile-top', type=int, default=25, metavar='N', help='打印最耗时的 N 个函数（默认 25）')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='用 tracemalloc 记录 EPUB 转换前后的内存快照，报告峰值和分配最多的代码行')
+
+
+def from_args(args):
+    """根据命令行选项创建 Profiler，没有开启任何剖析时返回 None"""
+    if not args.profile and not args.trace_memory:
+        return None
+    return Profiler(args.profile, args.trace_memory, args.profile_top)
+
+
+def memory_checkpoint(label):
+    """在开启 --trace-memory 时拍一次内存快照，否则什么也不做"""
+    if _memory_tracer is not None:
+        _memory_tracer.snapshot(label)
+
+
+class StackSampler:
+    """定时抓取所有线程 Python 调用栈的采样剖析器"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()  # (从外到内的帧, ...) -> 采样次数
+        self.samples = 0
+        self._labels = {}  # 代码对象 -> 显示名称，避免每次采样都重新生成字符串
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+                self.samples += 1
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+        return label
+
+    def top(self, limit):
+        """返回 [(函数, 自身采样数, 累计采样数)]，按自身采样数排序（即真正消耗时间的函数）"""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        return [(label, count, total[label]) for label, count in own.most_common(limit)]
+
+    def write_folded(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+
+class MemoryTracer:
+    """用 tracemalloc 在指定位置拍快照，比较转换前后的内存分配"""
+
+    def __init__(self, frames=10):
+        self.frames = frames
+        self.snapshots = []  # [(标签, 快照, 当前内存, 峰值内存)]
+
+    def start(self):
+        import tracemalloc
+        tracemalloc.start(self.frames)
+        self.snapshot('开始')
+
+    def snapshot(self, label):
+        import tracemalloc
+        current, peak = tracemalloc.get_traced_memory()
+        # 不统计剖析工具自身的分配
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+        self.snapshots.append((label, snapshot, current, peak))
+
+    def stop(self):
+        import tracemalloc
+        self.snapshot('结束')
+        tracemalloc.stop()
+
+    def report(self, limit):
+        """生成文本报告：各快照的内存占用，以及最后一次快照相对第一次转换前快照新增最多的代码行"""
+        lines = ['快照              当前          峰值']
+        for label, _, current, peak in self.snapshots:
+            lines.append(f'{label:<12}  {current / 1024 / 1024:8.1f} MB  {peak / 1024 / 1024:8.1f} MB')
+        # 与转换前的快照比较；没有经过转换（例如没有新文章）时与开始时比较
+        labels = [label for label, *_ in self.snapshots]
+        base = self.snapshots[labels.index('转换前')] if '转换前' in labels else self.snapshots[0]
+        after = self.snapshots[labels.index('转换后')] if '转换后' in labels else self.snapshots[-1]
+        lines.append('')
+        lines.append(f'{base[0]} → {after[0]} 新增内存最多的代码行：')
+        for stat in after[1].compare_to(base[1], 'lineno')[:limit]:
+            lines.append(f'  {stat}')
+        return '\n'.join(lines) + '\n'
+
+
+class Profiler:
+    """一次剖析会话：run 执行被剖析的函数，save 把结果保存到 EPUB 旁边并打印摘要"""
+
+    def __init__(self, mode=None, trace_memory=False, top=25):
+        self.mode = mode
+        self.trace_memory = trace_memory
+        self.top = top
+        self._profile = None
+        self._thread_profiles = []
+        self._sampler = None
+        self._memory = None
+        self.elapsed = 0.0
+
+    def _profile_thread(self, *args):
+        """threading.setprofile 钩子：在每个新线程中启动单独的 cProfile"""
+        import cProfile
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Python 3.12 起只能有一个活动的 cProfile
+            return
+        self._thread_profiles.append(profile)
+
+    def start(self):
+        global _memory_tracer
+        if self.trace_memory:
+            self._memory = MemoryTracer()
+            self._memory.start()
+            _memory_tracer = self._memory
+        if self.mode == 'cprofile':
+            import cProfile
+            self._profile = cProfile.Profile()
+            threading.setprofile(self._profile_thread)
+            self._profile.enable()
+        elif self.mode == 'sample':
+            self._sampler = StackSampler()
+            self._sampler.start()
+        self._start = time.monotonic()
+
+    def stop(self):
+        global _memory_tracer
+        self.elapsed = time.monotonic() - self._start
+        if self._profile is not None:
+            self._profile.disable()
+            threading.setprofile(None)
+        if self._sampler is not None:
+            self._sampler.stop()
+        if self._memory is not None:
+            _memory_tracer = None
+            self._memory.stop()
+
+    def run(self, func, *args, **kwargs):
+        """在剖析下执行 func，返回它的结果"""
+        self.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.stop()
+
+    def save(self, epub_files=None):
+        """保存剖析结果并打印摘要
+
+        Args:
+            epub_files: 本次生成的 EPUB，结果保存在第一个 EPUB 旁边；没有生成时保存在当前目录
+        """
+        if epub_files:
+            base = os.path.splitext(epub_files[0])[0]
+        else:
+            base = datetime.now().strftime('profile_%Y%m%d_%H%M%S')
+
+        if self._profile is not None:
+            import pstats
+            path = base + '.prof'
+            stats = pstats.Stats(self._profile)
+            for profile in self._thread_profiles:
+                try:
+                    stats.add(profile)
+                except (TypeError, ValueError):
+                    pass
+            stats.dump_stats(path)
+            threads = f"，包括 {len(self._thread_profiles)} 个线程" if self._thread_profiles else ''
+            print(f"\n🔬 cProfile 结果已保存到 {path}（用时 {self.elapsed:.1f} 秒{threads}），累计耗时最多的函数：")
+            stats.sort_stats('cumulative').print_stats(self.top)
+
+        if self._sampler is not None:
+            path = base + '.stacks.txt'
+            self._sampler.write_folded(path)
+            print(f"\n🔬 采样结果已保存到 {path}（{self._sampler.samples} 个样本，可用 speedscope 或 flamegraph.pl 查看）")
+            print("   自身%   累计%  函数")
+            samples = max(1, self._sampler.samples)
+            for label, own, total in self._sampler.top(self.top):
+                print(f"  {own * 100 / samples:6.1f}  {total * 100 / samples:6.1f}  {label}")
+
+        if self._memory is not None:
+            path = base + '.memory.txt'
+            report = self._memory.report(self.top)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(report)
+            print(f"\n🧠 内存快照已保存到 {path}")
+            print(report)
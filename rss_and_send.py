@@ -5,31 +5,67 @@
 
 import os
 import sys
+import glob
+import signal
 import argparse
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # 导入主程序和发送模块
-from main import main as generate_epub
-from send_to_kindle import load_email_config, send_to_kindle, get_latest_epub
+import metrics
+import profiling
+from main import build_deliveries, mark_delivered, load_config
+from send_to_kindle import load_email_config, send_to_kindle, get_latest_epubs, KindleSender
 
-def main():
-    """主函数：生成并发送"""
-    parser = argparse.ArgumentParser(description='生成RSS EPUB并发送到Kindle')
-    parser.add_argument('--no-send', action='store_true', help='仅生成EPUB，不发送邮件')
-    parser.add_argument('--send-only', action='store_true', help='仅发送最新的EPUB，不生成新的')
-    args = parser.parse_args()
+def deliver(delivery, email_config, rss_config):
+    """把一个投递目标的全部分卷发送到它的 Kindle 邮箱（共用一个 SMTP 会话）
     
+    Args:
+        delivery: build_deliveries 返回的投递目标
+        email_config: 邮件配置
+        rss_config: 已加载的 config.yaml，用于记录已投递的文章
+    
+    Returns:
+        发送失败的文件列表
+    """
+    config = dict(email_config)
+    if delivery.get('kindle_email'):
+        config['kindle_email'] = delivery['kindle_email']
+    
+    # 逐卷发送邮件，每卷成功后才把其中的文章记为已投递
+    failed = []
+    with KindleSender(config) as sender:
+        for epub_file in delivery['files']:
+            if send_to_kindle(epub_file, config, sender):
+                metrics.incr('emails_sent')
+                mark_delivered(epub_file, rss_config)
+            else:
+                metrics.incr('emails_failed')
+                failed.append(epub_file)
+    return failed
+
+def run_once(args):
+    """生成并发送一次，返回退出码"""
+    deliveries = []
     if not args.send_only:
         # 生成EPUB
         print("=" * 50)
         print("📖 开始生成EPUB...")
         print("=" * 50)
+        # --profile / --trace-memory 只剖析生成过程，不包括邮件发送
+        profiler = profiling.from_args(args)
         try:
-            generate_epub()
-            print("✅ EPUB生成成功！")
+            deliveries = profiler.run(build_deliveries) if profiler else build_deliveries()
         except Exception as e:
             print(f"❌ EPUB生成失败: {e}")
             return 1
+        if profiler:
+            profiler.save([epub_file for delivery in deliveries for epub_file in delivery['files']])
+        if not deliveries:
+            print("📭 没有新文章，本次不生成也不发送")
+            return 0
+        print("✅ EPUB生成成功！")
     
     if not args.no_send:
         # 发送到Kindle
@@ -44,20 +80,29 @@ def main():
             print("   提示：创建 email_config.yaml 来启用邮件发送功能")
             return 0
         
-        # 获取最新的EPUB文件
-        epub_file = get_latest_epub()
-        if not epub_file:
-            print("❌ 没有找到EPUB文件可以发送")
-            return 1
+        # 仅发送模式下使用最新的EPUB文件，发送到邮件配置中的地址
+        if not deliveries:
+            epub_files = get_latest_epubs()
+            if not epub_files:
+                print("❌ 没有找到EPUB文件可以发送")
+                return 1
+            deliveries = [{'name': None, 'kindle_email': None, 'files': epub_files}]
         
-        # 发送邮件
-        if send_to_kindle(epub_file, config):
+        # 多个投递目标并行发送，config.yaml 只读取一次
+        rss_config = load_config()
+        with metrics.stage('send_email'), ThreadPoolExecutor(max_workers=len(deliveries)) as executor:
+            failed = [epub_file for files in executor.map(lambda d: deliver(d, config, rss_config), deliveries)
+                      for epub_file in files]
+        # 重新写入运行指标，加上发送阶段
+        metrics.write_reports(rss_config.get('Settings') or {})
+        
+        if not failed:
             print("\n" + "=" * 50)
             print("🎉 完成！EPUB已生成并发送到Kindle")
             print("=" * 50)
             return 0
         else:
-            print("⚠️  EPUB已生成但邮件发送失败")
+            print(f"⚠️  EPUB已生成但邮件发送失败: {', '.join(failed)}")
             return 1
     
     print("\n" + "=" * 50)
@@ -65,5 +110,104 @@ def main():
     print("=" * 50)
     return 0
 
+class Shutdown(BaseException):
+    """常驻模式在运行中收到 SIGTERM / SIGINT 时在主线程抛出
+    
+    继承 BaseException，不会被流程中的 except Exception 吞掉，
+    沿途的清理代码会删除写了一半的 EPUB 和临时文件。
+    """
+
+def remove_partial_epubs():
+    """删除上次被强制结束时留下的未完成 EPUB（*.epub.part）"""
+    for path in glob.glob('*.epub.part'):
+        try:
+            os.remove(path)
+            print(f"🧹 已删除未完成的EPUB: {path}")
+        except OSError:
+            pass
+
+def load_schedule():
+    """读取配置中的 schedule 和 schedule_timezone，返回 (cron 表达式列表, 时区)"""
+    from cron import parse_schedules
+    settings = load_config().get('Settings') or {}
+    timezone = None
+    if settings.get('schedule_timezone'):
+        from zoneinfo import ZoneInfo
+        timezone = ZoneInfo(settings['schedule_timezone'])
+    return parse_schedules(settings.get('schedule')), timezone
+
+def run_daemon(args):
+    """常驻模式：按配置的 cron 表达式反复生成并发送
+    
+    进程常驻期间 HTTP 连接池、feed 状态和缓存保持在内存中，每次运行不需要重新建立。
+    每次运行前重新读取配置，修改 feed 或 schedule 后不需要重启。
+    收到 SIGTERM / SIGINT 时，空闲则立即退出；正在运行则中断本次运行，清理未完成的文件后退出。
+    """
+    from cron import next_run
+    stop = threading.Event()
+    running = False
+    
+    def handle_signal(signum, frame):
+        nonlocal running
+        print(f"\n🛑 收到 {signal.Signals(signum).name}，正在退出...")
+        stop.set()
+        if running:
+            # 只抛出一次，避免再次收到信号时打断清理代码
+            running = False
+            raise Shutdown()
+    
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    remove_partial_epubs()
+    
+    while not stop.is_set():
+        try:
+            schedules, timezone = load_schedule()
+        except Exception as e:
+            print(f"❌ 读取 schedule 失败: {e}")
+            return 1
+        if not schedules:
+            print("❌ 常驻模式需要在 config.yaml 的 Settings 中配置 schedule（cron 表达式）")
+            return 1
+        
+        next_time = next_run(schedules, datetime.now(timezone))
+        print(f"⏰ 下次运行时间：{next_time:%Y-%m-%d %H:%M}")
+        # 分段等待并重新计算剩余时间，系统休眠或调整时钟后也能按时运行
+        while not stop.is_set():
+            remaining = (next_time - datetime.now(timezone)).total_seconds()
+            if remaining <= 0:
+                break
+            stop.wait(min(remaining, 60))
+        if stop.is_set():
+            break
+        
+        running = True
+        try:
+            run_once(args)
+        except Shutdown:
+            break
+        except Exception as e:
+            # 单次运行失败不影响之后的运行
+            print(f"❌ 本次运行失败: {e}")
+        finally:
+            running = False
+    
+    print("👋 常驻模式已退出")
+    return 0
+
+def main():
+    """主函数：生成并发送"""
+    parser = argparse.ArgumentParser(description='生成RSS EPUB并发送到Kindle')
+    parser.add_argument('--no-send', action='store_true', help='仅生成EPUB，不发送邮件')
+    parser.add_argument('--send-only', action='store_true', help='仅发送最新的EPUB（包括同一次生成的全部分卷），不生成新的')
+    parser.add_argument('--daemon', action='store_true',
+                        help='常驻运行，按 config.yaml 中 schedule 配置的 cron 表达式定时生成并发送')
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    if args.daemon and args.send_only:
+        parser.error('--daemon 不能与 --send-only 同时使用')
+    
+    return run_daemon(args) if args.daemon else run_once(args)
+
 if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file
@@ -4,13 +4,14 @@
 """
 
 import os
+import re
 import glob
+import base64
 import smtplib
 import yaml
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
-from email import encoders
+from email.message import EmailMessage
+from email.policy import SMTP
+from email.utils import formatdate, make_msgid
 from datetime import datetime
 import argparse
 
@@ -76,41 +77,107 @@ def get_latest_epub():
     
     return latest_file
 
-def send_to_kindle(epub_file, config):
-    """发送EPUB文件到Kindle邮箱"""
-    try:
-        # 创建邮件
-        msg = MIMEMultipart()
-        msg['From'] = config['sender_email']
-        msg['To'] = config['kindle_email']
-        msg['Subject'] = config.get('subject', 'RSS Feed')
-        
-        # 添加邮件正文
-        body = config.get('body', f'RSS订阅推送 - {datetime.now().strftime("%Y-%m-%d %H:%M")}')
-        msg.attach(MIMEText(body, 'plain', 'utf-8'))
-        
-        # 添加EPUB附件
-        with open(epub_file, 'rb') as f:
-            # 使用正确的MIME类型
-            attachment = MIMEBase('application', 'octet-stream')
-            attachment.set_payload(f.read())
-            encoders.encode_base64(attachment)
-            
-            # 确保文件名正确编码
-            filename = os.path.basename(epub_file)
-            # 添加Content-Type头，明确指定文件类型
-            attachment.add_header('Content-Type', 'application/epub+zip', name=filename)
-            # 使用filename参数而不是简单的字符串格式化
-            attachment.add_header(
-                'Content-Disposition',
-                'attachment',
-                filename=filename
-            )
-            msg.attach(attachment)
-        
-        # 连接SMTP服务器并发送
-        print(f"📧 正在发送邮件到 {config['kindle_email']}...")
-        
+def get_latest_epubs():
+    """获取最新一次生成的全部EPUB文件（分卷时返回所有 …_partN.epub，按卷号排序）"""
+    latest_file = get_latest_epub()
+    if not latest_file:
+        return []
+    match = re.match(r'^(.*)_part\d+\.epub$', latest_file)
+    if not match:
+        return [latest_file]
+    
+    pattern = re.compile(re.escape(match.group(1)) + r'_part(\d+)\.epub$')
+    parts = [(int(m.group(1)), name) for name in glob.glob('*.epub') for m in [pattern.match(name)] if m]
+    volumes = [name for _, name in sorted(parts)]
+    print(f"📚 共 {len(volumes)} 卷: {', '.join(volumes)}")
+    return volumes
+
+# 每次读取 57 的整数倍字节，编码后正好是若干个 76 字符的 base64 行
+ENCODE_CHUNK_BYTES = 57 * 1024
+# 附件内容在邮件骨架中的占位符，发送时替换为流式编码的文件内容
+ATTACHMENT_MARKER = 'KINDLERSS-ATTACHMENT-{}'
+
+def get_recipients(config):
+    """Kindle 邮箱，支持单个地址、逗号分隔的多个地址或列表"""
+    recipients = config['kindle_email']
+    if isinstance(recipients, str):
+        recipients = recipients.split(',')
+    return [address.strip() for address in recipients if address and address.strip()]
+
+def build_message_skeleton(epub_files, config, recipients):
+    """用 email 库生成邮件头、正文和附件头，附件内容留作占位符
+    
+    Returns:
+        按占位符切开的字节串列表，长度为附件数量 + 1
+    """
+    msg = EmailMessage(policy=SMTP)
+    msg['From'] = config['sender_email']
+    msg['To'] = ', '.join(recipients)
+    msg['Subject'] = config.get('subject', 'RSS Feed')
+    msg['Date'] = formatdate(localtime=True)
+    msg['Message-ID'] = make_msgid()
+    
+    # 添加邮件正文
+    body = config.get('body', f'RSS订阅推送 - {datetime.now().strftime("%Y-%m-%d %H:%M")}')
+    msg.set_content(body, cte='base64')
+    msg.make_mixed()
+    
+    for idx, epub_file in enumerate(epub_files):
+        # 确保文件名正确编码，明确指定文件类型
+        filename = os.path.basename(epub_file)
+        attachment = EmailMessage(policy=SMTP)
+        attachment['Content-Type'] = 'application/epub+zip'
+        attachment.set_param('name', filename)
+        attachment['Content-Transfer-Encoding'] = 'base64'
+        attachment.add_header('Content-Disposition', 'attachment', filename=filename)
+        attachment.set_payload(ATTACHMENT_MARKER.format(idx))
+        msg.attach(attachment)
+    
+    data = msg.as_bytes()
+    pieces = []
+    for idx in range(len(epub_files)):
+        head, data = data.split(ATTACHMENT_MARKER.format(idx).encode('ascii'), 1)
+        pieces.append(head)
+    pieces.append(data)
+    return pieces
+
+def encoded_size(path):
+    """文件经 base64 编码（每行 76 字符加 CRLF）后的字节数"""
+    size = os.path.getsize(path)
+    lines = (size + 56) // 57
+    return (size + 2) // 3 * 4 + lines * 2
+
+def stream_base64(path):
+    """分块读取文件并编码为 base64 行，内存中只保留一个块"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(ENCODE_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield base64.encodebytes(chunk).replace(b'\n', b'\r\n')
+
+class KindleSender:
+    """复用同一个已登录的 SMTP 会话发送多封邮件（例如多个分卷或多个收件人）
+    
+    附件从磁盘分块读取并流式编码后直接写入 SMTP 连接，不在内存中构建完整邮件。
+    """
+    
+    def __init__(self, config):
+        self.config = config
+        self.server = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+    
+    def connect(self):
+        """连接SMTP服务器并登录，已连接时直接返回"""
+        if self.server is not None:
+            return self.server
+        config = self.config
         # 根据端口选择加密方式
         if config['smtp_port'] == 587:
             # STARTTLS
@@ -122,10 +189,104 @@ def send_to_kindle(epub_file, config):
         else:
             # 无加密
             server = smtplib.SMTP(config['smtp_server'], config['smtp_port'])
-        
         server.login(config['sender_email'], config['sender_password'])
-        server.send_message(msg)
-        server.quit()
+        self.server = server
+        return server
+    
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except smtplib.SMTPException:
+                self.server.close()
+            self.server = None
+    
+    def abort(self):
+        """不发送 QUIT 直接断开连接（会话状态未知时使用），下次发送时重新连接"""
+        if self.server is not None:
+            try:
+                self.server.close()
+            finally:
+                self.server = None
+    
+    def send(self, epub_files, recipients=None):
+        """把一个或多个EPUB作为附件发送到一封邮件中，连接断开时重连一次"""
+        recipients = recipients or get_recipients(self.config)
+        try:
+            self._send(epub_files, recipients)
+        except smtplib.SMTPServerDisconnected:
+            self.server = None
+            self._send(epub_files, recipients)
+    
+    def _send(self, epub_files, recipients):
+        server = self.connect()
+        pieces = build_message_skeleton(epub_files, self.config, recipients)
+        size = sum(len(piece) for piece in pieces) + sum(encoded_size(path) for path in epub_files)
+        
+        # 服务器支持 SIZE 扩展时先声明邮件大小，超出限制会在上传前被拒绝
+        server.ehlo_or_helo_if_needed()
+        options = [f'SIZE={size}'] if server.has_extn('size') else []
+        try:
+            refused = self._transaction(server, pieces, epub_files, recipients, options)
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            # 服务器明确拒绝，会话仍然可用，重置事务后下一封邮件可以继续使用
+            try:
+                server.rset()
+            except (smtplib.SMTPException, OSError):
+                self.abort()
+            raise
+        except BaseException:
+            # 写到一半（例如 DATA 阶段超时）的会话无法继续使用，
+            # 否则下一封邮件的内容会被当作这封邮件的一部分
+            self.abort()
+            raise
+        for address, (code, resp) in refused.items():
+            print(f"⚠️  收件人被拒绝 {address}: {code} {resp}")
+    
+    def _transaction(self, server, pieces, epub_files, recipients, options):
+        """MAIL / RCPT / DATA 事务，返回被拒绝的收件人 {地址: (代码, 回复)}"""
+        code, resp = server.mail(self.config['sender_email'], options)
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, resp, self.config['sender_email'])
+        refused = {}
+        for address in recipients:
+            code, resp = server.rcpt(address)
+            if code not in (250, 251):
+                refused[address] = (code, resp)
+        if len(refused) == len(recipients):
+            raise smtplib.SMTPRecipientsRefused(refused)
+        
+        code, resp = server.docmd('DATA')
+        if code != 354:
+            raise smtplib.SMTPDataError(code, resp)
+        # 邮件头和正文需要做点号转义；base64 内容不会以 “.” 开头，可以直接写入
+        for idx, piece in enumerate(pieces):
+            server.send(re.sub(rb'(?m)^\.', b'..', piece))
+            if idx < len(epub_files):
+                for block in stream_base64(epub_files[idx]):
+                    server.send(block)
+        server.send(b'\r\n.\r\n')
+        code, resp = server.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+        return refused
+
+def send_to_kindle(epub_file, config, sender=None):
+    """发送EPUB文件到Kindle邮箱
+    
+    Args:
+        epub_file: EPUB 文件路径
+        config: 邮件配置
+        sender: 可选的 KindleSender，多次发送时复用同一个 SMTP 会话
+    """
+    try:
+        # 连接SMTP服务器并发送
+        print(f"📧 正在发送邮件到 {', '.join(get_recipients(config))}: {os.path.basename(epub_file)}...")
+        if sender is not None:
+            sender.send([epub_file])
+        else:
+            with KindleSender(config) as own_sender:
+                own_sender.send([epub_file])
         
         print(f"✅ 邮件发送成功！")
         print(f"   请检查Kindle设备或邮箱确认接收")
@@ -154,15 +315,26 @@ def main():
         if not os.path.exists(args.file):
             print(f"❌ 指定的文件不存在: {args.file}")
             return
-        epub_file = args.file
-        print(f"📚 使用指定文件: {epub_file}")
+        epub_files = [args.file]
+        print(f"📚 使用指定文件: {args.file}")
     else:
-        epub_file = get_latest_epub()
-        if not epub_file:
+        epub_files = get_latest_epubs()
+        if not epub_files:
             return
     
-    # 发送邮件
-    send_to_kindle(epub_file, config)
+    # 与 rss_and_send 相同：每卷发送成功后把其中的文章记为已投递（增量模式），config.yaml 只读取一次
+    from main import load_config, mark_delivered
+    try:
+        rss_config = load_config()
+    except FileNotFoundError:
+        # 没有 RSS 配置时只发送，不记录
+        rss_config = {}
+    
+    # 发送邮件（分卷时逐卷发送，共用一个 SMTP 会话）
+    with KindleSender(config) as sender:
+        for epub_file in epub_files:
+            if send_to_kindle(epub_file, config, sender):
+                mark_delivered(epub_file, rss_config)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,120 @@
+"""
+EPUB 页面模板
+
+所有页面共用一个样式表（STYLESHEET_FILE），每卷只写入一次，页面中只有链接。
+模板在导入时编译一次；页面由片段列表拼接，插入的标题、feed 名称等文本都经过 XHTML 转义。
+文章正文等已经是 HTML 的内容原样插入。
+"""
+
+import re
+from html import escape, unescape
+from string import Template
+
+STYLESHEET_FILE = 'style.css'
+
+STYLESHEET = '''a { color: black; text-decoration: underline; }
+.nav { margin: 20px 0; padding: 10px; }
+.description-preview { color: #666; font-size: 0.9em; margin-left: 20px; margin-top: 5px; }
+img { page-break-inside: avoid; break-inside: avoid; display: block; max-width: 100%; height: auto; }
+figure { page-break-inside: avoid; break-inside: avoid; }
+p { orphans: 2; widows: 2; }
+ul.toc { margin: 30px auto; max-width: 600px; }
+ul.toc li { margin: 15px 0; }
+'''
+
+# 页面只需要 body，head（标题和样式表链接）由 StreamingEpubWriter 生成
+ARTICLE_PAGE = Template('''<html><body>
+<center><div class="nav">$navigation</div></center>
+$body
+</body></html>''')
+
+ARTICLE_BODY = Template('''<hr/>
+<center><h1>$title</h1></center>
+<p><small>$meta</small></p>
+<br/>
+<blockquote>
+$content
+</blockquote>
+''')
+
+INDEX_PAGE = Template('''<html><body>
+<center><div class="nav">$navigation</div></center>
+<hr/>
+<center>
+<h1>$title</h1>
+$subtitle
+</center>
+<ul>
+$items
+</ul>
+<hr/>
+<center><div class="nav">$navigation</div></center>
+</body></html>''')
+
+TOC_PAGE = Template('''<html><body>
+<center>
+<h1>$title</h1>
+<p>$date</p>
+</center>
+<br/>
+<ul class="toc">
+$items
+</ul>
+</body></html>''')
+
+INDEX_ITEM = Template('<li><a href="$href">$title</a>$preview</li>\n')
+DUPLICATE_ITEM = Template('<li><a href="$href">$title</a><div class="description-preview">已收录于「$feed」</div></li>\n')
+PREVIEW = Template('<div class="description-preview">$text</div>')
+SUBTITLE = Template('<p><i>$text</i></p>')
+TOC_ITEM = Template('<li><a href="$href">$title</a></li>\n')
+IMAGE = Template('<p><img src="$src" alt="文章配图"/></p>\n')
+EXTRA_IMAGES_HEADER = '<br/><h2>▣ 附加图片</h2>\n'
+
+TAG_RE = re.compile(r'<[^>]+>')
+
+
+def text(value):
+    """转义插入页面的纯文本"""
+    return escape(str(value or ''))
+
+
+def plain_text(html_content, limit=None):
+    """去掉 HTML 标签和实体，返回纯文本（未转义），超出 limit 时截断并加上 [...]"""
+    value = unescape(TAG_RE.sub('', html_content or '')).strip()
+    if limit and len(value) > limit:
+        value = value[:limit] + '[...]'
+    return value
+
+
+def render_index_item(href, title, preview=''):
+    return INDEX_ITEM.substitute(href=text(href), title=text(title),
+                                 preview=PREVIEW.substitute(text=text(preview)) if preview else '')
+
+
+def render_duplicate_item(href, title, feed_name):
+    return DUPLICATE_ITEM.substitute(href=text(href), title=text(title), feed=text(feed_name))
+
+
+def render_article_body(title, meta, content, extra_images=()):
+    """文章正文部分（不含导航栏），extra_images 为附加图片的地址"""
+    parts = [ARTICLE_BODY.substitute(title=text(title), meta=text(meta), content=content)]
+    if extra_images:
+        parts.append(EXTRA_IMAGES_HEADER)
+        parts.extend(IMAGE.substitute(src=text(src)) for src in extra_images)
+    return ''.join(parts)
+
+
+def render_article_page(navigation, body):
+    return ARTICLE_PAGE.substitute(navigation=navigation, body=body)
+
+
+def render_index_page(title, subtitle, navigation, items):
+    """feed 索引页，items 为 render_index_item 生成的条目列表"""
+    return INDEX_PAGE.substitute(title=text(title), navigation=navigation, items=''.join(items),
+                                 subtitle=SUBTITLE.substitute(text=text(subtitle)) if subtitle else '')
+
+
+def render_toc_page(title, date, feeds):
+    """主目录页，feeds 为 [(feed 名称, 索引页文件名)]"""
+    items = ''.join(TOC_ITEM.substitute(href=text(href), title=text(name)) for name, href in feeds)
+    return TOC_PAGE.substitute(title=text(title), date=text(date), items=items)